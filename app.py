@@ -12,6 +12,8 @@ from process_karvy_statement import process_karvy_statement
 import requests, re
 from bs4 import BeautifulSoup
 from replay_sells import replay_sells
+from services.investments import record_investments, ensure_ledgers
+from daily_valuation import daily_series
 from flask_login import login_required, login_user, logout_user, current_user
 from flask_mail import Message, Mail
 from itsdangerous import URLSafeTimedSerializer
@@ -485,6 +487,7 @@ def confirm_upload():
         return redirect(url_for('upload_center'))
 
     inserted = 0
+    new_investments = []
 
     for raw in staging_rows:
         fund = Fund.query.filter_by(isin=raw.isin).first()
@@ -504,8 +507,15 @@ def confirm_upload():
             registrar=fund.registrar
         )
         db.session.add(inv)
+        new_investments.append(inv)
         inserted += 1
 
+    # Keep the FIFO lot ledger current for the funds touched
+    db.session.flush()
+    record_investments(db.session, new_investments)
+    # Self-heal any of the user's ledgers still out of step with history
+    ensure_ledgers(db.session, [current_user.id])
+
     # Clear staging for this user
     StagingInvestment.query.filter_by(
         user_id=current_user.id
@@ -671,6 +681,19 @@ def portfolio_history_data():
     if not dashboard_type:
         return jsonify({"error": "dashboard_type is required"}), 400
 
+    # Daily points from portfolio_daily_value (DAILY_VALUATION mode)
+    if request.args.get('granularity') == 'daily':
+        years = request.args.get('years', type=int)
+        start = date.today().replace(year=date.today().year - years) if years else None
+        user_ids = [user_id]
+        if dashboard_type == 'family':
+            # Summed over the user's family members, as /family-portfolio-history does
+            user = User.query.get(user_id)
+            if user is None or not user.family_id:
+                return jsonify([])
+            user_ids = [u.id for u in User.query.filter_by(family_id=user.family_id).all()]
+        return jsonify(daily_series(user_ids, start=start))
+
     snapshots = (
         PortfolioSnapshot.query
         .filter_by(user_id=user_id, dashboard_type=dashboard_type)
@@ -681,7 +704,8 @@ def portfolio_history_data():
     data = [
         {
             "date": s.snapshot_date.strftime("%Y-%m-%d"),
-            "value": float(s.portfolio_value)
+            "value": float(s.portfolio_value),
+            "xirr": s.xirr
         }
         for s in snapshots
     ]
@@ -0,0 +1,24 @@
+# backfill_latest_nav.py
+#
+# Set Fund.latest_nav / Fund.latest_nav_date from FundNAVHistory for every
+# fund. Run once after the latest_nav_date migration; safe to re-run.
+
+from models import db
+from services.latest_navs import refresh_latest_navs
+from app import app
+
+
+def backfill_latest_nav():
+    print("[BACKFILL] Setting latest NAV on fund rows...")
+    try:
+        changed = refresh_latest_navs(db.session)
+        db.session.commit()
+        print(f"[BACKFILL] Complete. Funds updated: {changed}")
+    except Exception as e:
+        db.session.rollback()
+        print(f"[BACKFILL] Error committing changes: {e}")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        backfill_latest_nav()
@@ -0,0 +1,133 @@
+# bench_fifo.py
+#
+# Compare the fixed-point deque/__slots__ FIFO engine in
+# utils.calculate_fifo_returns against the previous list-of-dicts + pop(0)
+# implementation, run on floats and on Decimal arithmetic, using synthetic
+# SIP-heavy folios whose units/amounts are Decimals like ORM rows.
+#
+#   python bench_fifo.py [n_transactions ...]   (default: 1000 10000)
+
+import sys
+import time
+import random
+import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from utils import calculate_fifo_returns
+from money import to_fixed_point_txns
+
+
+def legacy_calculate_fifo_returns(transactions, latest_nav, today, num=float):
+    """The pre-deque engine, kept verbatim (minus XIRR) as the baseline.
+    num=Decimal runs the same matching in Decimal arithmetic."""
+    txns = sorted(transactions, key=lambda t: t.date)
+
+    buy_lots = []
+    cash_flows = []
+
+    for t in txns:
+        if t.transaction_type.lower() == 'buy':
+            buy_lots.append({
+                'date': t.date,
+                'units': num(t.units or 0),
+                'cost': num(t.amount or 0)
+            })
+            cash_flows.append((t.date, -num(t.amount or 0)))
+
+        elif t.transaction_type.lower() == 'sell':
+            units_to_sell = abs(num(t.units or 0))
+            cash_flows.append((t.date, abs(num(t.amount or 0))))
+
+            while units_to_sell > 0 and buy_lots:
+                lot = buy_lots[0]
+                if lot['units'] <= 0:
+                    buy_lots.pop(0)
+                    continue
+
+                matched_units = min(lot['units'], units_to_sell)
+                proportion = matched_units / lot['units']
+                lot['cost'] -= lot['cost'] * proportion
+                lot['units'] -= matched_units
+                units_to_sell -= matched_units
+
+                if lot['units'] <= 1e-9:
+                    buy_lots.pop(0)
+
+    remaining_units = sum(lot['units'] for lot in buy_lots)
+    remaining_cost = sum(lot['cost'] for lot in buy_lots)
+    return {
+        "remaining_units": remaining_units,
+        "cost_value": remaining_cost,
+        "current_value": remaining_units * num(latest_nav),
+        "remaining_lots": buy_lots,
+    }
+
+
+def make_folio(n, sell_fraction=(0.05, 0.3), seed=7):
+    """SIP-style buys with a redemption roughly every fifth transaction
+    (every hundredth for lump redemptions)."""
+    rng = random.Random(seed)
+    day = datetime.date(2000, 1, 1)
+    nav = 10.0
+    held = 0.0
+    txns = []
+    for _ in range(n):
+        day += datetime.timedelta(days=1)
+        nav *= 1 + rng.gauss(0.0003, 0.01)
+        sell_odds = 0.01 if sell_fraction[0] >= 0.3 else 0.2
+        if held > 0 and rng.random() < sell_odds:
+            units = round(held * rng.uniform(*sell_fraction), 6)
+            held -= units
+            txns.append(SimpleNamespace(date=day, transaction_type="sell",
+                                        units=Decimal(f"{-units:.6f}"),
+                                        amount=Decimal(f"{-units * nav:.2f}")))
+        else:
+            amount = rng.choice([1000, 2500, 5000])
+            units = round(amount / nav, 6)
+            held += units
+            txns.append(SimpleNamespace(date=day, transaction_type="buy",
+                                        units=Decimal(f"{units:.6f}"),
+                                        amount=Decimal(amount)))
+    return txns, Decimal(f"{nav:.8f}"), day
+
+
+def best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000]
+
+    profiles = {
+        "large redemptions": (0.05, 0.3),
+        "small redemptions": (0.001, 0.01),  # many lots stay open
+        "rare lump redemptions": (0.3, 0.6),  # long lot queues, big sweeps
+    }
+
+    for label, sell_fraction in profiles.items():
+        print(f"--- {label} ---")
+        for n in sizes:
+            txns, nav, today = make_folio(n, sell_fraction)
+            fixed = to_fixed_point_txns(txns)  # what callers do once at load time
+
+            t_float, old = best_of(lambda: legacy_calculate_fifo_returns(txns, nav, today))
+            t_dec, _ = best_of(lambda: legacy_calculate_fifo_returns(txns, nav, today, num=Decimal))
+            t_new, new = best_of(lambda: calculate_fifo_returns(txns, nav, today=today, with_xirr=False))
+            t_replay, replay = best_of(lambda: calculate_fifo_returns(fixed, nav, today=today, with_xirr=False))
+
+            assert len(old["remaining_lots"]) == len(new["remaining_lots"])
+            assert abs(old["remaining_units"] - new["remaining_units"]) < 1e-6
+            assert abs(old["cost_value"] - new["cost_value"]) < 0.01 * len(new["remaining_lots"]) + 0.01
+            assert replay["cost_value_paise"] == new["cost_value_paise"]
+
+            print(f"{n:>7} txns | float list+pop(0) {t_float * 1000:7.2f} ms | "
+                  f"Decimal {t_dec * 1000:7.2f} ms | "
+                  f"fixed-point {t_new * 1000:7.2f} ms | "
+                  f"fixed-point pre-converted {t_replay * 1000:7.2f} ms "
+                  f"({t_float / t_replay:4.2f}x float) | open lots {len(new['remaining_lots'])}")
@@ -0,0 +1,156 @@
+# bench_holdings.py
+#
+# Compare utils.get_portfolio_holdings (one statement: net units joined to
+# the latest NAV per ISIN and to Fund) against the previous per-ISIN lookup
+# loop, on an in-memory SQLite database with synthetic holdings. Prints the
+# SQL statements each version issues and its time; the set-based version
+# stays at one statement however many ISINs are held.
+#
+#   python bench_holdings.py [n_holdings ...]   (default: 10 100 500)
+
+import sys
+import time
+import random
+import datetime
+from decimal import Decimal
+
+from flask import Flask
+from sqlalchemy import event, case, func
+
+from db_config import db
+from models import User, Fund, FundNAVHistory, Investment
+from utils import get_portfolio_holdings
+
+
+def legacy_get_portfolio_holdings(db, user_id):
+    """The previous implementation, kept verbatim as the baseline."""
+    holdings = (
+        db.session.query(
+            Investment.isin,
+            func.sum(
+                case(
+                    (Investment.transaction_type.ilike('buy'), Investment.units),
+                    else_=-Investment.units
+                )
+            ).label('net_units')
+        )
+        .filter(Investment.user_id == user_id)
+        .group_by(Investment.isin)
+        .all()
+    )
+
+    results = []
+    portfolio_total = 0
+
+    for isin, net_units in holdings:
+        if not isin or not net_units or net_units <= 0:
+            continue
+
+        latest_nav_lookup = (
+            db.session.query(FundNAVHistory.nav_value, FundNAVHistory.nav_date)
+            .filter(FundNAVHistory.isin == isin)
+            .order_by(FundNAVHistory.nav_date.desc())
+            .first()
+        )
+
+        if not latest_nav_lookup:
+            continue
+
+        latest_nav, nav_date = latest_nav_lookup
+        market_value = float(net_units) * float(latest_nav)
+        portfolio_total += market_value
+
+        fund = Fund.query.filter_by(isin=isin).first()
+        fund_name = fund.name if fund else isin
+
+        results.append({
+            "isin": isin,
+            "fund_name": fund_name,
+            "net_units": float(net_units),
+            "latest_nav": float(latest_nav),
+            "nav_date": nav_date,
+            "market_value": market_value,
+            "pct_of_portfolio": 0.0
+        })
+
+    if portfolio_total > 0:
+        for r in results:
+            r["pct_of_portfolio"] = round((r["market_value"] / portfolio_total) * 100, 2)
+
+    return results
+
+
+def seed(n_holdings, navs_per_fund=120, seed=11):
+    """One user holding n_holdings funds (a few fully redeemed) with semi-monthly NAVs."""
+    rng = random.Random(seed)
+    user = User(name="bench", email="bench@example.com")
+    user.set_password("bench")
+    db.session.add(user)
+    db.session.flush()
+
+    start = datetime.date(2015, 1, 15)
+    for i in range(n_holdings):
+        isin = f"INFB{i:08d}"
+        fund = Fund(name=f"Bench Fund {i} Direct Growth", isin=isin)
+        db.session.add(fund)
+        db.session.flush()
+
+        nav = 10.0
+        for k in range(navs_per_fund):
+            nav *= 1 + rng.gauss(0.004, 0.03)
+            db.session.add(FundNAVHistory(
+                fund_id=fund.id, nav_date=start + datetime.timedelta(days=15 * k),
+                nav_value=Decimal(f"{nav:.4f}"), isin=isin, nav_type="growth",
+            ))
+
+        units = Decimal(f"{rng.uniform(10, 1000):.6f}")
+        db.session.add(Investment(user_id=user.id, fund_id=fund.id, isin=isin, transaction_type="buy",
+                                  amount=Decimal("10000.00"), units=units, date=start))
+        sold = units if i % 10 == 0 else (units / 3).quantize(Decimal("0.000001"))
+        db.session.add(Investment(user_id=user.id, fund_id=fund.id, isin=isin, transaction_type="sell",
+                                  amount=Decimal("3000.00"), units=sold, date=start + datetime.timedelta(days=400)))
+    db.session.commit()
+    return user.id
+
+
+def counted(fn):
+    """Run fn, returning (seconds, statements issued, result)."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return elapsed, len(statements), result
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10, 100, 500]
+
+    for n in sizes:
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        db.init_app(app)
+
+        with app.app_context():
+            db.create_all()
+            user_id = seed(n)
+
+            t_old, q_old, old = counted(lambda: legacy_get_portfolio_holdings(db, user_id))
+            db.session.expunge_all()
+            t_new, q_new, new = counted(lambda: get_portfolio_holdings(db, user_id))
+
+            assert sorted(old, key=lambda r: r["isin"]) == new
+            print(f"{n:>5} holdings | per-ISIN loop {q_old:5d} queries {t_old * 1000:8.2f} ms | "
+                  f"set-based {q_new:2d} queries {t_new * 1000:7.2f} ms | rows {len(new)}")
+
+            db.session.remove()
+            db.drop_all()
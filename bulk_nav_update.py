@@ -5,6 +5,8 @@ from datetime import datetime
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
 from models import Fund, FundNAVHistory  # adjust import path if needed
+from services.latest_navs import note_nav, latest_nav_cache
+from nav_store import sync_nav_store
 
 # ===== Database setup =====
 # Replace with your actual DB URI
@@ -33,6 +35,7 @@ def update_nav_from_excel(file_path: str):
 
     session = Session()
     updates, inserts, skipped = 0, 0, 0
+    fund_ids = set()
 
     try:
         for _, row in df.iterrows():
@@ -68,7 +71,12 @@ def update_nav_from_excel(file_path: str):
                 session.add(new_nav)
                 inserts += 1
 
+            note_nav(fund, nav_date, nav_value)
+            fund_ids.add(fund.id)
+
         session.commit()
+        latest_nav_cache.invalidate()
+        sync_nav_store(session, fund_ids)
         print(f"[{datetime.now()}] NAV update complete: {inserts} inserted, {updates} updated, {skipped} skipped.")
 
     except Exception as e:
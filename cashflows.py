@@ -0,0 +1,177 @@
+# cashflows.py
+#
+# One representation for investor cash flows (buys negative, sells and
+# terminal values positive), shared by the FIFO engine, the XIRR solvers,
+# the dashboards and the snapshot generators. Flows are held as two
+# parallel NumPy arrays kept in date order, so the solvers can use them as
+# they are, with no per-call parsing or sorting.
+
+import datetime
+import hashlib
+
+import numpy as np
+
+
+def _to_ordinal(value):
+    """Day ordinal for a date/datetime/'YYYY-MM-DD' string, or None."""
+    if isinstance(value, datetime.datetime):
+        return value.date().toordinal()
+    if isinstance(value, datetime.date):
+        return value.toordinal()
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.strptime(value, "%Y-%m-%d").date().toordinal()
+        except ValueError:
+            return None
+    return None
+
+
+class CashFlowSeries:
+    """
+    Date-ordered investor cash flows as parallel arrays:
+        ordinals : int64 day ordinals (datetime.date.toordinal())
+        amounts  : float64 rupees
+
+    Same-day flows keep the order they were added in. Iterating yields
+    (datetime.date, float) pairs, so code written against the old list of
+    tuples keeps working.
+    """
+    __slots__ = ("ordinals", "amounts")
+
+    def __init__(self, ordinals=(), amounts=(), presorted=False):
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        amounts = np.asarray(amounts, dtype=np.float64)
+        if ordinals.shape != amounts.shape:
+            raise ValueError("ordinals and amounts must have the same length")
+        if not presorted and ordinals.size > 1 and (np.diff(ordinals) < 0).any():
+            order = np.argsort(ordinals, kind="stable")
+            ordinals = ordinals[order]
+            amounts = amounts[order]
+        self.ordinals = ordinals
+        self.amounts = amounts
+
+    # ---------------------------------------------------------
+    # Construction
+    # ---------------------------------------------------------
+    @classmethod
+    def from_pairs(cls, pairs):
+        """
+        Build from (date, amount) pairs or {"date", "amount"} dicts. Dates may
+        be date, datetime or 'YYYY-MM-DD'; rows with an unparseable date or
+        amount are skipped.
+        """
+        ordinals = []
+        amounts = []
+        for row in pairs:
+            if isinstance(row, dict):
+                dt, amt = row.get("date"), row.get("amount")
+            else:
+                dt, amt = row
+            ordinal = _to_ordinal(dt)
+            if ordinal is None:
+                continue
+            try:
+                amt = float(amt)
+            except (TypeError, ValueError):
+                continue
+            ordinals.append(ordinal)
+            amounts.append(amt)
+        return cls(ordinals, amounts)
+
+    @classmethod
+    def coerce(cls, flows):
+        """Return flows as a CashFlowSeries, converting only if needed."""
+        if isinstance(flows, cls):
+            return flows
+        return cls.from_pairs(flows or ())
+
+    @classmethod
+    def concat(cls, series):
+        """All flows of several series in one, still date-ordered."""
+        parts = [cls.coerce(s) for s in series]
+        parts = [s for s in parts if len(s)]
+        if not parts:
+            return cls()
+        if len(parts) == 1:
+            return parts[0]
+        return cls(
+            np.concatenate([s.ordinals for s in parts]),
+            np.concatenate([s.amounts for s in parts]),
+        )
+
+    def __add__(self, other):
+        return CashFlowSeries.concat([self, other])
+
+    def with_flow(self, date, amount):
+        """A copy with one more flow, placed after any flows on the same day."""
+        ordinal = _to_ordinal(date)
+        pos = int(np.searchsorted(self.ordinals, ordinal, side="right"))
+        return CashFlowSeries(
+            np.insert(self.ordinals, pos, ordinal),
+            np.insert(self.amounts, pos, float(amount)),
+            presorted=True,
+        )
+
+    # ---------------------------------------------------------
+    # Reshaping
+    # ---------------------------------------------------------
+    def merge_by_date(self):
+        """One flow per day, the sum of that day's flows."""
+        if len(self) < 2:
+            return self
+        days, starts = np.unique(self.ordinals, return_index=True)
+        if days.size == self.ordinals.size:
+            return self
+        return CashFlowSeries(days, np.add.reduceat(self.amounts, starts), presorted=True)
+
+    def between(self, start=None, end=None):
+        """Flows dated start ≤ date ≤ end; either bound may be None."""
+        lo = 0 if start is None else int(np.searchsorted(self.ordinals, _to_ordinal(start), side="left"))
+        hi = len(self) if end is None else int(np.searchsorted(self.ordinals, _to_ordinal(end), side="right"))
+        return self[lo:max(lo, hi)]
+
+    def until(self, end):
+        """Flows dated on or before `end`."""
+        return self.between(end=end)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CashFlowSeries(self.ordinals[index], self.amounts[index], presorted=True)
+        return datetime.date.fromordinal(int(self.ordinals[index])), float(self.amounts[index])
+
+    # ---------------------------------------------------------
+    # Access
+    # ---------------------------------------------------------
+    def __len__(self):
+        return int(self.ordinals.size)
+
+    def __bool__(self):
+        return self.ordinals.size > 0
+
+    def __iter__(self):
+        fromordinal = datetime.date.fromordinal
+        return zip(map(fromordinal, self.ordinals.tolist()), self.amounts.tolist())
+
+    def __repr__(self):
+        return f"CashFlowSeries({list(self)!r})"
+
+    @property
+    def dates(self):
+        return [datetime.date.fromordinal(o) for o in self.ordinals.tolist()]
+
+    def year_fractions(self):
+        """Years since the first flow, on the 365-day basis XIRR uses."""
+        if not len(self):
+            return np.zeros(0)
+        return (self.ordinals - self.ordinals[0]) / 365.0
+
+    def has_sign_change(self):
+        """True when there is at least one outflow and one inflow."""
+        return bool((self.amounts < 0).any() and (self.amounts > 0).any())
+
+    def fingerprint(self):
+        """Stable digest of the flows, amounts rounded to 1e-4 rupees."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.ordinals.tobytes())
+        digest.update(np.round(self.amounts * 10_000).astype(np.int64).tobytes())
+        return digest.hexdigest()
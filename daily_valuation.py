@@ -0,0 +1,226 @@
+# daily_valuation.py
+#
+# Optional daily valuation mode (DAILY_VALUATION=True). The snapshot
+# generators value portfolios at the 15th and month-end only; this values a
+# user's portfolio on every business day in one forward pass over their
+# transactions and the daily NAVs kept in fund_nav_daily, and stores the
+# result as a compact (date, value, cost) series in portfolio_daily_value.
+# Each refresh appends the days after the last stored one;
+# portfolio_daily_state notes that day and a fingerprint of the inputs up to
+# it, so a backdated transaction or a NAV revision triggers a full rebuild.
+
+import datetime
+
+from sqlalchemy import func
+
+from db_config import db
+from models import FundNAVDaily, FundNAVHistory, Investment, PortfolioDailyValue, PortfolioDailyState, User
+from money import to_nav_scale, value_in_paise, paise_to_rupees
+from valuation_engine import FifoBook, NAV_FALLBACK_DAYS, load_fund_transactions, load_nav_series
+
+
+# ---------------------------------------------------------
+# Loading
+# ---------------------------------------------------------
+def load_daily_nav_series(fund_ids, until=None):
+    """
+    {fund_id: ([nav_date, ...], [scaled_nav, ...])} from fund_nav_daily merged
+    with the cutoff NAVs, so funds without daily rows still get a value.
+    """
+    if not fund_ids:
+        return {}
+
+    merged = {}
+    for fund_id, (dates, navs) in load_nav_series(fund_ids, until=until).items():
+        merged[fund_id] = dict(zip(dates, navs))
+
+    query = (
+        db.session.query(FundNAVDaily.fund_id, FundNAVDaily.nav_date, FundNAVDaily.nav_value)
+        .filter(FundNAVDaily.fund_id.in_(list(fund_ids)))
+    )
+    if until is not None:
+        query = query.filter(FundNAVDaily.nav_date <= until)
+    for fund_id, nav_date, nav_value in query:
+        merged.setdefault(fund_id, {})[nav_date] = to_nav_scale(nav_value)
+
+    series = {}
+    for fund_id, by_date in merged.items():
+        dates = sorted(by_date)
+        series[fund_id] = (dates, [by_date[d] for d in dates])
+    return series
+
+
+def business_days(nav_by_fund, start, end):
+    """Weekdays from start to end on which at least one of the funds has a NAV."""
+    days = set()
+    for dates, _ in nav_by_fund.values():
+        days.update(d for d in dates if start <= d <= end and d.weekday() < 5)
+    return sorted(days)
+
+
+# ---------------------------------------------------------
+# Streaming pass
+# ---------------------------------------------------------
+def value_daily(txns_by_fund, nav_by_fund, days):
+    """
+    Portfolio value and remaining cost for every day in `days` (sorted).
+
+    Each fund carries a transaction pointer, a NAV pointer and a FifoBook,
+    all moving forward only, so the whole range costs one pass over the
+    transactions and NAVs. NAV selection matches value_at_cutoffs: the last
+    NAV on or before the day, else the first within NAV_FALLBACK_DAYS after.
+
+    Returns [(date, value_paise, cost_paise), ...].
+    """
+    fallback = datetime.timedelta(days=NAV_FALLBACK_DAYS)
+    funds = []
+    for fund_id, txns in txns_by_fund.items():
+        dates, navs = nav_by_fund.get(fund_id) or ([], [])
+        if dates:
+            funds.append([txns, 0, dates, navs, 0, FifoBook()])
+
+    series = []
+    for day in days:
+        value_paise = 0
+        cost_paise = 0
+
+        for state in funds:
+            txns, t_pos, dates, navs, n_pos, book = state
+            while t_pos < len(txns) and txns[t_pos].date <= day:
+                book.apply(txns[t_pos])
+                t_pos += 1
+            while n_pos < len(dates) and dates[n_pos] <= day:
+                n_pos += 1
+            state[1] = t_pos
+            state[4] = n_pos
+
+            if t_pos == 0:
+                continue  # nothing invested yet
+
+            if n_pos:
+                scaled_nav = navs[n_pos - 1]
+            elif dates[0] <= day + fallback:
+                scaled_nav = navs[0]
+            else:
+                continue
+
+            value_paise += value_in_paise(book.units, scaled_nav)
+            cost_paise += book.cost
+
+        series.append((day, value_paise, cost_paise))
+
+    return series
+
+
+# ---------------------------------------------------------
+# Persistence
+# ---------------------------------------------------------
+def daily_inputs_version(user_id, through):
+    """
+    Fingerprint of what the user's daily values up to `through` were built
+    from: their transactions dated by then (count, last id, last update,
+    unit and amount totals) and the NAVs up to then of the funds they held
+    (count and sum in both NAV tables). A backdated or deleted transaction
+    or a revised NAV changes it; NAVs and transactions dated later do not.
+    """
+    txn_version = (
+        db.session.query(
+            func.count(Investment.id), func.max(Investment.id), func.max(Investment.updated_at),
+            func.sum(Investment.units), func.sum(Investment.amount),
+        )
+        .filter(Investment.user_id == user_id, Investment.date <= through)
+        .one()
+    )
+    held = (
+        db.session.query(Investment.fund_id)
+        .filter(Investment.user_id == user_id, Investment.date <= through)
+        .distinct()
+    )
+    nav_versions = [
+        db.session.query(func.count(), func.sum(model.nav_value))
+        .filter(model.fund_id.in_(held), model.nav_date <= through)
+        .one()
+        for model in (FundNAVHistory, FundNAVDaily)
+    ]
+    return "|".join(str(v) for v in (*txn_version, *nav_versions[0], *nav_versions[1]))
+
+
+def refresh_daily_values(user_id, today=None):
+    """
+    Bring one user's daily series up to today. While the inputs dated up to
+    the last stored day are unchanged (daily_inputs_version), only the days
+    after it are valued and appended; otherwise the series is rebuilt.
+    Returns the number of days stored.
+    """
+    today = today or datetime.date.today()
+
+    txns_by_fund = load_fund_transactions([user_id])
+    state = db.session.get(PortfolioDailyState, user_id)
+    if not txns_by_fund:
+        PortfolioDailyValue.query.filter_by(user_id=user_id).delete()
+        if state is not None:
+            db.session.delete(state)
+        db.session.commit()
+        return 0
+
+    if state is not None and state.inputs_version == daily_inputs_version(user_id, state.through_date):
+        start = state.through_date + datetime.timedelta(days=1)
+    else:
+        # Backdated transaction, deletion or NAV revision (or first run)
+        PortfolioDailyValue.query.filter_by(user_id=user_id).delete()
+        start = min(txns[0].date for txns in txns_by_fund.values())
+        if isinstance(start, datetime.datetime):
+            start = start.date()
+
+    nav_by_fund = load_daily_nav_series(txns_by_fund.keys(), until=today + datetime.timedelta(days=NAV_FALLBACK_DAYS))
+    days = business_days(nav_by_fund, start, today)
+
+    rows = [
+        {"user_id": user_id, "value_date": day, "value_paise": value_paise, "cost_paise": cost_paise}
+        for day, value_paise, cost_paise in value_daily(txns_by_fund, nav_by_fund, days)
+        if value_paise or cost_paise
+    ]
+    if rows:
+        db.session.bulk_insert_mappings(PortfolioDailyValue, rows)
+    if days:
+        inputs_version = daily_inputs_version(user_id, days[-1])
+        if state is None:
+            state = PortfolioDailyState(user_id=user_id)
+            db.session.add(state)
+        state.through_date = days[-1]
+        state.inputs_version = inputs_version
+    db.session.commit()
+    return len(rows)
+
+
+def refresh_all_daily_values(today=None):
+    for user in User.query.all():
+        stored = refresh_daily_values(user.id, today=today)
+        print(f"[DAILY] User {user.id}: {stored} daily values stored")
+
+
+def daily_series(user_ids, start=None):
+    """[{"date", "value", "cost"}] summed over the given users, in date order."""
+    if not user_ids:
+        return []
+
+    query = (
+        db.session.query(
+            PortfolioDailyValue.value_date,
+            func.sum(PortfolioDailyValue.value_paise),
+            func.sum(PortfolioDailyValue.cost_paise),
+        )
+        .filter(PortfolioDailyValue.user_id.in_(list(user_ids)))
+    )
+    if start is not None:
+        query = query.filter(PortfolioDailyValue.value_date >= start)
+
+    return [
+        {
+            "date": value_date.strftime("%Y-%m-%d"),
+            "value": round(paise_to_rupees(int(value_paise)), 2),
+            "cost": round(paise_to_rupees(int(cost_paise)), 2),
+        }
+        for value_date, value_paise, cost_paise in
+        query.group_by(PortfolioDailyValue.value_date).order_by(PortfolioDailyValue.value_date)
+    ]
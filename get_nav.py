@@ -2,6 +2,8 @@ import os
 import pandas as pd
 from sqlalchemy import func, text
 from models import Fund, FundNAVHistory
+from services.latest_navs import note_nav, latest_nav_cache
+from nav_store import sync_nav_store
 
 # Synonym lists for flexible header matching
 SCHEME_NAME_HEADERS = ["scheme name", "fund name", "scheme", "fund"]
@@ -22,7 +24,7 @@ def load_nav_file_for_date(session, nav_date):
     1. Reads the NAV Excel file from NAVs folder, specifically from 'Sheet1'.
     2. Auto-detects the header row.
     3. Inserts ALL rows into raw_nav_history.
-    4. Updates fund.latest_nav and fund_nav_history for matched funds.
+    4. Updates fund.latest_nav/latest_nav_date and fund_nav_history for matched funds.
     """
 
     # Build file path inside NAVs folder
@@ -77,6 +79,7 @@ def load_nav_file_for_date(session, nav_date):
     raw_inserted = 0
     updated_count = 0
     skipped_count = 0
+    updated_fund_ids = set()
 
     for _, row in df.iterrows():
         scheme_name = str(row[scheme_col]).strip()
@@ -110,16 +113,19 @@ def load_nav_file_for_date(session, nav_date):
         # 2. If fund exists, update snapshot + history
         fund = session.query(Fund).filter(func.lower(Fund.name) == scheme_name.lower()).first()
         if fund:
-            fund.latest_nav = nav_value_float
+            note_nav(fund, file_nav_date, nav_value_float)
             session.add(FundNAVHistory(
                 fund_id=fund.id,
                 nav_date=file_nav_date,
                 nav_value=nav_value_float
             ))
             updated_count += 1
+            updated_fund_ids.add(fund.id)
 
     try:
         session.commit()
+        latest_nav_cache.invalidate()
+        sync_nav_store(session, updated_fund_ids)
         print(f"[NAV UPDATE] Raw inserted/updated: {raw_inserted}, Funds updated: {updated_count}, Skipped: {skipped_count}")
     except Exception as e:
         session.rollback()
@@ -0,0 +1,26 @@
+"""add xirr to portfolio_snapshot
+
+Revision ID: 3a9d5c1e7f20
+Revises: 16fab3986c64
+Create Date: 2026-10-17 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a9d5c1e7f20'
+down_revision = '16fab3986c64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('portfolio_snapshot', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('xirr', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('portfolio_snapshot', schema=None) as batch_op:
+        batch_op.drop_column('xirr')
@@ -0,0 +1,49 @@
+"""add realized_gain table
+
+Revision ID: 8b2e4f6a1c93
+Revises: 3a9d5c1e7f20
+Create Date: 2026-10-17 11:04:52.337120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4f6a1c93'
+down_revision = '3a9d5c1e7f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('realized_gain',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('fund_id', sa.Integer(), nullable=False),
+    sa.Column('buy_date', sa.Date(), nullable=False),
+    sa.Column('sell_date', sa.Date(), nullable=False),
+    sa.Column('units', sa.Numeric(precision=18, scale=6), nullable=False),
+    sa.Column('cost', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.Column('proceeds', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.Column('gain', sa.Numeric(precision=18, scale=2), nullable=False),
+    sa.Column('holding_days', sa.Integer(), nullable=False),
+    sa.Column('term', sa.String(length=4), nullable=False),
+    sa.Column('financial_year', sa.String(length=7), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.CheckConstraint("term IN ('STCG','LTCG')", name='chk_gain_term_valid'),
+    sa.ForeignKeyConstraint(['fund_id'], ['fund.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('realized_gain', schema=None) as batch_op:
+        batch_op.create_index('ix_realized_gain_user_fy', ['user_id', 'financial_year'], unique=False)
+        batch_op.create_index('ix_realized_gain_user_fund', ['user_id', 'fund_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('realized_gain', schema=None) as batch_op:
+        batch_op.drop_index('ix_realized_gain_user_fund')
+        batch_op.drop_index('ix_realized_gain_user_fy')
+
+    op.drop_table('realized_gain')
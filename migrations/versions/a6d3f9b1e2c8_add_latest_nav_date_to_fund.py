@@ -0,0 +1,23 @@
+"""add latest_nav_date to fund
+
+Revision ID: a6d3f9b1e2c8
+Revises: f2b8d4a6c917
+Create Date: 2026-10-17 18:12:37.560914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a6d3f9b1e2c8'
+down_revision = 'f2b8d4a6c917'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("fund", sa.Column("latest_nav_date", sa.Date(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("fund", "latest_nav_date")
@@ -0,0 +1,29 @@
+"""add portfolio_daily_state table
+
+Revision ID: b7e4c1d8a5f2
+Revises: a6d3f9b1e2c8
+Create Date: 2026-10-17 21:04:51.228193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4c1d8a5f2'
+down_revision = 'a6d3f9b1e2c8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('portfolio_daily_state',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('through_date', sa.Date(), nullable=False),
+    sa.Column('inputs_version', sa.String(length=255), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('portfolio_daily_state')
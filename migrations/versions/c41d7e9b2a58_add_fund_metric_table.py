@@ -0,0 +1,45 @@
+"""add fund_metric table
+
+Revision ID: c41d7e9b2a58
+Revises: 8b2e4f6a1c93
+Create Date: 2026-10-17 13:22:09.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9b2a58'
+down_revision = '8b2e4f6a1c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('fund_metric',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('fund_id', sa.Integer(), nullable=False),
+    sa.Column('as_of_date', sa.Date(), nullable=False),
+    sa.Column('nav_points', sa.Integer(), nullable=False),
+    sa.Column('first_nav_date', sa.Date(), nullable=False),
+    sa.Column('first_nav', sa.Numeric(precision=18, scale=8), nullable=False),
+    sa.Column('last_nav', sa.Numeric(precision=18, scale=8), nullable=False),
+    sa.Column('peak_nav', sa.Numeric(precision=18, scale=8), nullable=False),
+    sa.Column('mean_return', sa.Float(), nullable=False),
+    sa.Column('m2_return', sa.Float(), nullable=False),
+    sa.Column('downside_sq_sum', sa.Float(), nullable=False),
+    sa.Column('annualized_return', sa.Float(), nullable=True),
+    sa.Column('volatility', sa.Float(), nullable=True),
+    sa.Column('downside_deviation', sa.Float(), nullable=True),
+    sa.Column('max_drawdown', sa.Float(), nullable=False),
+    sa.Column('sharpe_ratio', sa.Float(), nullable=True),
+    sa.Column('computed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['fund_id'], ['fund.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('fund_id', 'as_of_date', name='uq_fund_metric_as_of')
+    )
+
+
+def downgrade():
+    op.drop_table('fund_metric')
@@ -0,0 +1,40 @@
+"""backfill investment_history lot ledger
+
+Revision ID: c9e2a7f4d613
+Revises: b7e4c1d8a5f2
+Create Date: 2026-10-17 23:41:06.374512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e2a7f4d613'
+down_revision = 'b7e4c1d8a5f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Dashboards read holdings from the ledger only, and it is kept current
+    # on writes; rebuild it once for history loaded before that.
+    from services.investments import rebuild_user_ledger
+
+    session = Session(bind=op.get_bind())
+    user_ids = [
+        user_id for (user_id,) in
+        session.execute(sa.text("SELECT DISTINCT user_id FROM investment_history"
+                                " UNION SELECT DISTINCT user_id FROM investment"))
+    ]
+    for user_id in user_ids:
+        rebuild_user_ledger(session, user_id)
+        session.flush()
+        print(f"[LEDGER] Rebuilt lots for user {user_id}")
+    session.close()
+
+
+def downgrade():
+    # The ledger is derived from investment; nothing to undo
+    pass
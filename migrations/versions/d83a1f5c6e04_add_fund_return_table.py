@@ -0,0 +1,39 @@
+"""add fund_return table
+
+Revision ID: d83a1f5c6e04
+Revises: c41d7e9b2a58
+Create Date: 2026-10-17 15:02:41.775193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd83a1f5c6e04'
+down_revision = 'c41d7e9b2a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('fund_return',
+    sa.Column('fund_id', sa.Integer(), nullable=False),
+    sa.Column('as_of_date', sa.Date(), nullable=False),
+    sa.Column('nav', sa.Numeric(precision=18, scale=8), nullable=False),
+    sa.Column('return_1m', sa.Float(), nullable=True),
+    sa.Column('return_3m', sa.Float(), nullable=True),
+    sa.Column('return_6m', sa.Float(), nullable=True),
+    sa.Column('return_1y', sa.Float(), nullable=True),
+    sa.Column('return_3y', sa.Float(), nullable=True),
+    sa.Column('return_5y', sa.Float(), nullable=True),
+    sa.Column('cagr_3y', sa.Float(), nullable=True),
+    sa.Column('cagr_5y', sa.Float(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['fund_id'], ['fund.id'], ),
+    sa.PrimaryKeyConstraint('fund_id')
+    )
+
+
+def downgrade():
+    op.drop_table('fund_return')
@@ -0,0 +1,39 @@
+"""add fund_nav_daily and portfolio_daily_value tables
+
+Revision ID: e5a7c2d9f316
+Revises: d83a1f5c6e04
+Create Date: 2026-10-17 16:20:08.413027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c2d9f316'
+down_revision = 'd83a1f5c6e04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('fund_nav_daily',
+    sa.Column('fund_id', sa.Integer(), nullable=False),
+    sa.Column('nav_date', sa.Date(), nullable=False),
+    sa.Column('nav_value', sa.Numeric(precision=18, scale=8), nullable=False),
+    sa.ForeignKeyConstraint(['fund_id'], ['fund.id'], ),
+    sa.PrimaryKeyConstraint('fund_id', 'nav_date')
+    )
+    op.create_table('portfolio_daily_value',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('value_date', sa.Date(), nullable=False),
+    sa.Column('value_paise', sa.BigInteger(), nullable=False),
+    sa.Column('cost_paise', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'value_date')
+    )
+
+
+def downgrade():
+    op.drop_table('portfolio_daily_value')
+    op.drop_table('fund_nav_daily')
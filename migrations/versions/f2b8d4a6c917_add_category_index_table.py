@@ -0,0 +1,31 @@
+"""add category_index table
+
+Revision ID: f2b8d4a6c917
+Revises: e5a7c2d9f316
+Create Date: 2026-10-17 17:05:52.184306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b8d4a6c917'
+down_revision = 'e5a7c2d9f316'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('category_index',
+    sa.Column('sub_category_id', sa.Integer(), nullable=False),
+    sa.Column('index_date', sa.Date(), nullable=False),
+    sa.Column('index_value', sa.Float(), nullable=False),
+    sa.Column('fund_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['sub_category_id'], ['sub_category.id'], ),
+    sa.PrimaryKeyConstraint('sub_category_id', 'index_date')
+    )
+
+
+def downgrade():
+    op.drop_table('category_index')
@@ -61,6 +61,7 @@ class Fund(db.Model):
     registrar = db.Column(Enum(*REGISTRAR_TYPES, name='registrar_types'), nullable=True)
     fund_url = db.Column(db.String(255))
     latest_nav = db.Column(Numeric(18, 8), nullable=True)
+    latest_nav_date = db.Column(db.Date, nullable=True)              # date of latest_nav
     fund_house = db.Column(db.String(255))
     isin = db.Column(db.String(20), unique=True, nullable=False)
     scheme_code = db.Column(db.String(20), unique=True, nullable=True)
@@ -95,6 +96,15 @@ class FundNAVHistory(db.Model):
     )
 
 
+class FundNAVDaily(db.Model):
+    """Every published NAV for a held fund (optional daily valuation mode)."""
+    __tablename__ = 'fund_nav_daily'
+
+    fund_id = db.Column(db.Integer, db.ForeignKey('fund.id'), primary_key=True)
+    nav_date = db.Column(db.Date, primary_key=True)
+    nav_value = db.Column(Numeric(18, 8), nullable=False)
+
+
 class Investment(db.Model):
     __tablename__ = 'investment'
 
@@ -167,6 +177,104 @@ class NavUpdateLog(db.Model):
     notes = db.Column(db.Text)
     
 
+class RealizedGain(db.Model):
+    """One FIFO match of a sell against a buy lot, written with the lot ledger."""
+    __tablename__ = 'realized_gain'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    fund_id = db.Column(db.Integer, db.ForeignKey('fund.id'), nullable=False)
+
+    buy_date = db.Column(db.Date, nullable=False)
+    sell_date = db.Column(db.Date, nullable=False)
+    units = db.Column(Numeric(18, 6), nullable=False)
+    cost = db.Column(Numeric(18, 2), nullable=False)
+    proceeds = db.Column(Numeric(18, 2), nullable=False)
+    gain = db.Column(Numeric(18, 2), nullable=False)
+
+    holding_days = db.Column(db.Integer, nullable=False)
+    term = db.Column(db.String(4), nullable=False)               # 'STCG' or 'LTCG'
+    financial_year = db.Column(db.String(7), nullable=False)     # e.g. '2024-25'
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship('User', backref='realized_gains')
+    fund = db.relationship('Fund', backref='realized_gains')
+
+    __table_args__ = (
+        db.CheckConstraint("term IN ('STCG','LTCG')", name='chk_gain_term_valid'),
+        db.Index('ix_realized_gain_user_fy', 'user_id', 'financial_year'),
+        db.Index('ix_realized_gain_user_fund', 'user_id', 'fund_id'),
+    )
+
+class FundMetric(db.Model):
+    """Risk metrics for one fund from its stored NAV history up to as_of_date."""
+    __tablename__ = 'fund_metric'
+
+    id = db.Column(db.Integer, primary_key=True)
+    fund_id = db.Column(db.Integer, db.ForeignKey('fund.id'), nullable=False)
+    as_of_date = db.Column(db.Date, nullable=False)              # last NAV date included
+
+    # Running state, so new NAV points extend the row instead of a full recompute
+    nav_points = db.Column(db.Integer, nullable=False)
+    first_nav_date = db.Column(db.Date, nullable=False)
+    first_nav = db.Column(Numeric(18, 8), nullable=False)
+    last_nav = db.Column(Numeric(18, 8), nullable=False)
+    peak_nav = db.Column(Numeric(18, 8), nullable=False)
+    mean_return = db.Column(db.Float, nullable=False)            # per NAV period
+    m2_return = db.Column(db.Float, nullable=False)              # Σ (r - mean)²
+    downside_sq_sum = db.Column(db.Float, nullable=False)        # Σ min(r, 0)²
+
+    # Annualized metrics (None until there is enough history)
+    annualized_return = db.Column(db.Float, nullable=True)
+    volatility = db.Column(db.Float, nullable=True)
+    downside_deviation = db.Column(db.Float, nullable=True)
+    max_drawdown = db.Column(db.Float, nullable=False)           # ≤ 0, e.g. -0.23
+    sharpe_ratio = db.Column(db.Float, nullable=True)
+
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    fund = db.relationship('Fund', backref='metrics')
+
+    __table_args__ = (
+        db.UniqueConstraint('fund_id', 'as_of_date', name='uq_fund_metric_as_of'),
+    )
+
+class FundReturn(db.Model):
+    """Trailing returns for one fund as of its latest NAV; one row per fund."""
+    __tablename__ = 'fund_return'
+
+    fund_id = db.Column(db.Integer, db.ForeignKey('fund.id'), primary_key=True)
+    as_of_date = db.Column(db.Date, nullable=False)              # latest NAV date
+    nav = db.Column(Numeric(18, 8), nullable=False)              # latest NAV value
+
+    # Point-to-point (absolute) returns, None when history is too short
+    return_1m = db.Column(db.Float, nullable=True)
+    return_3m = db.Column(db.Float, nullable=True)
+    return_6m = db.Column(db.Float, nullable=True)
+    return_1y = db.Column(db.Float, nullable=True)
+    return_3y = db.Column(db.Float, nullable=True)
+    return_5y = db.Column(db.Float, nullable=True)
+
+    # Annualized
+    cagr_3y = db.Column(db.Float, nullable=True)
+    cagr_5y = db.Column(db.Float, nullable=True)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    fund = db.relationship('Fund', backref=db.backref('trailing_returns', uselist=False))
+
+class CategoryIndex(db.Model):
+    """Equal-weighted index of a subcategory's funds at the 15th/month-end cutoffs."""
+    __tablename__ = 'category_index'
+
+    sub_category_id = db.Column(db.Integer, db.ForeignKey('sub_category.id'), primary_key=True)
+    index_date = db.Column(db.Date, primary_key=True)
+    index_value = db.Column(db.Float, nullable=False)            # starts at 100
+    fund_count = db.Column(db.Integer, nullable=False)           # funds in the period's return
+
+    sub_category = db.relationship('SubCategory', backref='index_points')
+
 class DeletionLog(db.Model):
     __tablename__ = 'deletion_log'
 
@@ -188,6 +296,7 @@ class PortfolioSnapshot(db.Model):
 
     snapshot_date = db.Column(db.Date, nullable=False)
     portfolio_value = db.Column(db.Float, nullable=False)
+    xirr = db.Column(db.Float, nullable=True)  # XIRR of all flows up to snapshot_date
     dashboard_type = db.Column(db.String(20), nullable=False)
 
     __table_args__ = (
@@ -199,6 +308,23 @@ class PortfolioSnapshot(db.Model):
         db.Index('ix_family_snapshot_lookup', 'family_id', 'snapshot_date'),
     )
 
+class PortfolioDailyValue(db.Model):
+    """One business day of a user's portfolio valuation, in integer paise."""
+    __tablename__ = 'portfolio_daily_value'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    value_date = db.Column(db.Date, primary_key=True)
+    value_paise = db.Column(db.BigInteger, nullable=False)
+    cost_paise = db.Column(db.BigInteger, nullable=False)
+
+class PortfolioDailyState(db.Model):
+    """How far a user's daily series is valued, and a fingerprint of its inputs up to there."""
+    __tablename__ = 'portfolio_daily_state'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    through_date = db.Column(db.Date, nullable=False)
+    inputs_version = db.Column(db.String(255), nullable=False)
+
 class PasswordResetToken(db.Model):
     __tablename__ = 'password_reset_token'
 
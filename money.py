@@ -0,0 +1,121 @@
+# money.py
+#
+# Fixed-point representation for the valuation hot path. Scales match the
+# Numeric columns in models.py, so converting a DB value is exact:
+#   amounts → integer paise         (Numeric(18, 2))
+#   units   → integer micro-units   (Numeric(18, 6))
+#   NAVs    → integer 1e-8 rupees   (Numeric(18, 8))
+
+from decimal import Decimal, ROUND_HALF_UP
+
+PAISE_DIGITS = 2
+UNIT_DIGITS = 6
+NAV_DIGITS = 8
+
+PAISE = 10 ** PAISE_DIGITS
+MICRO_UNITS = 10 ** UNIT_DIGITS
+NAV_SCALE = 10 ** NAV_DIGITS
+
+# micro-units × scaled NAV → paise
+_VALUE_DIVISOR = MICRO_UNITS * NAV_SCALE // PAISE
+
+
+def round_div(numerator, denominator):
+    """Integer division rounded half away from zero."""
+    q, r = divmod(abs(numerator), denominator)
+    if 2 * r >= denominator:
+        q += 1
+    return q if numerator >= 0 else -q
+
+
+def _round_half_up(x):
+    """Round a float half away from zero, matching Decimal's ROUND_HALF_UP."""
+    return int(x + 0.5) if x >= 0 else -int(0.5 - x)
+
+
+def to_fixed(value, digits):
+    """Convert a Decimal/float/int/str to an integer with `digits` implied decimals."""
+    if value is None:
+        return 0
+    if isinstance(value, float):
+        return _round_half_up(value * 10 ** digits)
+    if isinstance(value, int):
+        return value * 10 ** digits
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    if value.adjusted() + digits < 15:
+        # ≤ 15 significant digits survive the float round-trip exactly
+        return _round_half_up(float(value) * 10 ** digits)
+    return int(value.scaleb(digits).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def to_paise(value):
+    return to_fixed(value, PAISE_DIGITS)
+
+
+def to_micro_units(value):
+    return to_fixed(value, UNIT_DIGITS)
+
+
+def to_nav_scale(value):
+    return to_fixed(value, NAV_DIGITS)
+
+
+def value_in_paise(micro_units, scaled_nav):
+    """Exact market value of a holding, rounded to the paisa."""
+    return round_div(micro_units * scaled_nav, _VALUE_DIVISOR)
+
+
+def unit_price(paise, micro_units):
+    """Per-unit price (NAV scale) of an amount over a unit count; 0 for no units."""
+    if not micro_units:
+        return 0
+    return round_div(abs(paise) * (NAV_SCALE * MICRO_UNITS // PAISE), abs(micro_units))
+
+
+def from_fixed(value, digits):
+    """Exact Decimal for a fixed-point integer, for writing back to Numeric columns."""
+    return Decimal(value).scaleb(-digits)
+
+
+def paise_to_rupees(paise):
+    return paise / PAISE
+
+
+def micro_units_to_units(micro_units):
+    return micro_units / MICRO_UNITS
+
+
+class FixedPointTxn:
+    """
+    Investment row converted once to fixed point, so repeated FIFO replays
+    (dashboards, snapshots) never touch Decimal or float again.
+    """
+    __slots__ = ("date", "transaction_type", "units", "amount", "fund_id", "user_id")
+
+    def __init__(self, date, transaction_type, units, amount, fund_id=None, user_id=None):
+        self.date = date
+        self.transaction_type = transaction_type
+        self.units = units
+        self.amount = amount
+        self.fund_id = fund_id
+        self.user_id = user_id
+
+    @classmethod
+    def from_txn(cls, txn):
+        return cls(
+            txn.date,
+            (txn.transaction_type or "").lower(),
+            to_fixed(txn.units, UNIT_DIGITS),
+            to_fixed(txn.amount, PAISE_DIGITS),
+            getattr(txn, "fund_id", None),
+            getattr(txn, "user_id", None),
+        )
+
+
+def to_fixed_point_txns(transactions):
+    """Convert ORM rows (or anything with date/transaction_type/units/amount) once."""
+    return [
+        t if isinstance(t, FixedPointTxn) else FixedPointTxn.from_txn(t)
+        for t in transactions
+    ]
@@ -1,13 +1,25 @@
 # nav_loader.py
 
+import os
 import requests
-from datetime import date
+from datetime import date, timedelta
 from dateutil import parser
 from decimal import Decimal
 from calendar import monthrange
 from sqlalchemy.exc import IntegrityError
 
-from models import db, Fund, FundNAVHistory, Investment
+from sqlalchemy import func
+
+from models import db, Fund, FundNAVHistory, FundNAVDaily, Investment
+from services.fund_metrics import refresh_fund_metrics
+from services.fund_returns import refresh_fund_returns
+from services.category_index import refresh_category_indices
+from services.latest_navs import note_nav, latest_nav_cache
+from nav_store import sync_nav_store
+
+# Optional daily valuation mode: also keep every NAV on or after the first
+# investment in fund_nav_daily (the cutoff table is unchanged)
+DAILY_VALUATION = os.getenv('DAILY_VALUATION') == 'True'
 
 
 # ---------------------------------------------------------
@@ -41,9 +53,9 @@ def fetch_nav_history(scheme_code: str):
 
 
 # ---------------------------------------------------------
-# Select cutoff NAVs (15th + month-end)
+# Parse MFAPI rows into (date, Decimal) pairs
 # ---------------------------------------------------------
-def select_cutoff_navs(history):
+def parse_nav_history(history):
     parsed = []
     for row in history:
         try:
@@ -52,7 +64,14 @@ def select_cutoff_navs(history):
             parsed.append((d, v))
         except Exception:
             continue
+    return parsed
+
 
+# ---------------------------------------------------------
+# Select cutoff NAVs (15th + month-end)
+# ---------------------------------------------------------
+def select_cutoff_navs(history):
+    parsed = parse_nav_history(history)
     if not parsed:
         return []
 
@@ -83,6 +102,9 @@ def select_cutoff_navs(history):
 # Save NAVs (upsert)
 # ---------------------------------------------------------
 def save_navs(fund: Fund, isin: str, cutoffs):
+    """Upsert cutoff NAVs; returns True if anything was inserted or changed."""
+    inserted = False
+    revised = False  # an already stored NAV changed value
     for nav_date, nav_value in cutoffs:
         entry = FundNAVHistory(
             fund_id=fund.id,
@@ -94,6 +116,7 @@ def save_navs(fund: Fund, isin: str, cutoffs):
         db.session.add(entry)
         try:
             db.session.commit()
+            inserted = True
             print(f"[SAVE] {fund.name}: {nav_date} -> {nav_value}")
         except IntegrityError:
             db.session.rollback()
@@ -103,10 +126,56 @@ def save_navs(fund: Fund, isin: str, cutoffs):
                 isin=isin,
             ).first()
             if existing:
+                revised = revised or existing.nav_value != nav_value
                 existing.nav_value = nav_value
                 db.session.commit()
                 print(f"[UPDATE] {fund.name}: {nav_date} -> {nav_value}")
 
+    # Keep fund.latest_nav/latest_nav_date in step with the history
+    noted = bool(cutoffs) and note_nav(fund, *max(cutoffs, key=lambda c: c[0]))
+    if noted:
+        db.session.commit()
+    if inserted or revised or noted:
+        latest_nav_cache.invalidate()
+
+    # Risk metrics once per load (only the new points if history is unchanged)
+    if refresh_fund_metrics(db.session, [fund.id], full=revised):
+        db.session.commit()
+        print(f"[METRICS] {fund.name}: risk metrics refreshed")
+
+    return inserted or revised
+
+
+# ---------------------------------------------------------
+# Save daily NAVs (append-only, daily valuation mode)
+# ---------------------------------------------------------
+def save_daily_navs(fund: Fund, history, first_date):
+    """
+    Append NAVs dated on or after first_date and after the latest stored
+    daily NAV for the fund. Returns the number of rows added.
+    """
+    latest = (
+        db.session.query(func.max(FundNAVDaily.nav_date))
+        .filter(FundNAVDaily.fund_id == fund.id)
+        .scalar()
+    )
+    start = max(first_date, latest + timedelta(days=1)) if latest else first_date
+
+    rows = {}
+    for nav_date, nav_value in parse_nav_history(history):
+        if nav_date >= start and nav_value > 0:
+            rows[nav_date] = nav_value
+    if not rows:
+        return 0
+
+    db.session.bulk_insert_mappings(FundNAVDaily, [
+        {"fund_id": fund.id, "nav_date": d, "nav_value": v}
+        for d, v in sorted(rows.items())
+    ])
+    db.session.commit()
+    print(f"[DAILY] {fund.name}: {len(rows)} daily NAVs from {min(rows)}")
+    return len(rows)
+
 
 # ---------------------------------------------------------
 # Load NAVs for a single fund (investment-aware)
@@ -128,6 +197,9 @@ def load_navs_for_fund(fund: Fund):
         print(f"[MFAPI EMPTY] {fund.id} {fund.name} scheme_code={fund.scheme_code}")
         return
 
+    if DAILY_VALUATION:
+        save_daily_navs(fund, history, first_date)
+
     cutoffs = select_cutoff_navs(history)
     print(f"[INFO] {fund.id} {fund.name} cutoffs_len_before_filter = {len(cutoffs)}")
 
@@ -139,7 +211,7 @@ def load_navs_for_fund(fund: Fund):
         print(f"[NO CUTOFFS AFTER INVESTMENT] {fund.id} {fund.name}")
         return
 
-    save_navs(fund, fund.isin, cutoffs)
+    return save_navs(fund, fund.isin, cutoffs)
 
 
 # ---------------------------------------------------------
@@ -156,9 +228,25 @@ def load_all_funds():
     total = len(funds)
     print(f"[LOAD_ALL] Funds with investments: {total}")
 
+    changed = []
     for idx, fund in enumerate(funds, start=1):
         print(f"\n[LOAD {idx}/{total}] {fund.name}")
-        load_navs_for_fund(fund)
+        if load_navs_for_fund(fund):
+            changed.append(fund.id)
+
+    # NAV store first: the refreshes below read it
+    sync_nav_store(db.session, changed)
+
+    # Trailing returns for every fund whose NAVs changed, in one pass
+    if refresh_fund_returns(db.session, changed):
+        db.session.commit()
+    print(f"[LOAD_ALL] Trailing returns refreshed for {len(changed)} funds")
+
+    # Category indices: append points for the new cutoffs only
+    added = refresh_category_indices(db.session)
+    if added:
+        db.session.commit()
+    print(f"[LOAD_ALL] Category index points added: {added}")
 
 
 # ---------------------------------------------------------
@@ -2,9 +2,15 @@
 
 import datetime
 import time
+from sqlalchemy import func
 from snapshot_generator import generate_personal_snapshots, generate_family_snapshots
 from models import db, Fund, Investment, FundNAVHistory, NavUpdateLog, User
-from nav_loader import load_all_funds, get_first_investment_date
+from nav_loader import load_all_funds, DAILY_VALUATION
+from services.fund_returns import refresh_fund_returns
+from services.category_index import refresh_category_indices
+from services.latest_navs import latest_nav_cache
+from nav_store import sync_nav_store
+from daily_valuation import refresh_all_daily_values
 
 
 # ---------------------------------------------------------
@@ -70,33 +76,33 @@ def record_log(cutoff_date: datetime.date, status: str, notes: str = None):
 # Verify NAVs for all invested funds (investment-aware)
 # ---------------------------------------------------------
 def verify_cutoff_for_all_funds(cutoff_date: datetime.date) -> bool:
-    invested_funds = (
-        Fund.query
-        .join(Investment, Investment.fund_id == Fund.id)
-        .distinct()
+    # First investment and first NAV of every invested fund, one grouped query each
+    first_investment = dict(
+        db.session.query(Investment.fund_id, func.min(Investment.date))
+        .filter(Investment.fund_id.isnot(None))
+        .group_by(Investment.fund_id)
+        .all()
+    )
+    if not first_investment:
+        print(f"[VERIFY] All invested funds have NAV ≤ cutoff {cutoff_date}")
+        return True
+
+    first_nav = dict(
+        db.session.query(FundNAVHistory.fund_id, func.min(FundNAVHistory.nav_date))
+        .filter(FundNAVHistory.fund_id.in_(list(first_investment)))
+        .group_by(FundNAVHistory.fund_id)
         .all()
     )
 
     missing = []
 
-    for fund in invested_funds:
-        first_date = get_first_investment_date(fund.id)
-
+    for fund in Fund.query.filter(Fund.id.in_(list(first_investment))).all():
         # Skip funds not yet purchased at this cutoff
-        if cutoff_date < first_date:
+        if cutoff_date < first_investment[fund.id]:
             continue
 
-        latest = (
-            FundNAVHistory.query
-            .filter(
-                FundNAVHistory.fund_id == fund.id,
-                FundNAVHistory.nav_date <= cutoff_date
-            )
-            .order_by(FundNAVHistory.nav_date.desc())
-            .first()
-        )
-
-        if not latest:
+        first_nav_date = first_nav.get(fund.id)
+        if first_nav_date is None or first_nav_date > cutoff_date:
             missing.append(fund.name)
 
     if missing:
@@ -119,6 +125,7 @@ def run_scheduler_once():
     cutoff_dates = get_relevant_cutoffs(today)
     print(f"[SCHEDULER] Relevant cutoffs: {', '.join(str(c) for c in cutoff_dates)}")
 
+    loaded = False
     for cutoff in cutoff_dates:
         print(f"\n[CHECK] Cutoff {cutoff}")
 
@@ -129,6 +136,7 @@ def run_scheduler_once():
         print(f"[RUN] Loading NAVs to satisfy cutoff {cutoff}")
         try:
             load_all_funds()
+            loaded = True
 
             if verify_cutoff_for_all_funds(cutoff):
                 record_log(cutoff, "success", "All invested funds have cutoff NAV")
@@ -156,6 +164,30 @@ def run_scheduler_once():
             record_log(cutoff, "fail", f"Exception during load: {e}")
             print(f"[ERROR] Exception while processing cutoff {cutoff}: {e}")
 
+    # Funds whose NAVs arrived outside load_all_funds (e.g. preview syncs)
+    sync_nav_store(db.session)
+    refreshed = refresh_fund_returns(db.session)
+    if refreshed:
+        db.session.commit()
+        print(f"[SCHEDULER] Trailing returns refreshed for {refreshed} funds")
+
+    added = refresh_category_indices(db.session)
+    if added:
+        db.session.commit()
+        print(f"[SCHEDULER] Category index points added: {added}")
+
+    # Daily valuation mode: pick up today's NAVs even between cutoffs
+    if DAILY_VALUATION:
+        try:
+            if not loaded:
+                load_all_funds()
+            refresh_all_daily_values(today)
+        except Exception as e:
+            print(f"[ERROR] Daily valuation failed: {e}")
+
+    # Readers in this process pick up whatever this run wrote
+    latest_nav_cache.invalidate()
+
 
 # ---------------------------------------------------------
 # Main loop: run at 20:00 daily
@@ -0,0 +1,408 @@
+# nav_store.py
+#
+# Optional on-disk NAV store (NAV_STORE_DIR=<directory>). FundNAVHistory
+# stays the source of truth; this keeps a columnar copy of it that every
+# web and worker process opens with numpy.memmap, so as-of lookups,
+# trailing returns and the snapshot sweep read NAVs without a query and
+# without unpickling, and the OS shares the pages between processes.
+#
+# One generation of the store is five .npy files:
+#   fund_ids-<gen>.npy      int64, sorted
+#   offsets-<gen>.npy       int64, len(fund_ids) + 1; fund k owns rows
+#                           offsets[k]:offsets[k + 1] of the next two
+#   ordinals-<gen>.npy      int32 date ordinals, ascending per fund
+#   navs-<gen>.npy          int64 NAV × NAV_SCALE (money.py)
+#   fingerprints-<gen>.npy  int64 (row count, last date ordinal, sum of
+#                           scaled NAVs) per fund, as FundNAVHistory had
+#                           them when the fund was read
+# The CURRENT file names the live store: a base generation, optionally
+# followed by "+<delta>", a generation holding only the funds re-read since
+# the base was written (the delta wins). Writers hold the LOCK file, build
+# a new generation next to the live one and swap CURRENT with os.replace,
+# so readers never see a half-written store; a reader reopens when CURRENT
+# changes.
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from sqlalchemy import func
+
+from db_config import db
+from models import FundNAVHistory
+from money import NAV_SCALE, to_nav_scale
+
+NAV_STORE_DIR = os.getenv('NAV_STORE_DIR')
+
+_ARRAYS = ("fund_ids", "offsets", "ordinals", "navs", "fingerprints")
+
+# A sync folds the delta back into a new base once the delta holds more
+# than this share of the base's rows.
+DELTA_COMPACT_RATIO = 0.25
+
+
+def _path(directory, name, generation):
+    return os.path.join(directory, f"{name}-{generation}.npy")
+
+
+# ---------------------------------------------------------
+# Reading
+# ---------------------------------------------------------
+class _Generation:
+    """The arrays of one written generation, memory-mapped read-only."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        arrays = {
+            array: np.load(_path(directory, array, name), mmap_mode="r")
+            for array in _ARRAYS
+        }
+        self.fund_ids = arrays["fund_ids"]
+        self.offsets = arrays["offsets"]
+        self.ordinals = arrays["ordinals"]
+        self.navs = arrays["navs"]
+        self.fingerprints = arrays["fingerprints"]
+
+    @property
+    def rows(self):
+        return int(self.offsets[-1])
+
+    def _slot(self, fund_id):
+        k = int(np.searchsorted(self.fund_ids, fund_id))
+        if k < len(self.fund_ids) and self.fund_ids[k] == fund_id:
+            return k
+        return None
+
+    def series(self, fund_id, until=None):
+        k = self._slot(fund_id)
+        if k is None:
+            return None
+        start, end = int(self.offsets[k]), int(self.offsets[k + 1])
+        ordinals = self.ordinals[start:end]
+        navs = self.navs[start:end]
+        if until is not None:
+            upto = int(np.searchsorted(ordinals, until.toordinal(), side="right"))
+            ordinals, navs = ordinals[:upto], navs[:upto]
+        return ordinals, navs
+
+
+class NavStore:
+    """The live store (base generation plus optional delta), memory-mapped read-only."""
+
+    def __init__(self, directory, generation):
+        self.generation = generation
+        # Delta first, so a re-read fund shadows its base copy
+        self.layers = [_Generation(directory, name) for name in reversed(generation.split("+"))]
+
+    @property
+    def base(self):
+        return self.layers[-1]
+
+    @property
+    def delta(self):
+        return self.layers[0] if len(self.layers) > 1 else None
+
+    @property
+    def fund_ids(self):
+        if len(self.layers) == 1:
+            return self.base.fund_ids
+        return np.union1d(self.layers[0].fund_ids, self.layers[1].fund_ids)
+
+    def __contains__(self, fund_id):
+        return fund_id is not None and any(layer._slot(fund_id) is not None for layer in self.layers)
+
+    def series(self, fund_id, until=None):
+        """(ordinals, scaled_navs) views for one fund, or None if not stored."""
+        for layer in self.layers:
+            series = layer.series(fund_id, until=until)
+            if series is not None:
+                return series
+        return None
+
+    def fingerprints(self):
+        """{fund_id: (row count, last ordinal, scaled NAV sum)} for every stored fund."""
+        result = {}
+        for layer in reversed(self.layers):
+            result.update(
+                (int(fund_id), tuple(int(v) for v in fingerprint))
+                for fund_id, fingerprint in zip(layer.fund_ids, layer.fingerprints)
+            )
+        return result
+
+
+_open = None
+_open_lock = threading.Lock()
+
+
+def _current_generation(directory):
+    try:
+        with open(os.path.join(directory, "CURRENT")) as fh:
+            return fh.read().strip() or None
+    except OSError:
+        return None
+
+
+def open_store():
+    """The live NavStore for this process, or None when the store is off or not built yet."""
+    global _open
+    if not NAV_STORE_DIR:
+        return None
+    generation = _current_generation(NAV_STORE_DIR)
+    if generation is None:
+        return None
+
+    with _open_lock:
+        if _open is None or _open.generation != generation:
+            try:
+                _open = NavStore(NAV_STORE_DIR, generation)
+            except (OSError, ValueError) as e:
+                print(f"[NAV_STORE] Could not open generation {generation}: {e}")
+                return None
+        return _open
+
+
+def store_series(fund_ids, until=None):
+    """
+    ({fund_id: (ordinals, scaled_navs)}, [fund_ids not in the store]) so
+    callers read what the store has and query the database for the rest.
+    With the store off every fund is returned as missing.
+    """
+    fund_ids = [fid for fid in fund_ids if fid is not None]
+    store = open_store()
+    if store is None:
+        return {}, fund_ids
+
+    found = {}
+    missing = []
+    for fund_id in fund_ids:
+        series = store.series(fund_id, until=until)
+        if series is None:
+            missing.append(fund_id)
+        elif len(series[0]):
+            found[fund_id] = series
+    return found, missing
+
+
+# ---------------------------------------------------------
+# Writing
+# ---------------------------------------------------------
+@contextmanager
+def _writer_lock(directory):
+    """
+    Serialize writers across processes on the LOCK file in the store
+    directory: flock on POSIX, msvcrt.locking on the first byte on Windows.
+    Imported here so the module loads on both.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "LOCK"), "a+b") as fh:
+        if os.name == "nt":
+            import msvcrt
+
+            while True:
+                fh.seek(0)
+                try:
+                    # LK_LOCK gives up after about ten seconds; keep waiting
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _query_fingerprints(session, fund_ids=None):
+    """
+    {fund_id: (row count, last date ordinal, sum of scaled NAVs)} from one
+    grouped query. The sum moves when a stored NAV is revised in place,
+    which the count and last date alone would miss.
+    """
+    query = session.query(
+        FundNAVHistory.fund_id,
+        func.count(FundNAVHistory.id),
+        func.max(FundNAVHistory.nav_date),
+        func.sum(func.round(FundNAVHistory.nav_value * NAV_SCALE)),
+    )
+    if fund_ids is not None:
+        query = query.filter(FundNAVHistory.fund_id.in_(list(fund_ids)))
+    return {
+        fund_id: (int(count), last_date.toordinal(), int(total or 0))
+        for fund_id, count, last_date, total in query.group_by(FundNAVHistory.fund_id)
+    }
+
+
+def _query_series(session, fund_ids=None):
+    """{fund_id: ([ordinal, ...], [scaled_nav, ...])}, one point per date, one query."""
+    query = session.query(FundNAVHistory.fund_id, FundNAVHistory.nav_date, FundNAVHistory.nav_value)
+    if fund_ids is not None:
+        query = query.filter(FundNAVHistory.fund_id.in_(list(fund_ids)))
+
+    series = {}
+    for fund_id, nav_date, nav_value in query.order_by(
+        FundNAVHistory.fund_id, FundNAVHistory.nav_date, FundNAVHistory.id
+    ):
+        if nav_value is None:
+            continue
+        ordinals, navs = series.setdefault(fund_id, ([], []))
+        ordinal = nav_date.toordinal()
+        if ordinals and ordinals[-1] == ordinal:
+            continue
+        ordinals.append(ordinal)
+        navs.append(to_nav_scale(nav_value))
+    return series
+
+
+def _read_funds(session, fund_ids=None):
+    """
+    ({fund_id: series}, {fund_id: fingerprint}) from FundNAVHistory. The
+    fingerprints are read first, so a NAV written in between leaves them
+    older than the series and the fund is re-read on the next sync.
+    """
+    fingerprints = _query_fingerprints(session, fund_ids)
+    series = _query_series(session, fund_ids)
+    if fund_ids is not None:
+        # Funds without NAVs any more are stored empty, shadowing the base
+        for fund_id in fund_ids:
+            series.setdefault(fund_id, ([], []))
+            fingerprints.setdefault(fund_id, (0, 0, 0))
+    return series, fingerprints
+
+
+def _write_generation(directory, series_by_fund, fingerprints):
+    """Write {fund_id: (ordinals, scaled_navs)} as a new generation; returns its name."""
+    # Time-ordered and unique per writer process
+    generation = f"{time.time_ns():020d}{os.getpid():07d}"
+
+    fund_ids = sorted(series_by_fund)
+    lengths = [len(series_by_fund[f][0]) for f in fund_ids]
+    offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))).astype(np.int64)
+    np.save(_path(directory, "fund_ids", generation), np.array(fund_ids, dtype=np.int64))
+    np.save(_path(directory, "offsets", generation), offsets)
+    np.save(
+        _path(directory, "fingerprints", generation),
+        np.array([fingerprints[f] for f in fund_ids], dtype=np.int64).reshape(len(fund_ids), 3),
+    )
+
+    # Fund by fund straight into the mapped files, without one big array in memory
+    for column, (name, dtype) in enumerate((("ordinals", np.int32), ("navs", np.int64))):
+        path = _path(directory, name, generation)
+        if not offsets[-1]:
+            np.save(path, np.zeros(0, dtype=dtype))
+            continue
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(int(offsets[-1]),))
+        for k, fund_id in enumerate(fund_ids):
+            out[offsets[k]:offsets[k + 1]] = series_by_fund[fund_id][column]
+        out.flush()
+        del out
+    return generation
+
+
+def _publish(directory, live):
+    """Make `live` ("<base>" or "<base>+<delta>") the current store and drop superseded generations."""
+    pointer = os.path.join(directory, f"CURRENT.{os.getpid()}.tmp")
+    with open(pointer, "w") as fh:
+        fh.write(live)
+    os.replace(pointer, os.path.join(directory, "CURRENT"))
+
+    # Files another process still has mapped stay valid on POSIX, and where
+    # removal fails they are retried on a later write
+    keep = set(live.split("+"))
+    newest = max(keep)
+    for entry in os.listdir(directory):
+        stem, _, suffix = entry.rpartition("-")
+        if stem in _ARRAYS and suffix.endswith(".npy"):
+            name = suffix[:-4]
+            if name not in keep and name < newest:
+                try:
+                    os.remove(os.path.join(directory, entry))
+                except OSError:
+                    pass
+
+
+def _rebuild(session):
+    series, fingerprints = _read_funds(session)
+    _publish(NAV_STORE_DIR, _write_generation(NAV_STORE_DIR, series, fingerprints))
+    print(f"[NAV_STORE] Rebuilt: {len(series)} funds, {sum(len(o) for o, _ in series.values())} NAVs")
+    return len(series)
+
+
+def rebuild_nav_store(session):
+    """Write the whole store from FundNAVHistory. Returns the number of funds stored."""
+    if not NAV_STORE_DIR:
+        return 0
+    with _writer_lock(NAV_STORE_DIR):
+        return _rebuild(session)
+
+
+def stale_store_fund_ids(session, store, fund_ids=None):
+    """Funds whose NAV count, latest date or NAV sum in FundNAVHistory differs from the store."""
+    stored = store.fingerprints()
+    return [
+        fund_id for fund_id, fingerprint in _query_fingerprints(session, fund_ids).items()
+        if stored.get(fund_id) != fingerprint
+    ]
+
+
+def sync_nav_store(session, fund_ids=None):
+    """
+    Bring the store up to date after a NAV load. Only the given funds (by
+    default every stale fund) are read from FundNAVHistory, and only they
+    and the funds already in the delta are written, as a new delta over the
+    unchanged base. Once the delta outgrows DELTA_COMPACT_RATIO of the base
+    it is folded into a new base. Builds the store from scratch if there is
+    none. Returns the number of funds re-read.
+    """
+    if not NAV_STORE_DIR:
+        return 0
+
+    with _writer_lock(NAV_STORE_DIR):
+        # Opened under the lock, so a sync that waited sees the last writer's store
+        store = open_store()
+        if store is None:
+            return _rebuild(session)
+
+        fund_ids = stale_store_fund_ids(session, store, fund_ids)
+        if not fund_ids:
+            return 0
+
+        series, fingerprints = _read_funds(session, fund_ids)
+        delta = store.delta
+        if delta is not None:
+            for k, fund_id in enumerate(int(f) for f in delta.fund_ids):
+                if fund_id not in series:
+                    series[fund_id] = delta.series(fund_id)
+                    fingerprints[fund_id] = tuple(int(v) for v in delta.fingerprints[k])
+
+        base = store.base
+        if sum(len(o) for o, _ in series.values()) > base.rows * DELTA_COMPACT_RATIO:
+            stored = store.fingerprints()
+            for fund_id in (int(f) for f in base.fund_ids):
+                if fund_id not in series:
+                    series[fund_id] = base.series(fund_id)
+                    fingerprints[fund_id] = stored[fund_id]
+            live = _write_generation(NAV_STORE_DIR, series, fingerprints)
+        else:
+            live = f"{base.name}+{_write_generation(NAV_STORE_DIR, series, fingerprints)}"
+        _publish(NAV_STORE_DIR, live)
+
+    print(f"[NAV_STORE] Synced {len(fund_ids)} funds")
+    return len(fund_ids)
+
+
+if __name__ == "__main__":
+    from app import app
+
+    with app.app_context():
+        rebuild_nav_store(db.session)
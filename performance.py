@@ -0,0 +1,209 @@
+# performance.py
+
+import os
+
+import numpy as np
+
+from db_config import db
+from models import Fund, PortfolioSnapshot, User
+from cashflows import CashFlowSeries
+
+# Default benchmark fund (ISIN) for the PME comparison, e.g. a Nifty 50 index
+# fund already loaded into Fund/FundNAVHistory
+PME_BENCHMARK_ISIN = os.getenv('PME_BENCHMARK_ISIN')
+
+
+# ---------------------------------------------------------
+# Time-weighted return (Modified Dietz, chained)
+# ---------------------------------------------------------
+def calculate_twr_series(snapshots, cash_flows):
+    """
+    Chain Modified Dietz sub-period returns between consecutive snapshots.
+
+    snapshots  : (snapshot_date, portfolio_value) pairs
+    cash_flows : investor-side flows (buys negative, sells positive), the
+                 same convention the XIRR engine uses; a CashFlowSeries is
+                 used without re-sorting
+
+    For each period (t0, t1] the net external flow F into the portfolio is
+    weighted by the share of the period it was invested for:
+        R = (V1 - V0 - F) / (V0 + Σ w_i·F_i),   w_i = (t1 - t_i) / (t1 - t0)
+    Snapshots are sorted once and walked together with the date-ordered
+    flows, so this is a single O(n + m) pass. The first snapshot anchors the index at 1.0.
+
+    Returns a list of {"date", "value", "period_return", "index"} dicts.
+    """
+    points = sorted(
+        ((d, float(v)) for d, v in snapshots if v is not None),
+        key=lambda x: x[0],
+    )
+    if not points:
+        return []
+
+    # Portfolio-side flows: money in is positive
+    flows = CashFlowSeries.coerce(cash_flows)
+    flows = list(zip(flows.dates, (-flows.amounts).tolist()))
+
+    series = [{
+        "date": points[0][0],
+        "value": points[0][1],
+        "period_return": 0.0,
+        "index": 1.0,
+    }]
+
+    pos = 0
+    # Skip flows already reflected in the first snapshot's value
+    while pos < len(flows) and flows[pos][0] <= points[0][0]:
+        pos += 1
+
+    index = 1.0
+    for (d0, v0), (d1, v1) in zip(points, points[1:]):
+        period_days = (d1 - d0).days or 1
+        net_flow = 0.0
+        weighted_flow = 0.0
+
+        while pos < len(flows) and flows[pos][0] <= d1:
+            flow_date, amount = flows[pos]
+            net_flow += amount
+            weighted_flow += amount * (d1 - flow_date).days / period_days
+            pos += 1
+
+        denominator = v0 + weighted_flow
+        period_return = (v1 - v0 - net_flow) / denominator if denominator > 0 else 0.0
+        index *= 1.0 + period_return
+
+        series.append({
+            "date": d1,
+            "value": v1,
+            "period_return": period_return,
+            "index": index,
+        })
+
+    return series
+
+
+def trailing_twr(series, periods=(1, 3, 5), as_of=None):
+    """
+    Trailing TWR from a chained index series, annualized beyond one year.
+    Uses the last point on or before `as_of - N years` as the base; a window
+    longer than the available history yields None.
+    """
+    if not series:
+        return {f"{n}Y": None for n in periods}
+
+    end = series[-1]
+    as_of = as_of or end["date"]
+    results = {}
+
+    for years in periods:
+        try:
+            start_date = as_of.replace(year=as_of.year - years)
+        except ValueError:  # 29 Feb
+            start_date = as_of.replace(year=as_of.year - years, day=28)
+
+        base = None
+        for point in series:
+            if point["date"] > start_date:
+                break
+            base = point
+
+        if base is None or base["index"] <= 0:
+            results[f"{years}Y"] = None
+            continue
+
+        growth = end["index"] / base["index"]
+        results[f"{years}Y"] = growth ** (1.0 / years) - 1.0 if years > 1 else growth - 1.0
+
+    return results
+
+
+def get_twr_series(user_id=None, family_id=None):
+    """TWR series for a user's personal or a family's snapshots, with no per-period queries."""
+    from snapshot_generator import get_external_cash_flows
+
+    query = db.session.query(PortfolioSnapshot.snapshot_date, PortfolioSnapshot.portfolio_value)
+    if family_id is not None:
+        query = query.filter(
+            PortfolioSnapshot.family_id == family_id,
+            PortfolioSnapshot.dashboard_type == "family",
+        )
+        user_ids = [u.id for u in User.query.filter_by(family_id=family_id).all()]
+    else:
+        query = query.filter(
+            PortfolioSnapshot.user_id == user_id,
+            PortfolioSnapshot.dashboard_type == "personal",
+        )
+        user_ids = [user_id]
+
+    snapshots = query.order_by(PortfolioSnapshot.snapshot_date).all()
+    if not snapshots or not user_ids:
+        return []
+
+    return calculate_twr_series(snapshots, get_external_cash_flows(user_ids))
+
+
+# ---------------------------------------------------------
+# Public Market Equivalent (same flows into a benchmark fund)
+# ---------------------------------------------------------
+def load_pme_benchmark(isin=None):
+    """
+    Benchmark fund plus its as-of NAV index as arrays, or None when no
+    benchmark is configured or it has no NAVs.
+    """
+    from daily_valuation import load_daily_nav_series
+
+    isin = isin or PME_BENCHMARK_ISIN
+    if not isin:
+        return None
+    fund = Fund.query.filter_by(isin=isin).first()
+    if fund is None:
+        return None
+    series = load_daily_nav_series([fund.id]).get(fund.id)
+    if not series:
+        return None
+
+    dates, navs = series
+    return {
+        "fund": fund,
+        "ordinals": np.array([d.toordinal() for d in dates], dtype=np.int64),
+        "navs": np.array(navs, dtype=float),
+    }
+
+
+def pme_cash_flows(cash_flows, benchmark, as_of):
+    """
+    The investor's external flows replayed into the benchmark: every buy
+    purchases benchmark units at the as-of NAV of its date and every sell
+    redeems them, and the flows end with the remaining units' value on
+    as_of as the terminal inflow. Solving XIRR on the result gives the PME
+    return. NAVs follow the valuation rule (last on or before, else the
+    first within NAV_FALLBACK_DAYS after); returns None when a flow falls
+    outside the benchmark's history.
+    """
+    from valuation_engine import NAV_FALLBACK_DAYS
+
+    flows = CashFlowSeries.coerce(cash_flows)
+    if not flows or benchmark is None:
+        return None
+
+    ordinals = benchmark["ordinals"]
+    points = np.append(flows.ordinals, as_of.toordinal())
+    pos = np.searchsorted(ordinals, points, side="right") - 1
+    before_first = pos < 0
+    if before_first.any() and ordinals[0] > points[before_first].min() + NAV_FALLBACK_DAYS:
+        return None
+
+    prices = benchmark["navs"][np.maximum(pos, 0)]
+    units = float((-flows.amounts / prices[:-1]).sum())
+    return flows.with_flow(as_of, units * prices[-1])
+
+
+def pme_summary(actual_xirr, pme_xirr, benchmark):
+    """Template/JSON values for the comparison; None without a PME result."""
+    if benchmark is None or pme_xirr is None:
+        return None
+    return {
+        "benchmark": benchmark["fund"].name,
+        "xirr": pme_xirr,
+        "excess": actual_xirr - pme_xirr if actual_xirr is not None else None,
+    }
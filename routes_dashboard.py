@@ -1,11 +1,24 @@
 import datetime
-from flask import Blueprint, render_template, session, request, jsonify
-from flask_login import current_user
+from flask import Blueprint, render_template, session, request, jsonify, Response, stream_with_context
+from flask_login import current_user, login_required
 from models import User, Investment, Fund, FundNAVHistory, StagingInvestment
 from sqlalchemy import func, case, extract
-from utils import calculate_xirr, format_fund_name, get_portfolio_holdings, calculate_fifo_returns
+from utils import xirr_cache, format_fund_name
 from db_config import db
 from nav_loader import load_navs_for_fund_preview
+from nav_store import sync_nav_store
+from performance import get_twr_series, trailing_twr, load_pme_benchmark, pme_cash_flows, pme_summary
+from scenario_engine import simulate_scenarios
+from valuation_engine import value_portfolio_as_of, value_portfolio_at_cutoffs
+from services.fund_returns import refresh_fund_returns, fund_returns_by_id
+from services.latest_navs import latest_nav_cache
+from services.capital_gains import capital_gains_report, iter_realized_gains_csv
+from money import paise_to_rupees
+from cashflows import CashFlowSeries
+from services.investments import (
+    load_fund_activity, load_open_lots, load_cash_flows, load_daily_cash_flows,
+    value_open_lots, with_terminal_value,
+)
 
 dashboard_bp = Blueprint('dashboard_bp', __name__)
 
@@ -22,27 +35,28 @@ def dashboard(user_id):
         return redirect(url_for('upload_center'))
     family_name = user.family.name if user.family else None
     session["user_id"] = user.id
-    transactions = Investment.query.filter_by(user_id=user.id).order_by(Investment.date).all()
+    today = datetime.date.today()
+
+    # Holdings come from the open lots of the FIFO ledger, which the write
+    # paths keep current; history is only read for the XIRR cash flows.
+    activity = load_fund_activity(db.session, [user.id])
+    open_lots = load_open_lots(db.session, [user.id])
+    funds_by_id = {
+        f.id: f for f in Fund.query.filter(Fund.id.in_([fid for fid in activity if fid is not None])).all()
+    }
 
     fund_map = {}
-    for txn in transactions:
-        fund = txn.fund
+    for fund_id, stats in activity.items():
+        fund = funds_by_id.get(fund_id)
+        if fund is None:
+            continue
         subcategory = fund.sub_category
-        category = subcategory.category if subcategory else None
-
-        if txn.fund_id not in fund_map:
-            fund_map[txn.fund_id] = {
-                'fund': fund,
-                'buys': [],
-                'sells': [],
-                'subcategory': subcategory,
-                'category': category
-            }
-
-        if txn.transaction_type == 'buy':
-            fund_map[txn.fund_id]['buys'].append(txn)
-        elif txn.transaction_type == 'sell':
-            fund_map[txn.fund_id]['sells'].append(txn)
+        fund_map[fund_id] = {
+            'fund': fund,
+            'activity': stats,
+            'subcategory': subcategory,
+            'category': subcategory.category if subcategory else None
+        }
 
     equity_investments = []
     debt_investments = []
@@ -52,28 +66,32 @@ def dashboard(user_id):
     subcategory_totals = {}
     fund_house_totals = {}
 
-    for data in fund_map.values():
-        fund = data['fund']
-        buys = data['buys']
-        sells = data['sells']
-        category_name = data['category'].name if data['category'] else None
-        subcategory_name = data['subcategory'].name if data['subcategory'] else None
+    # Latest NAV per fund from the fund rows, one IN (...) fetch; funds
+    # without a row (unmapped transactions) have no NAV
+    latest_navs = latest_nav_cache.get(db.session, activity.keys())
+    fund_navs = {
+        fund_id: latest_navs[fund_id][0] if fund_id in latest_navs else 0.0
+        for fund_id in activity
+    }
 
-        # Use centralized FIFO returns calculator
-        fund_txns = buys + sells
-        nav_row = (
-            db.session.query(FundNAVHistory.nav_value)
-            .filter(FundNAVHistory.fund_id == fund.id)
-            .order_by(FundNAVHistory.nav_date.desc())
-            .first()
-        )
+    # Each fund is valued once, for both the holdings table and the summary card
+    valuations = {
+        fund_id: value_open_lots(open_lots.get(fund_id, []), fund_navs[fund_id], today=today)
+        for fund_id in activity
+    }
 
-        latest_nav = float(nav_row[0]) if nav_row else 0.0
+    # Fund-level trailing returns, stored at NAV load time
+    trailing_by_fund = fund_returns_by_id(db.session, fund_map.keys())
 
+    for fund_id, data in fund_map.items():
+        fund = data['fund']
+        stats = data['activity']
+        category_name = data['category'].name if data['category'] else None
+        subcategory_name = data['subcategory'].name if data['subcategory'] else None
 
-        returns = calculate_fifo_returns(fund_txns, latest_nav)
+        returns = valuations[fund_id]
 
-        net_amount = sum(b.amount for b in buys) - sum(s.amount for s in sells)
+        net_amount = stats["buy_amount"] - stats["sell_amount"]
 
         summary = {
             'fund': fund,
@@ -81,16 +99,17 @@ def dashboard(user_id):
             'net_amount': net_amount,
             'current_value': returns["current_value"],
             'amount': returns["current_value"],
-            'buy_date': min(b.date for b in buys) if buys else None,
-            'sell_date': max(s.date for s in sells) if sells else None,
-            'xirr': returns["xirr"],
+            'buy_date': stats["first_buy"],
+            'sell_date': stats["last_sell"],
+            'xirr': None,
+            'return_1y': getattr(trailing_by_fund.get(fund_id), 'return_1y', None),
+            'cagr_3y': getattr(trailing_by_fund.get(fund_id), 'cagr_3y', None),
             'fund_display_name': format_fund_name(fund.name),
-            'plan_type': buys[0].plan_type if buys and buys[0].plan_type else (
+            'plan_type': stats["plan_type"] or (
                 'Direct' if 'direct' in fund.name.lower() else 'Regular'
-            ),       
+            ),
         }
 
-
         if category_name == 'Equity':
             equity_investments.append(summary)
         elif category_name == 'Debt':
@@ -119,101 +138,42 @@ def dashboard(user_id):
 
     # Build comprehensive fund_meta: include all funds referenced in transactions
     fund_meta = {}
-
-    # Collect all fund_ids from transactions
-    fund_ids_in_txn = {t.fund_id for t in transactions if t.fund_id is not None}
-    fund_rows = Fund.query.filter(Fund.id.in_(fund_ids_in_txn)).all()
-
-    # Preload latest NAV by fund_id from FundNAVHistory
-    latest_nav_by_isin = {}
-    for f in fund_rows:
-        nav_row = (
-            db.session.query(FundNAVHistory.nav_value)
-            .filter(FundNAVHistory.fund_id == f.id)
-            .order_by(FundNAVHistory.nav_date.desc())
-            .first()
-        )
-        if nav_row:
-            latest_nav_by_isin[f.isin] = float(nav_row[0])
-
-
-    # Build fund_meta with robust NAV fallback
-    for f in fund_rows:
-        name = getattr(f, "name", str(f.id))
-        isin = getattr(f, "isin", None)
-        nav_row = (
-            db.session.query(FundNAVHistory.nav_value)
-            .filter(FundNAVHistory.fund_id == f.id)
-            .order_by(FundNAVHistory.nav_date.desc())
-            .first()
-        )
-        latest_nav = float(nav_row[0]) if nav_row else 0.0
-
-        if (latest_nav == 0.0) and isin and (isin in latest_nav_by_isin):
-            latest_nav = latest_nav_by_isin[isin]
+    for f in funds_by_id.values():
         fund_meta[f.id] = {
-            "name": name,
-            "isin": isin,
-            "latest_nav": latest_nav,
+            "name": getattr(f, "name", str(f.id)),
+            "isin": getattr(f, "isin", None),
+            "latest_nav": fund_navs[f.id],
         }
 
 
     # ===== Summary Card Calculations (transaction-driven, FIFO-only) =====
 
-    summary_portfolio_value = 0.0
-    summary_cost_value = 0.0
+    # Totals are summed in integer paise and converted once, so they don't
+    # drift with the order funds are iterated in.
+    summary_portfolio_paise = 0
+    summary_cost_paise = 0
     summary_weighted_days_sum = 0.0
-    summary_cash_flows = []
-    today = datetime.date.today()
     summary_debug_rows = []
 
-    txns_by_fund = {}
-    for t in transactions:
-        txns_by_fund.setdefault(t.fund_id, []).append(t)
-
-    for fund_id, fund_txns in txns_by_fund.items():
+    for fund_id, stats in activity.items():
+        # fund_meta holds every fund row from the IN (...) fetch above
         fm = fund_meta.get(fund_id)
-        if fm:
-            fund_name = fm["name"]
-            latest_nav = fm["latest_nav"]
-        else:
-            fund = Fund.query.get(fund_id)
-            fund_name = getattr(fund, "name", str(fund_id)) if fund else str(fund_id)
-            isin = getattr(fund, "isin", None) if fund else None
-            latest_nav = float(getattr(fund, "latest_nav", 0.0) or 0.0) if fund else 0.0
-            if latest_nav == 0.0 and isin:
-                nav_row = (
-                    db.session.query(FundNAVHistory.nav_value)
-                    .filter(FundNAVHistory.isin == isin)
-                    .order_by(FundNAVHistory.nav_date.desc())
-                    .first()
-                )
-                latest_nav = float(nav_row[0]) if nav_row else 0.0
-
-        result = calculate_fifo_returns(fund_txns, latest_nav, today=today)
-
-        # Collect cash flows for XIRR
-        summary_cash_flows.extend(result.get("cash_flows", []))
-
-        # Add synthetic inflow for current value of remaining units
-        if result["remaining_units"] > 0:
-            summary_cash_flows.append({
-                "date": today,
-                "amount": result["current_value"]
-            })
+        fund_name = fm["name"] if fm else str(fund_id)
+        latest_nav = fund_navs[fund_id]
+        result = valuations[fund_id]
 
         is_active = result["remaining_units"] > 0
 
         if is_active:
-            summary_cost_value += float(result["cost_value"])
-            summary_portfolio_value += float(result["current_value"])
+            summary_cost_paise += result["cost_value_paise"]
+            summary_portfolio_paise += result["current_value_paise"]
 
         for lot in result["remaining_lots"]:
             if lot["cost"] > 0:
                 days_held = (today - lot["date"]).days
                 summary_weighted_days_sum += days_held * float(lot["cost"])
 
-        info_units = sum(float(t.units or 0) for t in fund_txns)
+        info_units = float(stats["net_units"])
         summary_debug_rows.append({
             "fund_id": fund_id,
             "fund_name": fund_name,
@@ -225,9 +185,82 @@ def dashboard(user_id):
             "isin": fm["isin"] if fm else None,
         })
 
+    summary_cost_value = paise_to_rupees(summary_cost_paise)
+    summary_portfolio_value = paise_to_rupees(summary_portfolio_paise)
     summary_wt_avg_days = round(summary_weighted_days_sum / summary_cost_value, 0) if summary_cost_value else 0
-    summary_xirr = calculate_xirr(summary_cash_flows) if summary_cash_flows else 0.0
-    summary_appreciation = summary_portfolio_value - summary_cost_value
+    summary_appreciation = paise_to_rupees(summary_portfolio_paise - summary_cost_paise)
+
+    # ===== XIRR: the shown funds, the summary, buckets and PME in one batched solve =====
+    # Per-fund XIRR is only shown for the five largest holdings
+    # (components/investment_table.html), so only their flows are read
+    shown = sorted(all_holdings, key=lambda inv: inv['amount'], reverse=True)[:5]
+    shown_cash_flows = load_cash_flows(db.session, [user.id], [inv['fund'].id for inv in shown])
+    fund_cash_flows = [
+        (inv, with_terminal_value(shown_cash_flows.get(inv['fund'].id), inv['current_value'], today))
+        for inv in shown
+    ]
+
+    # Portfolio and bucket flows come summed per day and subcategory from the
+    # database; each ends in the current value of the funds it covers that
+    # have flows, as the per-fund series did
+    daily_flows = load_daily_cash_flows(db.session, [user.id])
+    terminal_paise = {}
+    for fund_id, stats in activity.items():
+        result = valuations[fund_id]
+        if result["current_value"] > 0 and (stats["first_buy"] or stats["last_sell"]):
+            terminal_paise[fund_id] = result["current_value_paise"]
+
+    all_flows = CashFlowSeries.concat(daily_flows.values())
+    summary_flows = with_terminal_value(
+        all_flows, paise_to_rupees(sum(terminal_paise.values())), today
+    ).merge_by_date()
+    benchmark = load_pme_benchmark(request.args.get("benchmark"))
+    pme_flows = pme_cash_flows(all_flows, benchmark, today)
+
+    # Category and subcategory buckets: the same daily flows, grouped
+    subcategories = {
+        data['subcategory'].id: data['subcategory']
+        for data in fund_map.values() if data['subcategory'] is not None
+    }
+    bucket_parts = {}
+    bucket_paise = {}
+    for sub_category_id, flows in daily_flows.items():
+        subcategory = subcategories.get(sub_category_id)
+        if subcategory is None or subcategory.category is None:
+            continue
+        for key in (("category", subcategory.category.name), ("subcategory", subcategory.name)):
+            bucket_parts.setdefault(key, []).append(flows)
+    for fund_id, paise in terminal_paise.items():
+        subcategory = fund_map[fund_id]['subcategory'] if fund_id in fund_map else None
+        if subcategory is None or subcategory.category is None:
+            continue
+        for key in (("category", subcategory.category.name), ("subcategory", subcategory.name)):
+            bucket_paise[key] = bucket_paise.get(key, 0) + paise
+    bucket_keys = list(bucket_parts)
+    bucket_flows = [
+        with_terminal_value(
+            CashFlowSeries.concat(bucket_parts[key]), paise_to_rupees(bucket_paise.get(key, 0)), today
+        ).merge_by_date()
+        for key in bucket_keys
+    ]
+
+    xirr_results = xirr_cache.solve_batch(
+        [flows for _, flows in fund_cash_flows] + [summary_flows] + bucket_flows
+        + ([pme_flows] if pme_flows is not None else [])
+    )
+    for (inv, _), res in zip(fund_cash_flows, xirr_results):
+        inv['xirr'] = res["xirr"]
+    summary_xirr = xirr_results[len(fund_cash_flows)]["xirr"]
+    bucket_xirr = {
+        key: res["xirr"]
+        for key, res in zip(bucket_keys, xirr_results[len(fund_cash_flows) + 1:])
+    }
+    summary_pme = pme_summary(
+        summary_xirr, xirr_results[-1]["xirr"] if pme_flows is not None else None, benchmark
+    )
+
+    # ===== Time-weighted returns from the stored snapshot series =====
+    summary_twr = trailing_twr(get_twr_series(user_id=user.id))
 
     # Percent holding for summary lists used by the investment table
     for inv in equity_investments + debt_investments + hybrid_investments + commodity_investments:
@@ -268,7 +301,8 @@ def dashboard(user_id):
                 "subcategory": sub,
                 "category": category,
                 "amount": round(data["amount"], 2),
-                "percent": round((data["amount"] / summary_portfolio_value) * 100, 1) if summary_portfolio_value else 0
+                "percent": round((data["amount"] / summary_portfolio_value) * 100, 1) if summary_portfolio_value else 0,
+                "xirr": bucket_xirr.get(("subcategory", sub)),
             }
             for sub, data in subcategory_totals.items()
             if data["category"] == category
@@ -294,12 +328,13 @@ def dashboard(user_id):
             category_totals[category_name] += current_value
 
     # Use summary_portfolio_value as denominator
-    category_labels, category_values, category_values_in_millions = [], [], []
+    category_labels, category_values, category_values_in_millions, category_xirrs = [], [], [], []
     for cat, val in category_totals.items():
         if val > 0:
             category_labels.append(cat)
             category_values.append(round(val, 2))
             category_values_in_millions.append(round(val / 1_000_000, 2))
+            category_xirrs.append(bucket_xirr.get(("category", cat)))
 
     debt_total = category_totals['Debt']
     equity_total = category_totals['Equity']
@@ -328,6 +363,7 @@ def dashboard(user_id):
         category_labels=category_labels,
         category_values_in_millions=category_values_in_millions,
         category_full_values=category_values,
+        category_xirrs=category_xirrs,
         grouped_subcategories=grouped_subcategories,
         debt_total=debt_total,
         equity_total=equity_total,
@@ -344,6 +380,8 @@ def dashboard(user_id):
         summary_cost_value=summary_cost_value,
         summary_wt_avg_days=summary_wt_avg_days,
         summary_xirr=summary_xirr,
+        summary_twr=summary_twr,
+        summary_pme=summary_pme,
         # Pie chart values
         fund_house_labels=fund_house_labels,
         fund_house_values_in_millions=fund_house_values_in_millions,
@@ -376,50 +414,131 @@ def portfolio_history_data():
         cutoffs.extend([mid, last])
         curr = datetime.date(y + 1, 1, 1) if m == 12 else datetime.date(y, m + 1, 1)
 
-    points = []
-
-    for cutoff in cutoffs:
-        total_value = 0.0
-        funds = Fund.query.join(Investment).filter(Investment.user_id == user_id).distinct().all()
-        for fund in funds:
-            txns = Investment.query.filter(
-                Investment.user_id == user_id,
-                Investment.fund_id == fund.id,
-                Investment.date <= cutoff
-            ).order_by(Investment.date).all()
-
-            if not txns:
-                continue
-
-            nav_record = (FundNAVHistory.query
-                .filter(FundNAVHistory.fund_id == fund.id,
-                        FundNAVHistory.nav_date <= cutoff)
-                .order_by(FundNAVHistory.nav_date.desc())
-                .first())
-
-            if not nav_record:
-                nav_record = (FundNAVHistory.query
-                    .filter(FundNAVHistory.fund_id == fund.id,
-                            FundNAVHistory.nav_date > cutoff,
-                            FundNAVHistory.nav_date <= cutoff + datetime.timedelta(days=15))
-                    .order_by(FundNAVHistory.nav_date.asc())
-                    .first())
-
-            if not nav_record:
-                continue
-
-            result = calculate_fifo_returns(txns, nav_record.nav_value, today=cutoff)
-            total_value += result["current_value"]
-
-        points.append({
-            "date": cutoff.strftime("%Y-%m-%d"),
-            "value": round(total_value, 2)
-        })
+    # One load of transactions and NAVs, one forward FIFO pass over the cutoffs
+    points = [
+        {"date": point["date"].strftime("%Y-%m-%d"), "value": round(point["value"], 2)}
+        for point in value_portfolio_at_cutoffs([user_id], cutoffs)
+    ]
 
     points.sort(key=lambda x: x["date"])
     return jsonify(points)
 
 
+# ===== Time-weighted return index =====
+
+@dashboard_bp.route("/api/twr-history")
+@login_required
+def twr_history():
+    dashboard_type = request.args.get("dashboard_type", "personal", type=str)
+
+    # The caller's own series, or their own family's
+    if dashboard_type == "family":
+        if not current_user.family_id:
+            return jsonify({"series": [], "trailing": trailing_twr([])})
+        series = get_twr_series(family_id=current_user.family_id)
+    else:
+        series = get_twr_series(user_id=current_user.id)
+
+    return jsonify({
+        "series": [
+            {
+                "date": p["date"].strftime("%Y-%m-%d"),
+                "value": round(p["value"], 2),
+                "period_return": p["period_return"],
+                "index": p["index"],
+            }
+            for p in series
+        ],
+        "trailing": trailing_twr(series),
+    })
+
+
+# ===== Capital gains (STCG/LTCG) from the stored FIFO matches =====
+
+def _report_user_ids():
+    """
+    The signed-in user; dashboard_type=family widens to the members of the
+    caller's own family. Never taken from the query string.
+    """
+    if request.args.get("dashboard_type", "personal", type=str) == "family" and current_user.family_id:
+        return [u.id for u in User.query.filter_by(family_id=current_user.family_id).all()]
+    return [current_user.id]
+
+
+@dashboard_bp.route("/api/capital-gains")
+@login_required
+def capital_gains():
+    user_ids = _report_user_ids()
+
+    report = capital_gains_report(db.session, user_ids, request.args.get("fy"))
+    for row in report["unrealized"]:
+        row["buy_date"] = row["buy_date"].strftime("%Y-%m-%d")
+        row["long_term_from"] = row["long_term_from"].strftime("%Y-%m-%d")
+    return jsonify(report)
+
+
+@dashboard_bp.route("/api/capital-gains.csv")
+@login_required
+def capital_gains_csv():
+    user_ids = _report_user_ids()
+
+    fy = request.args.get("fy")
+    filename = f"capital_gains_{fy or 'all'}.csv"
+    return Response(
+        stream_with_context(iter_realized_gains_csv(db.session, user_ids, fy)),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+# ===== Point-in-time valuation =====
+
+@dashboard_bp.route("/api/valuation")
+@login_required
+def valuation():
+    user_ids = _report_user_ids()
+
+    raw_date = request.args.get("date")
+    try:
+        as_of = (
+            datetime.datetime.strptime(raw_date, "%Y-%m-%d").date()
+            if raw_date else datetime.date.today()
+        )
+    except ValueError:
+        return jsonify({"error": "date must be YYYY-MM-DD"}), 400
+
+    return jsonify(value_portfolio_as_of(user_ids, as_of))
+
+
+# ===== What-if scenarios over the real transaction history =====
+
+@dashboard_bp.route("/api/scenarios", methods=["POST"])
+@login_required
+def scenarios():
+    user_ids = _report_user_ids()
+
+    try:
+        result = simulate_scenarios(user_ids, request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if result is None:
+        return jsonify({"error": "no transactions"}), 404
+
+    result["dates"] = [d.strftime("%Y-%m-%d") for d in result["dates"]]
+    result["variants"]["date"] = [
+        d.strftime("%Y-%m-%d") if d else None for d in result["variants"]["date"]
+    ]
+    return jsonify(result)
+
+
+# ===== XIRR cache diagnostics =====
+
+@dashboard_bp.route("/api/xirr-cache-stats")
+@login_required
+def xirr_cache_stats():
+    return jsonify(xirr_cache.stats())
+
+
 # ===== Manual NAV load at preview =====
 
 @dashboard_bp.route("/preview-sync-nav", methods=["POST"])
@@ -491,6 +610,11 @@ def preview_sync_nav():
             errors.append(msg)
             print(">>> EXCEPTION DURING NAV LOAD:", msg)
 
+    synced_fund_ids = [f.id for f in Fund.query.filter(Fund.isin.in_(synced)).all()] if synced else []
+    sync_nav_store(db.session, synced_fund_ids)
+    if refresh_fund_returns(db.session, synced_fund_ids):
+        db.session.commit()
+
     nav_counts = {}
     for isin in isins:
         fund = Fund.query.filter_by(isin=isin).first()
@@ -1,10 +1,18 @@
 from flask import Blueprint, request, redirect, url_for, flash, render_template, jsonify
-from models import User, Investment, InvestmentHistory, Fund, FundNAVHistory, SubCategory, PortfolioSnapshot, DeletionLog
+from models import User, Investment, InvestmentHistory, Fund, SubCategory, PortfolioSnapshot, DeletionLog
 from datetime import datetime, date
-from utils import calculate_xirr, format_fund_name, calculate_fifo_returns
+from utils import xirr_cache, format_fund_name
 from sqlalchemy import func
 from sqlalchemy.orm import joinedload
 from db_config import db
+from services.investments import (
+    record_investments, rebuild_ledgers, ensure_ledgers, load_fund_activity,
+    load_open_lots, load_cash_flows, value_open_lots, with_terminal_value,
+)
+from services.fund_metrics import latest_fund_metrics
+from services.latest_navs import latest_nav_cache
+from services.fund_returns import fund_returns_by_id, months_before
+from services.category_index import load_index_series, index_return
 
 dashboard_tables_bp = Blueprint('dashboard_tables_bp', __name__)
 
@@ -48,6 +56,7 @@ def add_transactions(user_id):
 
     if request.method == "POST":
         row_count = int(request.form.get("row_count", 0))
+        new_investments = []
 
         for i in range(row_count):
             fund_id = request.form.get(f"fund_{i}")  # hidden field from autocomplete
@@ -88,7 +97,12 @@ def add_transactions(user_id):
             )
 
             db.session.add(inv)
+            new_investments.append(inv)
 
+        db.session.flush()
+        record_investments(db.session, new_investments)
+        # Self-heal any of the user's ledgers still out of step with history
+        ensure_ledgers(db.session, [user.id])
         db.session.commit()
 
         # --- NEW: Generate snapshots ---
@@ -167,6 +181,7 @@ def commit_transactions():
         return redirect(url_for("dashboard_tables_bp.add_transactions", user_id=session.get("user_id")))
 
     inserted = 0
+    new_investments = []
 
     for row in preview_data:
         try:
@@ -191,13 +206,19 @@ def commit_transactions():
             )
 
             db.session.add(inv)
+            new_investments.append(inv)
             inserted += 1
 
         except Exception as e:
             print("Commit error:", e)
             db.session.rollback()
+            new_investments.clear()  # the rollback discarded them too
             db.session.begin_nested()
 
+    db.session.flush()
+    record_investments(db.session, new_investments)
+    # Self-heal any of the user's ledgers still out of step with history
+    ensure_ledgers(db.session, [session.get("user_id")])
     db.session.commit()
     session.pop("preview_data", None)
 
@@ -214,69 +235,47 @@ def commit_transactions():
 @dashboard_tables_bp.route('/dashboard-tables/<int:user_id>', endpoint='dashboard_tables')
 def dashboard_tables(user_id):
     user = User.query.get_or_404(user_id)
-    investments = (
-        Investment.query
-        .filter_by(user_id=user.id)
-        .order_by(Investment.date)
-        .all()
-    )
+    today = date.today()
 
-    # Group investments by fund
+    # Holdings from the FIFO ledger's open lots (kept current by the write
+    # paths); no history replay
+    activity = load_fund_activity(db.session, [user.id])
+    open_lots = load_open_lots(db.session, [user.id])
+
+    # Group by fund, in order of first transaction
+    funds_by_id = {
+        f.id: f for f in Fund.query.filter(Fund.id.in_([fid for fid in activity if fid is not None])).all()
+    }
     fund_map = {}
-    for inv in investments:
-        fund_id = inv.fund_id
-        if fund_id not in fund_map:
-            fund_map[fund_id] = {
-                'fund': inv.fund,
-                'buys': [],
-                'sells': [],
-                'subcategory': inv.fund.sub_category,
-                'category': inv.fund.sub_category.category if inv.fund.sub_category else None,
-            }
-        if inv.transaction_type.lower() == 'buy':
-            fund_map[fund_id]['buys'].append(inv)
-        elif inv.transaction_type.lower() == 'sell':
-            fund_map[fund_id]['sells'].append(inv)
-
-    fund_ids_in_txn = list(fund_map.keys())
-    fund_rows = Fund.query.filter(Fund.id.in_(fund_ids_in_txn)).all()
-
-    # Preload latest NAV by fund_id from FundNAVHistory
-    latest_nav_by_fund = {}
-    for f in fund_rows:
-        nav_row = (
-            db.session.query(FundNAVHistory.nav_value)
-            .filter(FundNAVHistory.fund_id == f.id)
-            .order_by(FundNAVHistory.nav_date.desc())
-            .first()
-        )
-        if nav_row:
-            latest_nav_by_fund[f.id] = float(nav_row[0])
+    for fund_id, stats in activity.items():
+        fund = funds_by_id.get(fund_id)
+        if fund is None:
+            continue
+        fund_map[fund_id] = {
+            'fund': fund,
+            'activity': stats,
+            'subcategory': fund.sub_category,
+            'category': fund.sub_category.category if fund.sub_category else None,
+        }
+
+    # Latest NAV (and its date) per fund from the fund rows, one IN (...) fetch
+    latest_navs = latest_nav_cache.get(db.session, fund_map.keys())
+    latest_nav_by_fund = {fund_id: nav for fund_id, (nav, _) in latest_navs.items()}
 
     # Find the most recent NAV date across all funds in this user’s portfolio
-    last_nav_date = (
-        db.session.query(func.max(FundNAVHistory.nav_date))
-        .filter(FundNAVHistory.fund_id.in_(fund_ids_in_txn))
-        .scalar()
-    )
+    last_nav_date = max((nav_date for _, nav_date in latest_navs.values()), default=None)
     last_nav_str = last_nav_date.strftime("%d %b %Y") if last_nav_date else None
 
     # First pass: compute FIFO results per fund, filter out current_value <= 1000, accumulate total_current_value
     fund_results = []
     total_current_value = 0.0
 
-    for data in fund_map.values():
+    for fund_id, data in fund_map.items():
         fund = data['fund']
-        buys = data['buys']
-        sells = data['sells']
+        stats = data['activity']
         category = data['category']
 
-        fund_txns = buys + sells
-        if not fund_txns:
-            continue
-
-        latest_nav = latest_nav_by_fund.get(fund.id, 0.0)
-        result = calculate_fifo_returns(fund_txns, latest_nav)
+        result = value_open_lots(open_lots.get(fund_id, []), latest_nav_by_fund.get(fund_id, 0.0), today=today)
 
         current_value = result.get("current_value", 0.0) or 0.0
 
@@ -288,19 +287,53 @@ def dashboard_tables(user_id):
 
         fund_results.append({
             "fund": fund,
-            "buys": buys,
-            "sells": sells,
+            "activity": stats,
             "category": category,
             "result": result,
         })
 
+    # Cash flows only for the funds whose XIRR is shown, then one batched solve
+    cash_flows_by_fund = load_cash_flows(db.session, [user.id], [item["fund"].id for item in fund_results])
+    for item in fund_results:
+        item["result"]["cash_flows"] = with_terminal_value(
+            cash_flows_by_fund.get(item["fund"].id), item["result"]["current_value"], today
+        )
+    xirr_results = xirr_cache.solve_batch([item["result"]["cash_flows"] for item in fund_results])
+    for item, res in zip(fund_results, xirr_results):
+        item["result"]["xirr"] = res["xirr"]
+
+    # Risk metrics precomputed at NAV load time
+    metrics_by_fund = latest_fund_metrics(db.session, [item["fund"].id for item in fund_results])
+
+    def as_percent(value):
+        return round(value * 100, 2) if value is not None else None
+
+    # 1Y excess over the subcategory's equal-weighted index, from stored rows only
+    returns_by_fund = fund_returns_by_id(db.session, [item["fund"].id for item in fund_results])
+    index_by_sub_category = load_index_series(
+        db.session,
+        [item["fund"].sub_category_id for item in fund_results],
+        since=months_before(today, 13),
+    )
+
+    def excess_return_1y(fund):
+        fund_return = returns_by_fund.get(fund.id)
+        if fund_return is None or fund_return.return_1y is None:
+            return None
+        index_growth = index_return(
+            index_by_sub_category.get(fund.sub_category_id),
+            months_before(fund_return.as_of_date, 12), fund_return.as_of_date,
+        )
+        if index_growth is None:
+            return None
+        return as_percent(fund_return.return_1y - index_growth)
+
     equity_investments, debt_investments, hybrid_investments, commodity_investments = [], [], [], []
 
     # Second pass: build summaries with holding_percent based on FIFO current_value and total_current_value
     for item in fund_results:
         fund = item["fund"]
-        buys = item["buys"]
-        sells = item["sells"]
+        stats = item["activity"]
         category = item["category"]
         result = item["result"]
 
@@ -313,21 +346,29 @@ def dashboard_tables(user_id):
             if total_current_value > 0
             else 0.0
         )
+        metric = metrics_by_fund.get(fund.id)
 
         summary = {
             'fund': fund,
             'net_amount': cost_value,
             'current_value': current_value,
             'holding_percent': holding_percent,
-            'buy_date': min(b.date for b in buys) if buys else None,
-            'sell_date': max(s.date for s in sells) if sells else None,
+            'buy_date': stats["first_buy"],
+            'sell_date': stats["last_sell"],
             'xirr': round(result["xirr"] * 100, 2) if result["xirr"] is not None else None,
             'holding_period': result["holding_period"],            
+            'volatility': as_percent(metric.volatility) if metric else None,
+            'downside_deviation': as_percent(metric.downside_deviation) if metric else None,
+            'max_drawdown': as_percent(metric.max_drawdown) if metric else None,
+            'sharpe_ratio': (
+                round(metric.sharpe_ratio, 2)
+                if metric and metric.sharpe_ratio is not None else None
+            ),
+            'excess_return_1y': excess_return_1y(fund),
             'fund_display_name': format_fund_name(fund.name),
             'plan_type': (
-                buys[0].plan_type
-                if buys and buys[0].plan_type
-                else ('Direct' if 'direct' in fund.name.lower() else 'Regular')
+                stats["plan_type"]
+                or ('Direct' if 'direct' in fund.name.lower() else 'Regular')
             ),
             'growth_type': (
                 fund.growth_type
@@ -400,24 +441,16 @@ def confirm_deletion(user_id, registrar):
         ).all()
 
         investment_ids = [inv.id for inv in investments_to_delete]
+        # (user, None) also clears legacy ledger rows without a fund
+        affected_pairs = {(user.id, inv.fund_id) for inv in investments_to_delete} | {(user.id, None)}
 
         for inv in investments_to_delete:
             db.session.delete(inv)
 
-        # 2️⃣ Delete FIFO rows tied to these investments
-        histories_to_delete = InvestmentHistory.query.filter(
-            InvestmentHistory.user_id == user.id,
-            InvestmentHistory.fund_id.isnot(None)  # only delete FIFO for matched funds
-        ).all()
-
-        # Also delete FIFO rows where fund_id is NULL (CAMS rows often have NULL fund_id)
-        histories_null = InvestmentHistory.query.filter(
-            InvestmentHistory.user_id == user.id,
-            InvestmentHistory.fund_id.is_(None)
-        ).all()
-
-        for hist in histories_to_delete + histories_null:
-            db.session.delete(hist)
+        # 2️⃣ Rebuild the FIFO ledger of the funds these investments belonged to
+        db.session.flush()
+        rebuild_ledgers(db.session, affected_pairs)
+        ensure_ledgers(db.session, [user.id])
 
         # 3️⃣ Delete snapshots for this user (personal dashboard only)
         snapshots_to_delete = PortfolioSnapshot.query.filter(
@@ -438,8 +471,6 @@ def confirm_deletion(user_id, registrar):
 
         deleted_count = (
             len(investments_to_delete)
-            + len(histories_to_delete)
-            + len(histories_null)
             + len(snapshots_to_delete)
         )
 
@@ -2,8 +2,17 @@
 
 from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, flash
 from datetime import datetime, timedelta, date
-from models import db, User, Investment, Fund, FundNAVHistory
-from utils import calculate_xirr, calculate_fifo_returns, format_fund_name
+from models import db, User, Investment, Fund, FundReturn
+from utils import xirr_cache, format_fund_name
+from services.investments import (
+    load_fund_activity, load_open_lots, load_cash_flows, load_daily_cash_flows,
+    value_open_lots, with_terminal_value,
+)
+from money import paise_to_rupees
+from services.fund_returns import fund_returns_by_id
+from services.latest_navs import latest_nav_cache
+from cashflows import CashFlowSeries
+from performance import load_pme_benchmark, pme_cash_flows, pme_summary
 from flask_login import current_user, login_required
 
 
@@ -16,59 +25,43 @@ family_dashboard_bp = Blueprint(
 # ---------------------------------------------------------
 # Helper: Aggregate FIFO results for all users in a family
 # ---------------------------------------------------------
-def aggregate_family_investments(family_users):
+def aggregate_family_investments(family_users, benchmark=None):
     user_ids = [u.id for u in family_users]
 
-    # Fetch all investments for all users in the family
-    investments = (
-        Investment.query
-        .filter(Investment.user_id.in_(user_ids))
-        .order_by(Investment.date)
-        .all()
-    )
-
-    # Group transactions by fund
-    txns_by_fund = {}
-    for inv in investments:
-        txns_by_fund.setdefault(inv.fund_id, []).append(inv)
+    # Holdings from the members' FIFO ledgers (each member matched on their
+    # own lots, kept current by the write paths); history is only read as
+    # cash flows for XIRR
+    activity = load_fund_activity(db.session, user_ids)
+    open_lots = load_open_lots(db.session, user_ids)
 
     aggregated = {}
     today = date.today()
 
-    # For summary-level XIRR
-    summary_cash_flows = []
-    summary_portfolio_value = 0.0
-    summary_cost_value = 0.0
+    # For summary-level XIRR: the current value of every fund with flows
+    summary_terminal_paise = 0
+    summary_portfolio_paise = 0
+    summary_cost_paise = 0
     summary_weighted_days_sum = 0.0
 
-    for fund_id, txns in txns_by_fund.items():
-        fund = Fund.query.get(fund_id)
-        if not fund:
-            continue
-
-        # NAV fallback identical to main dashboard
-        nav_row = (
-            db.session.query(FundNAVHistory.nav_value)
-            .filter(FundNAVHistory.fund_id == fund.id)
-            .order_by(FundNAVHistory.nav_date.desc())
-            .first()
-        )
-
-        latest_nav = float(nav_row[0]) if nav_row else 0.0
-
-
-        # FIFO calculation identical to main dashboard
-        result = calculate_fifo_returns(txns, latest_nav, today=today)
+    # Fund rows and their latest NAVs, one IN (...) fetch each
+    fund_rows = {
+        f.id: f for f in Fund.query.filter(Fund.id.in_([fid for fid in activity if fid is not None])).all()
+    }
+    funds = {fund_id: fund_rows[fund_id] for fund_id in activity if fund_id in fund_rows}
+    nav_points = latest_nav_cache.get(db.session, funds.keys())
+    latest_navs = {
+        fund_id: nav_points[fund_id][0] if fund_id in nav_points else 0.0
+        for fund_id in funds
+    }
 
-        # Add cash flows for portfolio-level XIRR
-        summary_cash_flows.extend(result.get("cash_flows", []))
+    for fund_id, fund in funds.items():
+        stats = activity[fund_id]
+        result = value_open_lots(open_lots.get(fund_id, []), latest_navs[fund_id], today=today)
 
-        # Synthetic inflow per fund (identical to main dashboard)
-        if result["remaining_units"] > 0:
-            summary_cash_flows.append({
-                "date": today,
-                "amount": result["current_value"]
-            })
+        # Portfolio-level XIRR ends in the current value of every fund with
+        # flows (identical to main dashboard)
+        if result["current_value"] > 0 and (stats["first_buy"] or stats["last_sell"]):
+            summary_terminal_paise += result["current_value_paise"]
 
         # Weighted days identical to main dashboard
         for lot in result["remaining_lots"]:
@@ -77,35 +70,63 @@ def aggregate_family_investments(family_users):
                 summary_weighted_days_sum += days_held * float(lot["cost"])
 
         # Portfolio totals identical to main dashboard
-        summary_cost_value += float(result["cost_value"])
-        summary_portfolio_value += float(result["current_value"])
+        summary_cost_paise += result["cost_value_paise"]
+        summary_portfolio_paise += result["current_value_paise"]
 
         aggregated[fund_id] = {
             "fund": fund,
             "fund_display_name": format_fund_name(fund.name),
             "subcategory": fund.sub_category.name if fund.sub_category else "—",
             "category": fund.sub_category.category.name if fund.sub_category and fund.sub_category.category else "Unknown",
-            "plan_type": txns[0].plan_type if txns and txns[0].plan_type else (
+            "plan_type": stats["plan_type"] or (
                 "Direct" if "direct" in fund.name.lower() else "Regular"
             ),
             "units": float(result["remaining_units"]),
             "cost_value": float(result["cost_value"]),
             "current_value": float(result["current_value"]),
-            "xirr": result["xirr"],  # per-fund XIRR identical to main dashboard
+            "xirr": None,  # filled by the batched solve below for the top holdings
             "transactions": result["cash_flows"],
         }
 
     # Final portfolio-level metrics identical to main dashboard
+    summary_cost_value = paise_to_rupees(summary_cost_paise)
+    summary_portfolio_value = paise_to_rupees(summary_portfolio_paise)
     summary_wt_avg_days = round(summary_weighted_days_sum / summary_cost_value, 0) if summary_cost_value else 0
-    summary_xirr = calculate_xirr(summary_cash_flows) if summary_cash_flows else 0.0
-    summary_appreciation = summary_portfolio_value - summary_cost_value
+
+    # Per-fund XIRR is only shown for the top holdings (build_family_top5),
+    # so only their flows are read; the portfolio and its PME use flows
+    # summed per day in the database
+    fund_ids = sorted(aggregated, key=lambda fid: aggregated[fid]["current_value"], reverse=True)[:5]
+    shown_cash_flows = load_cash_flows(db.session, user_ids, fund_ids)
+    for fid in fund_ids:
+        aggregated[fid]["transactions"] = with_terminal_value(
+            shown_cash_flows.get(fid), aggregated[fid]["current_value"], today
+        )
+
+    all_flows = CashFlowSeries.concat(load_daily_cash_flows(db.session, user_ids, funds.keys()).values())
+    summary_flows = with_terminal_value(
+        all_flows, paise_to_rupees(summary_terminal_paise), today
+    ).merge_by_date()
+    pme_flows = pme_cash_flows(all_flows, benchmark, today)
+    xirr_results = xirr_cache.solve_batch(
+        [aggregated[fid]["transactions"] for fid in fund_ids] + [summary_flows]
+        + ([pme_flows] if pme_flows is not None else [])
+    )
+    for fid, res in zip(fund_ids, xirr_results):
+        aggregated[fid]["xirr"] = res["xirr"]
+    summary_xirr = xirr_results[len(fund_ids)]["xirr"]
+    summary_pme = pme_summary(
+        summary_xirr, xirr_results[-1]["xirr"] if pme_flows is not None else None, benchmark
+    )
+    summary_appreciation = paise_to_rupees(summary_portfolio_paise - summary_cost_paise)
 
     return (aggregated, 
         summary_portfolio_value, 
         summary_cost_value, 
         summary_appreciation, 
         summary_wt_avg_days, 
-        summary_xirr
+        summary_xirr,
+        summary_pme
     )
 # ---------------------------------------------------------
 # Helper: Category-level pie chart
@@ -172,8 +193,10 @@ def build_family_subcategory_breakup(aggregated):
 def build_family_top5(aggregated):
     rows = []
     total_value = sum(d["current_value"] for d in aggregated.values()) or 1
+    trailing_by_fund = fund_returns_by_id(db.session, aggregated.keys())
 
-    for data in aggregated.values():
+    for fund_id, data in aggregated.items():
+        trailing = trailing_by_fund.get(fund_id)
         rows.append({
             "fund_display_name": data["fund_display_name"],
             "subcategory": data["subcategory"],
@@ -181,6 +204,8 @@ def build_family_top5(aggregated):
             "amount": data["current_value"],
             "percent_holding": (data["current_value"] / total_value) * 100,
             "xirr": data["xirr"],
+            "return_1y": trailing.return_1y if trailing else None,
+            "cagr_3y": trailing.cagr_3y if trailing else None,
             "fund": data["fund"]
         })
 
@@ -226,32 +251,36 @@ def last_nav_update():
     family_users = User.query.filter_by(family_id=current_user.family_id).all()
     family_user_ids = [u.id for u in family_users]
 
+    # Funds with their stored trailing returns (latest NAV included) in one query
     invested_funds = (
-        Fund.query
-        .join(Investment, Investment.fund_id == Fund.id)
-        .filter(Investment.user_id.in_(family_user_ids))
-        .distinct()
+        db.session.query(Fund, FundReturn)
+        .outerjoin(FundReturn, FundReturn.fund_id == Fund.id)
+        .filter(Fund.id.in_(
+            db.session.query(Investment.fund_id)
+            .filter(Investment.user_id.in_(family_user_ids))
+        ))
         .all()
     )
 
+    # Latest NAV kept on the fund rows by every NAV write path
+    latest_navs = latest_nav_cache.get(db.session, [fund.id for fund, _ in invested_funds])
 
     rows = []
 
-    for fund in invested_funds:
-        latest_nav_entry = (
-            FundNAVHistory.query
-            .filter_by(fund_id=fund.id)
-            .order_by(FundNAVHistory.nav_date.desc())
-            .first()
-        )
+    for fund, trailing in invested_funds:
+        latest_nav_value, latest_nav_date = latest_navs.get(fund.id, (None, None))
 
         formatted_name = format_fund_name(fund.name or "")
 
         rows.append({
             "fund_name": formatted_name,
             "isin": fund.isin,
-            "latest_nav_date": latest_nav_entry.nav_date if latest_nav_entry else None,
-            "latest_nav_value": latest_nav_entry.nav_value if latest_nav_entry else None,
+            "latest_nav_date": latest_nav_date,
+            "latest_nav_value": latest_nav_value,
+            "returns": [
+                getattr(trailing, column, None)
+                for column in ("return_1m", "return_3m", "return_6m", "return_1y", "cagr_3y", "cagr_5y")
+            ],
         })
 
     return render_template("lastNAVupdate.html", rows=rows, now=now)
@@ -279,8 +308,9 @@ def family_dashboard():
         family_cost_value,
         family_appreciation,
         family_wt_avg_days,
-        family_xirr
-    ) = aggregate_family_investments(family_users)
+        family_xirr,
+        family_pme
+    ) = aggregate_family_investments(family_users, load_pme_benchmark(request.args.get("benchmark")))
     family_category_labels, family_category_values_in_millions, family_category_full_values = \
         build_family_category_breakup(aggregated)
     family_grouped_subcategories = build_family_subcategory_breakup(aggregated)
@@ -345,6 +375,7 @@ def family_dashboard():
         family_appreciation=round(family_appreciation, 2),
         family_wt_avg_days=family_wt_avg_days,
         family_xirr=family_xirr_display,
+        family_pme=family_pme,
         category_breakup=category_breakup,
         subcategory_breakup=subcategory_breakup,
         top_holdings=top_holdings,
@@ -375,10 +406,17 @@ def family_portfolio_history():
     years = request.args.get("years", 3, type=int)
     cutoff_date = date.today().replace(year=date.today().year - years)
 
+    # Daily points summed over the family's members (DAILY_VALUATION mode)
+    if request.args.get("granularity") == "daily":
+        from daily_valuation import daily_series
+        member_ids = [u.id for u in User.query.filter_by(family_id=family_id).all()]
+        return jsonify(daily_series(member_ids, start=cutoff_date))
+
     snapshots = (
         db.session.query(
             PortfolioSnapshot.snapshot_date,
-            func.sum(PortfolioSnapshot.portfolio_value).label("total_value")
+            func.sum(PortfolioSnapshot.portfolio_value).label("total_value"),
+            func.max(PortfolioSnapshot.xirr).label("xirr")
         )
         .filter(
             PortfolioSnapshot.family_id == family_id,
@@ -393,7 +431,8 @@ def family_portfolio_history():
     return jsonify([
         {
             "date": snap.snapshot_date.strftime("%Y-%m-%d"),
-            "value": float(snap.total_value)
+            "value": float(snap.total_value),
+            "xirr": snap.xirr
         }
         for snap in snapshots
     ])
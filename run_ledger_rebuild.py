@@ -0,0 +1,39 @@
+# run_ledger_rebuild.py
+#
+#   python run_ledger_rebuild.py           rebuild every user's ledger
+#   python run_ledger_rebuild.py --stale   rebuild only the (user, fund)
+#                                          ledgers out of step with history
+
+import sys
+
+from app import app
+from db_config import db
+from services.investments import rebuild_user_ledger, ensure_ledgers
+from models import User
+
+stale_only = "--stale" in sys.argv[1:]
+
+with app.app_context():
+    print("\n==============================")
+    print("  Rebuilding FIFO Lot Ledger")
+    print("==============================\n")
+
+    users = User.query.all()
+    print(f"[INFO] Found {len(users)} users")
+
+    for u in users:
+        try:
+            if stale_only:
+                stale = ensure_ledgers(db.session, [u.id])
+                print(f"[LEDGER] User {u.id} ({u.name}): {len(stale)} stale ledgers rebuilt")
+            else:
+                print(f"[LEDGER] Rebuilding lots for user {u.id} ({u.name})")
+                rebuild_user_ledger(db.session, u.id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[ERROR] Failed for user {u.id}: {e}")
+
+    print("\n==============================")
+    print("  Ledger Rebuild Complete")
+    print("==============================\n")
@@ -0,0 +1,337 @@
+# scenario_engine.py
+#
+# What-if analysis over a user's real transaction history. The history and
+# the NAV matrix (funds × cutoff dates) are loaded once; each scenario is a
+# transform of the buy amounts/units plus an optional category rebalance,
+# and all variants are replayed together as rows of NumPy arrays, so a few
+# thousand variants cost one walk over the events.
+
+import datetime
+import itertools
+
+import numpy as np
+
+from db_config import db
+from models import Fund, SubCategory, Category
+from money import PAISE, MICRO_UNITS
+from snapshot_generator import generate_cutoff_dates
+from utils import _solve_packed_xirr
+from valuation_engine import load_fund_transactions, NavResolver
+
+# Upper bound on variants per request (product of all scenario axes)
+MAX_VARIANTS = 10000
+
+# Variants replayed per NumPy batch; bounds the (variants × events) arrays
+BATCH_SIZE = 1024
+
+PERCENTILES = (5, 25, 50, 75, 95)
+HISTOGRAM_BINS = 20
+
+
+# ---------------------------------------------------------
+# Inputs: events, valuation grid and NAV matrix (loaded once)
+# ---------------------------------------------------------
+def load_scenario_inputs(user_ids, today=None):
+    """
+    Everything a scenario run needs, as arrays:
+        fund_ids     : [fund_id, ...] (column order of the matrices)
+        categories   : [category name, ...] per fund
+        event_*      : every buy/sell in date order (fund column, kind,
+                       units, rupee amount, date ordinal)
+        grid         : [date, ...] 15th/month-end cutoffs since the first
+                       transaction, plus today
+        nav          : (funds × grid) NAV matrix, 0.0 where a fund has no NAV
+    Returns None when the users have no transactions.
+    """
+    today = today or datetime.date.today()
+    txns_by_fund = load_fund_transactions(user_ids)
+    if not txns_by_fund:
+        return None
+
+    fund_ids = list(txns_by_fund)
+    column = {fund_id: i for i, fund_id in enumerate(fund_ids)}
+
+    events = sorted(
+        (t for txns in txns_by_fund.values() for t in txns if t.transaction_type in ("buy", "sell")),
+        key=lambda t: t.date,
+    )
+    if not events:
+        return None
+
+    first = events[0].date
+    grid = [c for c in generate_cutoff_dates(today.year - first.year + 1) if first <= c < today] + [today]
+
+    nav = NavResolver(fund_ids, grid).matrix(fund_ids, grid)
+
+    category_rows = (
+        db.session.query(Fund.id, Category.name)
+        .outerjoin(SubCategory, Fund.sub_category_id == SubCategory.id)
+        .outerjoin(Category, SubCategory.category_id == Category.id)
+        .filter(Fund.id.in_(fund_ids))
+        .all()
+    )
+    category_by_fund = dict(category_rows)
+
+    return {
+        "fund_ids": fund_ids,
+        "categories": [category_by_fund.get(fund_id) for fund_id in fund_ids],
+        "event_fund": np.array([column[t.fund_id] for t in events], dtype=np.int64),
+        "event_is_buy": np.array([t.transaction_type == "buy" for t in events]),
+        "event_units": np.array([abs(t.units) for t in events], dtype=float) / MICRO_UNITS,
+        "event_amount": np.array([abs(t.amount) for t in events], dtype=float) / PAISE,
+        "event_ordinal": np.array([t.date.toordinal() for t in events], dtype=np.int64),
+        "grid": grid,
+        "nav": nav,
+    }
+
+
+# ---------------------------------------------------------
+# Scenario spec → variant arrays
+# ---------------------------------------------------------
+def _axis(spec, default):
+    """A scenario axis: a number, a list, or {"min", "max", "steps"}."""
+    if spec is None:
+        return [default]
+    try:
+        if isinstance(spec, dict):
+            steps = int(spec.get("steps", 11))
+            if steps < 1:
+                raise ValueError("steps must be at least 1")
+            return np.linspace(float(spec["min"]), float(spec["max"]), steps).tolist()
+        if isinstance(spec, (list, tuple)):
+            return [float(v) for v in spec]
+        return [float(spec)]
+    except (KeyError, TypeError):
+        raise ValueError(f"invalid scenario axis: {spec!r}")
+
+
+def _parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid date: {value!r}")
+
+
+def build_variants(spec, grid):
+    """
+    Expand a scenario spec into one row per variant (the product of all
+    axes). Spec keys, all optional:
+        sip_scale : multiplier on every buy (1.1 = SIPs 10% higher)
+        rebalance : {"from": category, "to": category,
+                     "fraction": share of `from` moved (0.2 = 20%),
+                     "date": "YYYY-MM-DD" or a list, or
+                             {"start", "end"} for every cutoff in between}
+    A rebalance date is moved to the first cutoff on or after it.
+    Returns {"sip_scale", "fraction", "step"} arrays plus "from"/"to";
+    step is -1 when a variant does not rebalance.
+    """
+    spec = spec or {}
+    sip_scales = _axis(spec.get("sip_scale"), 1.0)
+    if any(s < 0 for s in sip_scales):
+        raise ValueError("sip_scale must not be negative")
+
+    rebalance = spec.get("rebalance")
+    fractions, steps = [0.0], [-1]
+    source = target = None
+    if rebalance:
+        source, target = rebalance.get("from"), rebalance.get("to")
+        if not source or not target or source == target:
+            raise ValueError("rebalance needs different 'from' and 'to' categories")
+        fractions = _axis(rebalance.get("fraction"), 0.0)
+        if any(not 0.0 <= f <= 1.0 for f in fractions):
+            raise ValueError("rebalance fraction must be between 0 and 1")
+
+        dates = rebalance.get("date")
+        if isinstance(dates, dict):
+            start, end = _parse_date(dates.get("start")), _parse_date(dates.get("end"))
+            dates = [d for d in grid if start <= d <= end]
+        else:
+            if not isinstance(dates, (list, tuple)):
+                dates = [dates]
+            dates = [_parse_date(d) for d in dates]
+
+        ordinals = np.array([d.toordinal() for d in grid])
+        steps = sorted({int(np.searchsorted(ordinals, d.toordinal(), side="left")) for d in dates})
+        steps = [s for s in steps if s < len(grid)]
+        if not steps:
+            raise ValueError("rebalance date is after the last valuation date")
+
+    count = len(sip_scales) * len(fractions) * len(steps)
+    if count > MAX_VARIANTS:
+        raise ValueError(f"{count} variants requested; the limit is {MAX_VARIANTS}")
+
+    rows = np.array(list(itertools.product(sip_scales, fractions, steps)), dtype=float)
+    return {
+        "sip_scale": rows[:, 0],
+        "fraction": rows[:, 1],
+        "step": rows[:, 2].astype(np.int64),
+        "from": source,
+        "to": target,
+    }
+
+
+# ---------------------------------------------------------
+# Batched replay
+# ---------------------------------------------------------
+def _replay(inputs, sip_scale, fraction, step, source_cols, target_cols):
+    """
+    Replay the events for one batch of variants (rows).
+
+    Buys add units × sip_scale. A sell takes the same share of the fund as
+    it did of the real holding at that time, at the real sell price, so
+    scaled or rebalanced holdings are never oversold. A rebalance at grid
+    step t sells `fraction` of the source category at that cutoff's NAVs and
+    buys the target category pro rata to its current value (equally if the
+    variant holds none of it). Returns (investor flows per event, value per
+    grid date), both (variants × n) arrays.
+    """
+    n_rows = sip_scale.size
+    nav = inputs["nav"]
+    grid_ordinals = [d.toordinal() for d in inputs["grid"]]
+    ev_fund = inputs["event_fund"]
+    ev_buy = inputs["event_is_buy"]
+    ev_units = inputs["event_units"]
+    ev_amount = inputs["event_amount"]
+    ev_ordinal = inputs["event_ordinal"]
+    n_events = ev_fund.size
+
+    holdings = np.zeros((n_rows, nav.shape[0]))
+    real_holdings = np.zeros(nav.shape[0])
+    flows = np.zeros((n_rows, n_events))
+    values = np.zeros((n_rows, len(grid_ordinals)))
+    rebalance_steps = set(step[step >= 0].tolist())
+
+    k = 0
+    for t, cutoff in enumerate(grid_ordinals):
+        while k < n_events and ev_ordinal[k] <= cutoff:
+            f = ev_fund[k]
+            if ev_buy[k]:
+                holdings[:, f] += ev_units[k] * sip_scale
+                flows[:, k] = -ev_amount[k] * sip_scale
+                real_holdings[f] += ev_units[k]
+            elif real_holdings[f] > 0 and ev_units[k] > 0:
+                sold = min(ev_units[k], real_holdings[f])
+                share = sold / real_holdings[f]
+                price = ev_amount[k] / ev_units[k]
+                flows[:, k] = holdings[:, f] * share * price
+                holdings[:, f] *= 1.0 - share
+                real_holdings[f] -= sold
+            k += 1
+
+        if t in rebalance_steps and len(source_cols) and len(target_cols):
+            moved = np.where(step == t, fraction, 0.0)
+            source_nav = nav[source_cols, t]
+            proceeds = (holdings[:, source_cols] * source_nav).sum(axis=1) * moved
+            holdings[:, source_cols] *= (1.0 - moved)[:, None]
+
+            target_nav = nav[target_cols, t]
+            priced = target_nav > 0
+            if priced.any():
+                weights = holdings[:, target_cols] * target_nav
+                totals = weights.sum(axis=1, keepdims=True)
+                equal = np.where(priced, 1.0 / priced.sum(), 0.0)
+                weights = np.where(totals > 0, weights / np.where(totals > 0, totals, 1.0), equal)
+                holdings[:, target_cols] += (
+                    proceeds[:, None] * weights / np.where(priced, target_nav, 1.0)
+                )
+
+        values[:, t] = holdings @ nav[:, t]
+
+    return flows, values
+
+
+def _distribution(values):
+    """Percentiles, mean and histogram of one number per variant."""
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if not values.size:
+        return None
+    counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+    return {
+        "mean": float(values.mean()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        **{f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+        "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+    }
+
+
+def run_scenarios(inputs, variants, batch_size=BATCH_SIZE):
+    """
+    Value every variant and solve its XIRR.
+
+    The actual portfolio (sip_scale 1, no rebalance) is always replayed as
+    the baseline. XIRR uses the real transaction dates with the variant's
+    flows and its value on the last grid date (today) as the terminal
+    inflow, solved for the whole batch in one packed Newton pass.
+
+    Returns {"dates", "baseline", "value_bands", "terminal_value", "xirr",
+             "variants"} where value_bands holds per-date percentiles across
+    variants and terminal_value/xirr are distributions.
+    """
+    categories = inputs["categories"]
+    source_cols = np.array([i for i, c in enumerate(categories) if c == variants["from"]], dtype=np.int64)
+    target_cols = np.array([i for i, c in enumerate(categories) if c == variants["to"]], dtype=np.int64)
+
+    sip_scale = np.concatenate(([1.0], variants["sip_scale"]))
+    fraction = np.concatenate(([0.0], variants["fraction"]))
+    step = np.concatenate(([-1], variants["step"]))
+
+    today_ordinal = inputs["grid"][-1].toordinal()
+    ordinals = np.append(inputs["event_ordinal"], today_ordinal)
+    years = (ordinals - ordinals[0]) / 365.0
+
+    all_values = []
+    all_xirr = []
+    for start in range(0, sip_scale.size, batch_size):
+        rows = slice(start, start + batch_size)
+        flows, values = _replay(
+            inputs, sip_scale[rows], fraction[rows], step[rows], source_cols, target_cols
+        )
+        amounts = np.concatenate((flows, values[:, -1:]), axis=1)
+
+        xirr = np.full(amounts.shape[0], np.nan)
+        solvable = (amounts < 0).any(axis=1) & (amounts > 0).any(axis=1)
+        if solvable.any():
+            rate, _, _ = _solve_packed_xirr(
+                np.broadcast_to(years, (int(solvable.sum()), years.size)), amounts[solvable]
+            )
+            xirr[solvable] = rate
+
+        all_values.append(values)
+        all_xirr.append(xirr)
+
+    values = np.concatenate(all_values)
+    xirr = np.concatenate(all_xirr)
+    baseline_values, values = values[0], values[1:]
+    baseline_xirr, xirr = xirr[0], xirr[1:]
+
+    bands = np.percentile(values, PERCENTILES, axis=0)
+    grid = inputs["grid"]
+    return {
+        "dates": grid,
+        "baseline": {
+            "values": baseline_values.tolist(),
+            "terminal_value": float(baseline_values[-1]),
+            "xirr": None if np.isnan(baseline_xirr) else float(baseline_xirr),
+        },
+        "value_bands": {f"p{p}": band.tolist() for p, band in zip(PERCENTILES, bands)},
+        "terminal_value": _distribution(values[:, -1]),
+        "xirr": _distribution(xirr),
+        "variants": {
+            "count": int(values.shape[0]),
+            "sip_scale": variants["sip_scale"].tolist(),
+            "fraction": variants["fraction"].tolist(),
+            "date": [grid[s] if s >= 0 else None for s in variants["step"].tolist()],
+            "terminal_value": values[:, -1].tolist(),
+            "xirr": [None if np.isnan(x) else float(x) for x in xirr],
+        },
+    }
+
+
+def simulate_scenarios(user_ids, spec, today=None):
+    """Load once, expand the spec and run: the entry point for the API."""
+    inputs = load_scenario_inputs(user_ids, today=today)
+    if inputs is None:
+        return None
+    return run_scenarios(inputs, build_variants(spec, inputs["grid"]))
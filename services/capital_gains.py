@@ -0,0 +1,229 @@
+import calendar
+import csv
+import datetime
+import io
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import RealizedGain, InvestmentHistory, Fund, SubCategory, Category, FundNAVHistory
+from money import (
+    UNIT_DIGITS, PAISE_DIGITS, to_paise, to_micro_units, to_nav_scale, round_div,
+    value_in_paise, from_fixed, paise_to_rupees, micro_units_to_units,
+)
+from services.latest_navs import latest_nav_cache
+
+# Holding period after which a gain is long-term, by fund category: equity
+# funds after 12 months, everything else on the 24-month rule.
+LONG_TERM_MONTHS = {"Equity": 12}
+DEFAULT_LONG_TERM_MONTHS = 24
+
+
+# ---------------------------------------------------------
+# Rules
+# ---------------------------------------------------------
+def financial_year(d):
+    """Indian financial year label (April–March), e.g. '2024-25'."""
+    start = d.year if d.month >= 4 else d.year - 1
+    return f"{start}-{(start + 1) % 100:02d}"
+
+
+def long_term_date(buy_date, months):
+    """First date on which a lot bought on buy_date counts as long-term."""
+    month_index = buy_date.month - 1 + months
+    year, month = buy_date.year + month_index // 12, month_index % 12 + 1
+    day = min(buy_date.day, calendar.monthrange(year, month)[1])
+    return datetime.date(year, month, day) + datetime.timedelta(days=1)
+
+
+def holding_term(buy_date, sell_date, months):
+    return 'LTCG' if sell_date >= long_term_date(buy_date, months) else 'STCG'
+
+
+def long_term_months_by_fund(session: Session, fund_ids):
+    """{fund_id: months} from each fund's category, one query."""
+    rows = (
+        session.query(Fund.id, Category.name)
+               .outerjoin(SubCategory, Fund.sub_category_id == SubCategory.id)
+               .outerjoin(Category, SubCategory.category_id == Category.id)
+               .filter(Fund.id.in_(list(fund_ids)))
+               .all()
+    )
+    months = {fund_id: LONG_TERM_MONTHS.get(category, DEFAULT_LONG_TERM_MONTHS) for fund_id, category in rows}
+    return {fund_id: months.get(fund_id, DEFAULT_LONG_TERM_MONTHS) for fund_id in fund_ids}
+
+
+def gain_row(user_id, fund_id, buy_date, sell_date, units, cost, proceeds, months):
+    """RealizedGain mapping for one sell/lot match (units in micro-units, money in paise)."""
+    return {
+        "user_id": user_id,
+        "fund_id": fund_id,
+        "buy_date": buy_date,
+        "sell_date": sell_date,
+        "units": from_fixed(units, UNIT_DIGITS),
+        "cost": from_fixed(cost, PAISE_DIGITS),
+        "proceeds": from_fixed(proceeds, PAISE_DIGITS),
+        "gain": from_fixed(proceeds - cost, PAISE_DIGITS),
+        "holding_days": (sell_date - buy_date).days,
+        "term": holding_term(buy_date, sell_date, months),
+        "financial_year": financial_year(sell_date),
+    }
+
+
+# ---------------------------------------------------------
+# Report
+# ---------------------------------------------------------
+def realized_summary(session: Session, user_ids, fy=None):
+    """
+    Realized STCG/LTCG per financial year, fund and user, aggregated in SQL
+    from the stored matches.
+    """
+    query = (
+        session.query(
+            RealizedGain.financial_year, RealizedGain.user_id, RealizedGain.fund_id,
+            RealizedGain.term,
+            func.sum(RealizedGain.cost), func.sum(RealizedGain.proceeds), func.sum(RealizedGain.gain),
+        )
+        .filter(RealizedGain.user_id.in_(user_ids))
+    )
+    if fy:
+        query = query.filter(RealizedGain.financial_year == fy)
+
+    rows = {}
+    for year, user_id, fund_id, term, cost, proceeds, gain in query.group_by(
+        RealizedGain.financial_year, RealizedGain.user_id, RealizedGain.fund_id, RealizedGain.term
+    ):
+        row = rows.setdefault((year, user_id, fund_id), {
+            "financial_year": year,
+            "user_id": user_id,
+            "fund_id": fund_id,
+            "stcg": 0, "ltcg": 0, "cost": 0, "proceeds": 0,
+        })
+        row["stcg" if term == 'STCG' else "ltcg"] += to_paise(gain)
+        row["cost"] += to_paise(cost)
+        row["proceeds"] += to_paise(proceeds)
+
+    for row in rows.values():
+        for key in ("stcg", "ltcg", "cost", "proceeds"):
+            row[key] = paise_to_rupees(row[key])
+    return sorted(rows.values(), key=lambda r: (r["financial_year"], r["user_id"], r["fund_id"]))
+
+
+def unrealized_lots(session: Session, user_ids, as_of=None):
+    """
+    Open lots with their unrealized gain at the latest NAV and the date each
+    becomes long-term.
+    """
+    as_of = as_of or datetime.date.today()
+    lots = (
+        session.query(InvestmentHistory.user_id, InvestmentHistory.fund_id,
+                      InvestmentHistory.tx_date, InvestmentHistory.units,
+                      InvestmentHistory.total_cost, InvestmentHistory.units_remaining)
+               .filter(InvestmentHistory.user_id.in_(user_ids),
+                       InvestmentHistory.tx_type == 'BUY',
+                       InvestmentHistory.units_remaining > 0)
+               .order_by(InvestmentHistory.fund_id, InvestmentHistory.tx_date, InvestmentHistory.id)
+               .all()
+    )
+    if not lots:
+        return []
+
+    fund_ids = {lot.fund_id for lot in lots}
+    if as_of == datetime.date.today():
+        # Today: the latest NAVs kept on the fund rows, cached per process
+        navs = {
+            fund_id: nav
+            for fund_id, (nav, nav_date) in latest_nav_cache.get(session, fund_ids).items()
+            if nav_date <= as_of
+        }
+    else:
+        latest = (
+            session.query(FundNAVHistory.fund_id, func.max(FundNAVHistory.nav_date).label("nav_date"))
+                   .filter(FundNAVHistory.fund_id.in_(fund_ids), FundNAVHistory.nav_date <= as_of)
+                   .group_by(FundNAVHistory.fund_id)
+                   .subquery()
+        )
+        navs = dict(
+            session.query(FundNAVHistory.fund_id, FundNAVHistory.nav_value)
+                   .join(latest, (FundNAVHistory.fund_id == latest.c.fund_id)
+                         & (FundNAVHistory.nav_date == latest.c.nav_date))
+                   .all()
+        )
+    months = long_term_months_by_fund(session, fund_ids)
+
+    results = []
+    for user_id, fund_id, buy_date, units, total_cost, remaining in lots:
+        units, remaining = to_micro_units(units), to_micro_units(remaining)
+        cost = to_paise(total_cost)
+        if remaining != units:
+            cost = round_div(cost * remaining, units)
+        nav = navs.get(fund_id)
+        value = value_in_paise(remaining, to_nav_scale(nav)) if nav is not None else None
+        lt_date = long_term_date(buy_date, months[fund_id])
+
+        results.append({
+            "user_id": user_id,
+            "fund_id": fund_id,
+            "buy_date": buy_date,
+            "units": micro_units_to_units(remaining),
+            "cost": paise_to_rupees(cost),
+            "current_value": paise_to_rupees(value) if value is not None else None,
+            "unrealized_gain": paise_to_rupees(value - cost) if value is not None else None,
+            "long_term_from": lt_date,
+            "term": 'LTCG' if as_of >= lt_date else 'STCG',
+        })
+    return results
+
+
+def capital_gains_report(session: Session, user_ids, fy=None):
+    realized = realized_summary(session, user_ids, fy)
+    unrealized = unrealized_lots(session, user_ids)
+
+    fund_ids = {r["fund_id"] for r in realized} | {r["fund_id"] for r in unrealized}
+    names = dict(session.query(Fund.id, Fund.name).filter(Fund.id.in_(fund_ids)).all()) if fund_ids else {}
+    for row in realized + unrealized:
+        row["fund_name"] = names.get(row["fund_id"])
+
+    return {
+        "financial_year": fy,
+        "realized": realized,
+        "totals": {
+            "stcg": round(sum(r["stcg"] for r in realized), 2),
+            "ltcg": round(sum(r["ltcg"] for r in realized), 2),
+        },
+        "unrealized": unrealized,
+    }
+
+
+CSV_COLUMNS = ("financial_year", "user_id", "fund_id", "fund_name", "buy_date", "sell_date",
+               "units", "cost", "proceeds", "gain", "holding_days", "term")
+
+
+def iter_realized_gains_csv(session: Session, user_ids, fy=None, batch_size=1000):
+    """Lot-level realized gains as CSV lines, streamed in batches."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return line
+
+    writer.writerow(CSV_COLUMNS)
+    yield flush()
+
+    query = (
+        session.query(RealizedGain, Fund.name)
+               .join(Fund, RealizedGain.fund_id == Fund.id)
+               .filter(RealizedGain.user_id.in_(user_ids))
+    )
+    if fy:
+        query = query.filter(RealizedGain.financial_year == fy)
+    query = query.order_by(RealizedGain.sell_date, RealizedGain.id).yield_per(batch_size)
+
+    for gain, fund_name in query:
+        writer.writerow((
+            gain.financial_year, gain.user_id, gain.fund_id, fund_name,
+            gain.buy_date.isoformat(), gain.sell_date.isoformat(),
+            gain.units, gain.cost, gain.proceeds, gain.gain, gain.holding_days, gain.term,
+        ))
+        yield flush()
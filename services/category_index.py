@@ -0,0 +1,218 @@
+import calendar
+import datetime
+from bisect import bisect_right
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import Fund, FundNAVHistory, CategoryIndex
+
+# Value of every index on its first point
+INDEX_BASE = 100.0
+
+# NAVs loaded before the last stored point, so each fund has an as-of NAV there
+LOOKBACK_DAYS = 45
+
+
+def cutoff_dates_between(start, end):
+    """15th and month-end dates with start ≤ date ≤ end."""
+    dates = []
+    year, month = start.year, start.month
+    while datetime.date(year, month, 1) <= end:
+        for d in (datetime.date(year, month, 15),
+                  datetime.date(year, month, calendar.monthrange(year, month)[1])):
+            if start <= d <= end:
+                dates.append(d)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return dates
+
+
+# ---------------------------------------------------------
+# Computation (one subcategory, all its funds at once)
+# ---------------------------------------------------------
+def compute_index_points(nav_series, grid, start_value=INDEX_BASE):
+    """
+    Chain an equal-weighted index over `grid` (sorted dates; grid[0] is the
+    anchor already valued at start_value).
+
+    nav_series : {fund_id: ([nav_date, ...], [nav, ...])} in date order
+
+    Each fund is read as-of every grid date. A fund counts in the period
+    grid[j-1] → grid[j] when it had a NAV on or before grid[j-1] and a newer
+    one by grid[j]; the period's index return is the plain mean of those
+    funds' returns (0 when none qualify).
+
+    Returns [(date, value, fund_count), ...] for grid[1:].
+    """
+    if len(grid) < 2:
+        return []
+
+    grid_ordinals = np.array([d.toordinal() for d in grid], dtype=np.int64)
+    sums = np.zeros(len(grid) - 1)
+    counts = np.zeros(len(grid) - 1, dtype=np.int64)
+
+    for dates, navs in nav_series.values():
+        if not dates:
+            continue
+        ordinals = np.array([d.toordinal() for d in dates], dtype=np.int64)
+        values = np.asarray(navs, dtype=float)
+
+        pos = np.searchsorted(ordinals, grid_ordinals, side="right") - 1
+        known = pos >= 0
+        pos = np.where(known, pos, 0)
+        asof_nav = values[pos]
+        asof_date = ordinals[pos]
+
+        valid = known[:-1] & (asof_date[1:] > grid_ordinals[:-1]) & (asof_nav[:-1] > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = asof_nav[1:] / asof_nav[:-1] - 1.0
+        sums += np.where(valid, returns, 0.0)
+        counts += valid
+
+    period_returns = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    values = start_value * np.cumprod(1.0 + period_returns)
+    return [
+        (grid[j + 1], float(values[j]), int(counts[j]))
+        for j in range(len(grid) - 1)
+    ]
+
+
+# ---------------------------------------------------------
+# Persistence
+# ---------------------------------------------------------
+def _last_points(session: Session, sub_category_ids):
+    """{sub_category_id: CategoryIndex} for the latest stored point of each."""
+    latest = (
+        session.query(CategoryIndex.sub_category_id, func.max(CategoryIndex.index_date).label("index_date"))
+               .filter(CategoryIndex.sub_category_id.in_(sub_category_ids))
+               .group_by(CategoryIndex.sub_category_id)
+               .subquery()
+    )
+    rows = (
+        session.query(CategoryIndex)
+               .join(latest, (CategoryIndex.sub_category_id == latest.c.sub_category_id)
+                             & (CategoryIndex.index_date == latest.c.index_date))
+               .all()
+    )
+    return {r.sub_category_id: r for r in rows}
+
+
+def _load_navs(session: Session, sub_category_ids, since=None):
+    """{sub_category_id: {fund_id: ([date, ...], [nav, ...])}}, one query."""
+    query = (
+        session.query(Fund.sub_category_id, FundNAVHistory.fund_id,
+                      FundNAVHistory.nav_date, FundNAVHistory.nav_value)
+               .join(Fund, Fund.id == FundNAVHistory.fund_id)
+               .filter(Fund.sub_category_id.in_(sub_category_ids))
+    )
+    if since is not None:
+        query = query.filter(FundNAVHistory.nav_date >= since)
+
+    by_sub_category = {}
+    for sub_category_id, fund_id, nav_date, nav_value in query.order_by(FundNAVHistory.fund_id, FundNAVHistory.nav_date):
+        if nav_value is None:
+            continue
+        dates, navs = by_sub_category.setdefault(sub_category_id, {}).setdefault(fund_id, ([], []))
+        if dates and dates[-1] == nav_date:
+            continue
+        dates.append(nav_date)
+        navs.append(float(nav_value))
+    return by_sub_category
+
+
+def refresh_category_indices(session: Session, sub_category_ids=None, full=False):
+    """
+    Append index points for every cutoff date after each subcategory's last
+    stored point, up to its latest NAV date. Only NAVs from LOOKBACK_DAYS
+    before that point are read. With full=True (or no stored point) the
+    index is rebuilt from the subcategory's first NAV. Adds rows to the
+    session; the caller commits. Returns the number of points added.
+    """
+    if sub_category_ids is None:
+        sub_category_ids = [
+            sid for (sid,) in session.query(Fund.sub_category_id)
+                                     .filter(Fund.sub_category_id.isnot(None))
+                                     .distinct()
+        ]
+    sub_category_ids = list(sub_category_ids)
+    if not sub_category_ids:
+        return 0
+
+    if full:
+        session.query(CategoryIndex).filter(
+            CategoryIndex.sub_category_id.in_(sub_category_ids)
+        ).delete(synchronize_session=False)
+        last_points = {}
+    else:
+        last_points = _last_points(session, sub_category_ids)
+
+    since = None
+    if last_points and len(last_points) == len(sub_category_ids):
+        since = min(p.index_date for p in last_points.values()) - datetime.timedelta(days=LOOKBACK_DAYS)
+    navs_by_sub_category = _load_navs(session, sub_category_ids, since=since)
+
+    added = 0
+    for sub_category_id, nav_series in navs_by_sub_category.items():
+        latest_nav_date = max(dates[-1] for dates, _ in nav_series.values())
+        last = last_points.get(sub_category_id)
+
+        if last is None:
+            first_nav_date = min(dates[0] for dates, _ in nav_series.values())
+            grid = cutoff_dates_between(first_nav_date, latest_nav_date)
+            if not grid:
+                continue
+            start_value = INDEX_BASE
+            session.add(CategoryIndex(
+                sub_category_id=sub_category_id, index_date=grid[0],
+                index_value=INDEX_BASE,
+                fund_count=sum(1 for dates, _ in nav_series.values() if dates[0] <= grid[0]),
+            ))
+            added += 1
+        else:
+            grid = [last.index_date] + cutoff_dates_between(
+                last.index_date + datetime.timedelta(days=1), latest_nav_date
+            )
+            start_value = last.index_value
+
+        for index_date, value, fund_count in compute_index_points(nav_series, grid, start_value):
+            session.add(CategoryIndex(
+                sub_category_id=sub_category_id, index_date=index_date,
+                index_value=value, fund_count=fund_count,
+            ))
+            added += 1
+
+    return added
+
+
+# ---------------------------------------------------------
+# Reads
+# ---------------------------------------------------------
+def load_index_series(session: Session, sub_category_ids, since=None):
+    """{sub_category_id: ([date, ...], [value, ...])}, one query."""
+    sub_category_ids = [sid for sid in set(sub_category_ids) if sid is not None]
+    if not sub_category_ids:
+        return {}
+    query = (
+        session.query(CategoryIndex.sub_category_id, CategoryIndex.index_date, CategoryIndex.index_value)
+               .filter(CategoryIndex.sub_category_id.in_(sub_category_ids))
+    )
+    if since is not None:
+        query = query.filter(CategoryIndex.index_date >= since)
+
+    series = {}
+    for sub_category_id, index_date, value in query.order_by(CategoryIndex.sub_category_id, CategoryIndex.index_date):
+        dates, values = series.setdefault(sub_category_id, ([], []))
+        dates.append(index_date)
+        values.append(value)
+    return series
+
+
+def index_return(series, start, end):
+    """Index growth from start to end (as-of lookups), or None if it doesn't cover start."""
+    if not series:
+        return None
+    dates, values = series
+    lo = bisect_right(dates, start)
+    hi = bisect_right(dates, end)
+    if not lo or not hi or values[lo - 1] <= 0:
+        return None
+    return values[hi - 1] / values[lo - 1] - 1.0
@@ -0,0 +1,251 @@
+import math
+import numpy as np
+from sqlalchemy import func, and_
+from sqlalchemy.orm import Session
+from models import FundNAVHistory, FundMetric
+from money import NAV_DIGITS, to_nav_scale, from_fixed
+
+# Annual rate the Sharpe-like ratio is measured against
+RISK_FREE_RATE = 0.065
+
+# With fewer NAV-to-NAV returns than this, the annualized figures stay empty
+MIN_RETURNS = 12
+
+DAYS_PER_YEAR = 365.25
+
+
+# ---------------------------------------------------------
+# Computation (NumPy over a NAV series or the new tail of one)
+# ---------------------------------------------------------
+def accumulate_navs(dates, navs, state=None):
+    """
+    Fold NAV points into running risk state.
+
+    dates/navs are in date order and, when `state` is given, all after its
+    as_of_date. Period returns are taken between consecutive NAV points.
+    Mean and Σ(r - mean)² of the new returns are merged into the running
+    values with the pairwise (Chan) update, so extending a fund by a few
+    points gives the same result as recomputing the whole series. Drawdown
+    carries the running peak forward.
+
+    Returns a new state dict, or `state` itself when there are no points.
+    """
+    navs = np.asarray(navs, dtype=float)
+    if navs.size == 0:
+        return state
+
+    if state is None:
+        state = {
+            "as_of_date": dates[0],
+            "nav_points": 1,
+            "first_nav_date": dates[0],
+            "first_nav": float(navs[0]),
+            "last_nav": float(navs[0]),
+            "peak_nav": float(navs[0]),
+            "mean_return": 0.0,
+            "m2_return": 0.0,
+            "downside_sq_sum": 0.0,
+            "max_drawdown": 0.0,
+        }
+        dates, navs = dates[1:], navs[1:]
+        if navs.size == 0:
+            return state
+
+    prices = np.concatenate(([state["last_nav"]], navs))
+    returns = prices[1:] / prices[:-1] - 1.0
+
+    n_old = state["nav_points"] - 1
+    n_new = returns.size
+    n_total = n_old + n_new
+    mean_new = returns.mean()
+    delta = mean_new - state["mean_return"]
+
+    peaks = np.maximum.accumulate(np.concatenate(([state["peak_nav"]], navs)))[1:]
+
+    return {
+        "as_of_date": dates[-1],
+        "nav_points": state["nav_points"] + n_new,
+        "first_nav_date": state["first_nav_date"],
+        "first_nav": state["first_nav"],
+        "last_nav": float(navs[-1]),
+        "peak_nav": float(peaks[-1]),
+        "mean_return": state["mean_return"] + delta * n_new / n_total,
+        "m2_return": (
+            state["m2_return"]
+            + float(((returns - mean_new) ** 2).sum())
+            + delta * delta * n_old * n_new / n_total
+        ),
+        "downside_sq_sum": state["downside_sq_sum"] + float((np.minimum(returns, 0.0) ** 2).sum()),
+        "max_drawdown": min(state["max_drawdown"], float((navs / peaks - 1.0).min())),
+    }
+
+
+def annualize(state, risk_free_rate=RISK_FREE_RATE):
+    """
+    Annualized return, volatility, downside deviation (below a 0% period
+    return) and Sharpe-like ratio from a running state. The NAV series is
+    irregular (15th and month-end cutoffs), so periods per year is taken
+    from the history itself.
+    """
+    empty = {"annualized_return": None, "volatility": None, "downside_deviation": None, "sharpe_ratio": None}
+    n = state["nav_points"] - 1
+    years = (state["as_of_date"] - state["first_nav_date"]).days / DAYS_PER_YEAR
+    if n < MIN_RETURNS or years <= 0 or state["first_nav"] <= 0:
+        return empty
+
+    scale = math.sqrt(n / years)
+    annualized_return = (state["last_nav"] / state["first_nav"]) ** (1.0 / years) - 1.0
+    volatility = math.sqrt(state["m2_return"] / (n - 1)) * scale
+    downside_deviation = math.sqrt(state["downside_sq_sum"] / n) * scale
+
+    return {
+        "annualized_return": annualized_return,
+        "volatility": volatility,
+        "downside_deviation": downside_deviation,
+        "sharpe_ratio": (annualized_return - risk_free_rate) / volatility if volatility > 0 else None,
+    }
+
+
+# ---------------------------------------------------------
+# Persistence
+# ---------------------------------------------------------
+def _nav_decimal(value):
+    return from_fixed(to_nav_scale(value), NAV_DIGITS)
+
+
+def _state_from_row(metric):
+    return {
+        "as_of_date": metric.as_of_date,
+        "nav_points": metric.nav_points,
+        "first_nav_date": metric.first_nav_date,
+        "first_nav": float(metric.first_nav),
+        "last_nav": float(metric.last_nav),
+        "peak_nav": float(metric.peak_nav),
+        "mean_return": metric.mean_return,
+        "m2_return": metric.m2_return,
+        "downside_sq_sum": metric.downside_sq_sum,
+        "max_drawdown": metric.max_drawdown,
+    }
+
+
+def _apply_state(metric, state):
+    for key in ("as_of_date", "nav_points", "first_nav_date", "mean_return",
+                "m2_return", "downside_sq_sum", "max_drawdown"):
+        setattr(metric, key, state[key])
+    metric.first_nav = _nav_decimal(state["first_nav"])
+    metric.last_nav = _nav_decimal(state["last_nav"])
+    metric.peak_nav = _nav_decimal(state["peak_nav"])
+    for key, value in annualize(state).items():
+        setattr(metric, key, value)
+    return metric
+
+
+def latest_fund_metrics(session: Session, fund_ids):
+    """{fund_id: FundMetric} with the most recent as_of_date per fund, one query."""
+    fund_ids = list(fund_ids)
+    if not fund_ids:
+        return {}
+    latest = (
+        session.query(FundMetric.fund_id, func.max(FundMetric.as_of_date).label("as_of_date"))
+               .filter(FundMetric.fund_id.in_(fund_ids))
+               .group_by(FundMetric.fund_id)
+               .subquery()
+    )
+    rows = (
+        session.query(FundMetric)
+               .join(latest, and_(FundMetric.fund_id == latest.c.fund_id,
+                                  FundMetric.as_of_date == latest.c.as_of_date))
+               .all()
+    )
+    return {m.fund_id: m for m in rows}
+
+
+def _load_navs(session: Session, fund_ids, after=None):
+    """{fund_id: ([date, ...], [nav, ...])}, one point per date, positive NAVs only."""
+    query = (
+        session.query(FundNAVHistory.fund_id, FundNAVHistory.nav_date, FundNAVHistory.nav_value)
+               .filter(FundNAVHistory.fund_id.in_(list(fund_ids)))
+    )
+    if after:
+        query = query.filter(FundNAVHistory.nav_date > min(after.values()))
+
+    series = {}
+    for fund_id, nav_date, nav_value in query.order_by(FundNAVHistory.fund_id, FundNAVHistory.nav_date):
+        if nav_value is None or nav_value <= 0:
+            continue
+        if after and fund_id in after and nav_date <= after[fund_id]:
+            continue
+        dates, navs = series.setdefault(fund_id, ([], []))
+        if dates and dates[-1] == nav_date:
+            continue
+        dates.append(nav_date)
+        navs.append(float(nav_value))
+    return series
+
+
+def refresh_fund_metrics(session: Session, fund_ids=None, full=False):
+    """
+    Bring FundMetric up to date with FundNAVHistory; call after a NAV load.
+
+    A fund whose latest row still covers the same NAV points up to its
+    as_of_date is extended with only the newer points, written as a new row
+    for the new as_of_date. Funds with no row yet, or whose history changed
+    on or before as_of_date, are recomputed from the full series (also with
+    full=True). Adds rows to the session; the caller commits.
+    Returns the number of funds written.
+    """
+    if fund_ids is None:
+        fund_ids = [fid for (fid,) in session.query(FundNAVHistory.fund_id).distinct()]
+    fund_ids = list(fund_ids)
+    if not fund_ids:
+        return 0
+
+    latest = {} if full else latest_fund_metrics(session, fund_ids)
+    if latest:
+        # Distinct NAV dates up to each stored as_of_date: a mismatch means
+        # points were back-filled or removed, so that fund starts over
+        covered = dict(
+            session.query(FundNAVHistory.fund_id, func.count(func.distinct(FundNAVHistory.nav_date)))
+                   .join(FundMetric, and_(FundMetric.fund_id == FundNAVHistory.fund_id,
+                                          FundNAVHistory.nav_date <= FundMetric.as_of_date))
+                   .filter(FundMetric.id.in_([m.id for m in latest.values()]),
+                           FundNAVHistory.nav_value > 0)
+                   .group_by(FundNAVHistory.fund_id)
+                   .all()
+        )
+        latest = {
+            fund_id: m for fund_id, m in latest.items()
+            if covered.get(fund_id) == m.nav_points
+        }
+
+    rebuild_ids = [fund_id for fund_id in fund_ids if fund_id not in latest]
+    new_navs = {}
+    if latest:
+        new_navs.update(_load_navs(session, latest, after={f: m.as_of_date for f, m in latest.items()}))
+    if rebuild_ids:
+        new_navs.update(_load_navs(session, rebuild_ids))
+
+    states = {}
+    for fund_id, (dates, navs) in new_navs.items():
+        previous = latest.get(fund_id)
+        states[fund_id] = accumulate_navs(
+            dates, navs, _state_from_row(previous) if previous is not None else None
+        )
+
+    # A recomputed fund may land on an as_of_date that already has a row
+    existing = {}
+    rebuilt = [fund_id for fund_id in rebuild_ids if fund_id in states]
+    if rebuilt:
+        for m in (session.query(FundMetric)
+                         .filter(FundMetric.fund_id.in_(rebuilt),
+                                 FundMetric.as_of_date.in_({states[f]["as_of_date"] for f in rebuilt}))):
+            existing[(m.fund_id, m.as_of_date)] = m
+
+    for fund_id, state in states.items():
+        metric = existing.get((fund_id, state["as_of_date"]))
+        if metric is None:
+            metric = FundMetric(fund_id=fund_id)
+            session.add(metric)
+        _apply_state(metric, state)
+
+    return len(states)
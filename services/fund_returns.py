@@ -0,0 +1,180 @@
+import calendar
+import datetime
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import FundNAVHistory, FundReturn
+from money import NAV_DIGITS, NAV_SCALE, to_nav_scale, from_fixed
+from nav_store import store_series
+
+# Trailing windows in months → FundReturn column of the point-to-point return
+TRAILING_MONTHS = {
+    "return_1m": 1,
+    "return_3m": 3,
+    "return_6m": 6,
+    "return_1y": 12,
+    "return_3y": 36,
+    "return_5y": 60,
+}
+
+# Annualized columns and the point-to-point window they come from
+CAGR_COLUMNS = {"cagr_3y": "return_3y", "cagr_5y": "return_5y"}
+
+# Fund index stride in the combined (fund, date) sort key; above any day ordinal
+_KEY_STRIDE = 10 ** 7
+
+
+def months_before(d, months):
+    """Same day `months` earlier, clamped to the end of a shorter month."""
+    month_index = d.year * 12 + d.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return datetime.date(year, month, min(d.day, calendar.monthrange(year, month)[1]))
+
+
+# ---------------------------------------------------------
+# Computation (all funds in one pass)
+# ---------------------------------------------------------
+def compute_trailing_returns(nav_series):
+    """
+    Trailing returns for many funds at once.
+
+    nav_series : {fund_id: ([nav_date, ...], [nav, ...])} in date order
+
+    All series are concatenated and keyed by (fund, date) so a single
+    searchsorted finds, for every fund and window, the last NAV on or before
+    "latest NAV date minus N months". A window reaching back past a fund's
+    first NAV gives None. CAGR uses the actual days between the two NAVs.
+
+    Returns {fund_id: {"as_of_date", "nav", <FundReturn columns>}}.
+    """
+    nav_series = {f: s for f, s in nav_series.items() if s[0]}
+    if not nav_series:
+        return {}
+
+    fund_ids = list(nav_series)
+    lengths = np.array([len(dates) for dates, _ in nav_series.values()])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    last = starts + lengths - 1
+
+    ordinals = np.array(
+        [d.toordinal() for dates, _ in nav_series.values() for d in dates], dtype=np.int64
+    )
+    navs = np.array([v for _, values in nav_series.values() for v in values], dtype=float)
+    fund_index = np.repeat(np.arange(len(fund_ids)), lengths)
+    keys = fund_index * _KEY_STRIDE + ordinals
+
+    as_of = [datetime.date.fromordinal(int(o)) for o in ordinals[last]]
+    columns = list(TRAILING_MONTHS)
+    targets = np.array(
+        [[months_before(d, TRAILING_MONTHS[c]).toordinal() for c in columns] for d in as_of],
+        dtype=np.int64,
+    )
+
+    pos = np.searchsorted(keys, np.arange(len(fund_ids))[:, None] * _KEY_STRIDE + targets, side="right") - 1
+    valid = pos >= starts[:, None]
+    pos = np.where(valid, pos, 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = navs[last][:, None] / navs[pos]
+        years = (ordinals[last][:, None] - ordinals[pos]) / 365.0
+        cagr = growth ** (1.0 / np.where(years > 0, years, 1.0)) - 1.0
+    valid &= np.isfinite(growth) & (navs[pos] > 0)
+    point_to_point = np.where(valid, growth - 1.0, np.nan)
+    cagr = np.where(valid & (years > 0), cagr, np.nan)
+
+    results = {}
+    for i, fund_id in enumerate(fund_ids):
+        row = {"as_of_date": as_of[i], "nav": float(navs[last[i]])}
+        for j, column in enumerate(columns):
+            value = point_to_point[i, j]
+            row[column] = None if np.isnan(value) else float(value)
+        for column, source in CAGR_COLUMNS.items():
+            value = cagr[i, columns.index(source)]
+            row[column] = None if np.isnan(value) else float(value)
+        results[fund_id] = row
+    return results
+
+
+# ---------------------------------------------------------
+# Persistence
+# ---------------------------------------------------------
+def stale_fund_ids(session: Session):
+    """Funds whose latest NAV date differs from their stored returns (or have none)."""
+    latest = (
+        session.query(FundNAVHistory.fund_id, func.max(FundNAVHistory.nav_date).label("nav_date"))
+               .group_by(FundNAVHistory.fund_id)
+               .subquery()
+    )
+    rows = (
+        session.query(latest.c.fund_id)
+               .outerjoin(FundReturn, FundReturn.fund_id == latest.c.fund_id)
+               .filter((FundReturn.fund_id.is_(None)) | (FundReturn.as_of_date != latest.c.nav_date))
+               .all()
+    )
+    return [fund_id for (fund_id,) in rows]
+
+
+def _load_navs(session: Session, fund_ids):
+    """{fund_id: ([date, ...], [nav, ...])}, one point per date, from the NAV store or one query."""
+    stored, missing = store_series(fund_ids)
+    series = {
+        fund_id: ([datetime.date.fromordinal(o) for o in ordinals.tolist()], (navs / NAV_SCALE).tolist())
+        for fund_id, (ordinals, navs) in stored.items()
+    }
+    if not missing:
+        return series
+
+    query = (
+        session.query(FundNAVHistory.fund_id, FundNAVHistory.nav_date, FundNAVHistory.nav_value)
+               .filter(FundNAVHistory.fund_id.in_(missing))
+               .order_by(FundNAVHistory.fund_id, FundNAVHistory.nav_date)
+    )
+    for fund_id, nav_date, nav_value in query:
+        if nav_value is None:
+            continue
+        dates, navs = series.setdefault(fund_id, ([], []))
+        if dates and dates[-1] == nav_date:
+            continue
+        dates.append(nav_date)
+        navs.append(float(nav_value))
+    return series
+
+
+def refresh_fund_returns(session: Session, fund_ids=None):
+    """
+    Recompute trailing returns for the given funds (by default every fund
+    whose NAVs moved past its stored row) in one pass and upsert their
+    FundReturn rows. The caller commits. Returns the number of funds written.
+    """
+    if fund_ids is None:
+        fund_ids = stale_fund_ids(session)
+    fund_ids = list(fund_ids)
+    if not fund_ids:
+        return 0
+
+    computed = compute_trailing_returns(_load_navs(session, fund_ids))
+    existing = {
+        r.fund_id: r
+        for r in session.query(FundReturn).filter(FundReturn.fund_id.in_(list(computed)))
+    }
+    for fund_id, values in computed.items():
+        row = existing.get(fund_id)
+        if row is None:
+            row = FundReturn(fund_id=fund_id)
+            session.add(row)
+        for key, value in values.items():
+            setattr(row, key, value)
+        row.nav = from_fixed(to_nav_scale(values["nav"]), NAV_DIGITS)
+    return len(computed)
+
+
+def fund_returns_by_id(session: Session, fund_ids):
+    """{fund_id: FundReturn} in one query."""
+    fund_ids = list(fund_ids)
+    if not fund_ids:
+        return {}
+    return {
+        r.fund_id: r
+        for r in session.query(FundReturn).filter(FundReturn.fund_id.in_(fund_ids))
+    }
@@ -1,6 +1,16 @@
+import datetime
+from collections import deque
 from decimal import Decimal
+from sqlalchemy import func, case
 from sqlalchemy.orm import Session
-from models import InvestmentHistory
+from models import Investment, InvestmentHistory, RealizedGain, Fund
+from money import (
+    UNIT_DIGITS, PAISE_DIGITS, NAV_DIGITS, round_div, unit_price, from_fixed,
+    to_paise, to_micro_units, to_nav_scale, value_in_paise, paise_to_rupees,
+    micro_units_to_units, to_fixed_point_txns,
+)
+from services.capital_gains import gain_row, long_term_months_by_fund, DEFAULT_LONG_TERM_MONTHS
+from cashflows import CashFlowSeries
 
 def process_sell(session: Session, user_id: int, fund_id: int,
                  sell_date, sell_units: Decimal, sell_price: Decimal):
@@ -52,3 +62,463 @@ def process_sell(session: Session, user_id: int, fund_id: int,
 
     session.commit()
     return realized_gain
+
+
+# ---------------------------------------------------------
+# Lot ledger maintenance
+# ---------------------------------------------------------
+# InvestmentHistory mirrors what calculate_fifo_returns would compute: one
+# BUY row per buy with units_remaining kept current, one SELL row per sell,
+# plus one RealizedGain row per sell/lot match for the capital-gains report.
+# Callers hand over the Investment rows they just added (after a flush, so
+# ids are set) or the (user_id, fund_id) pairs whose history changed; only
+# those pairs are touched, and each is written back with bulk operations.
+
+
+def _ledger_row(txn):
+    """InvestmentHistory mapping for a FixedPointTxn."""
+    is_buy = txn.transaction_type == 'buy'
+    return {
+        "user_id": txn.user_id,
+        "fund_id": txn.fund_id,
+        "tx_date": txn.date,
+        "tx_type": 'BUY' if is_buy else 'SELL',
+        "units": from_fixed(abs(txn.units), UNIT_DIGITS),
+        "cost_per_unit": from_fixed(unit_price(txn.amount, txn.units), NAV_DIGITS),
+        "total_cost": from_fixed(abs(txn.amount), PAISE_DIGITS),
+        "units_remaining": from_fixed(txn.units if is_buy else 0, UNIT_DIGITS),
+        "_units": txn.units,
+        "_cost": abs(txn.amount),
+        "_remaining": txn.units if is_buy else 0,
+    }
+
+
+def _match_sell(open_lots, units_to_sell):
+    """
+    Consume open lots oldest-first, same rules as calculate_fifo_returns
+    (units the holding cannot cover are dropped).
+    Returns [(lot, units_consumed, cost_consumed)].
+    """
+    matches = []
+    while units_to_sell > 0 and open_lots:
+        lot = open_lots[0]
+        lot_units = lot["_remaining"]
+        if lot_units <= 0:
+            open_lots.popleft()
+            continue
+
+        consumed = min(lot_units, units_to_sell)
+        # Cost by difference of cumulative pro-rata cost, so a lot's chunks
+        # always add back up to its total cost
+        used_before = lot["_units"] - lot_units
+        cost = (round_div(lot["_cost"] * (used_before + consumed), lot["_units"])
+                - round_div(lot["_cost"] * used_before, lot["_units"]))
+        lot["_remaining"] = lot_units - consumed
+        units_to_sell -= consumed
+        matches.append((lot, consumed, cost))
+        if lot["_remaining"] == 0:
+            open_lots.popleft()
+    return matches
+
+
+def _replay(txns, open_lots=None, long_term_months=DEFAULT_LONG_TERM_MONTHS):
+    """
+    FIFO over FixedPointTxns in order.
+    Returns (new_ledger_rows, touched_existing_lots, realized_gain_rows).
+    """
+    open_lots = deque(open_lots or [])
+    new_rows = []
+    touched = {}
+    gains = []
+
+    for txn in txns:
+        if txn.transaction_type not in ('buy', 'sell'):
+            continue
+        row = _ledger_row(txn)
+        new_rows.append(row)
+        if txn.transaction_type == 'buy':
+            open_lots.append(row)
+            continue
+
+        sell_units = abs(txn.units)
+        proceeds_total = abs(txn.amount)
+        matched = 0
+        for lot, units, cost in _match_sell(open_lots, sell_units):
+            if "id" in lot:
+                touched[lot["id"]] = lot
+            proceeds = (round_div(proceeds_total * (matched + units), sell_units)
+                        - round_div(proceeds_total * matched, sell_units))
+            matched += units
+            gains.append(gain_row(txn.user_id, txn.fund_id, lot["tx_date"], txn.date,
+                                  units, cost, proceeds, long_term_months))
+
+    for row in new_rows + list(touched.values()):
+        row["units_remaining"] = from_fixed(row["_remaining"], UNIT_DIGITS)
+
+    return new_rows, list(touched.values()), gains
+
+
+def _strip(rows, keys):
+    return [{k: row[k] for k in keys} for row in rows]
+
+
+_INSERT_KEYS = ("user_id", "fund_id", "tx_date", "tx_type", "units",
+                "cost_per_unit", "total_cost", "units_remaining")
+
+
+def rebuild_ledgers(session: Session, pairs):
+    """
+    Rebuild the ledger for each (user_id, fund_id) pair from Investment rows:
+    one transaction query and one delete per user, a single in-memory FIFO
+    pass per fund, then one bulk insert. A (user_id, None) pair purges the
+    user's legacy ledger rows without a fund, which are no longer written.
+    Does not commit.
+    """
+    funds_by_user = {}
+    unmatched_users = set()
+    for user_id, fund_id in pairs:
+        if fund_id is None:
+            unmatched_users.add(user_id)
+        else:
+            funds_by_user.setdefault(user_id, set()).add(fund_id)
+
+    if unmatched_users:
+        (session.query(InvestmentHistory)
+                .filter(InvestmentHistory.user_id.in_(unmatched_users),
+                        InvestmentHistory.fund_id.is_(None))
+                .delete(synchronize_session=False))
+
+    for user_id, fund_ids in funds_by_user.items():
+        rows = (session.query(Investment)
+                       .filter(Investment.user_id == user_id,
+                               Investment.fund_id.in_(fund_ids))
+                       .order_by(Investment.date.asc(), Investment.id.asc())
+                       .all())
+
+        txns_by_fund = {}
+        for txn in to_fixed_point_txns(rows):
+            txns_by_fund.setdefault(txn.fund_id, []).append(txn)
+
+        months = long_term_months_by_fund(session, fund_ids)
+        inserts = []
+        gains = []
+        for fund_id, txns in txns_by_fund.items():
+            new_rows, _, fund_gains = _replay(txns, long_term_months=months[fund_id])
+            inserts.extend(new_rows)
+            gains.extend(fund_gains)
+
+        for model in (InvestmentHistory, RealizedGain):
+            (session.query(model)
+                    .filter(model.user_id == user_id, model.fund_id.in_(fund_ids))
+                    .delete(synchronize_session=False))
+        if inserts:
+            session.bulk_insert_mappings(InvestmentHistory, _strip(inserts, _INSERT_KEYS))
+        if gains:
+            session.bulk_insert_mappings(RealizedGain, gains)
+
+
+def record_investments(session: Session, investments):
+    """
+    Bring the ledger up to date after Investment rows were added (call after
+    flush, before commit). A pair whose new rows are all dated on or after
+    its last ledger entry is extended in place: only its open lots are read
+    and only the lots a new sell consumes are updated. Backdated rows, or a
+    pair whose ledger is out of step with its history, are rebuilt.
+    """
+    new_by_pair = {}
+    for inv in investments:
+        if inv.fund_id is not None:
+            new_by_pair.setdefault((inv.user_id, inv.fund_id), []).append(inv)
+    if not new_by_pair:
+        return
+
+    user_ids = {user_id for user_id, _ in new_by_pair}
+    fund_ids = {fund_id for _, fund_id in new_by_pair}
+
+    # Ledger tail and size vs. history size, one aggregate query each
+    ledger_state = {
+        (u, f): (count, last_date)
+        for u, f, count, last_date in (
+            session.query(InvestmentHistory.user_id, InvestmentHistory.fund_id,
+                          func.count(InvestmentHistory.id), func.max(InvestmentHistory.tx_date))
+                   .filter(InvestmentHistory.user_id.in_(user_ids),
+                           InvestmentHistory.fund_id.in_(fund_ids))
+                   .group_by(InvestmentHistory.user_id, InvestmentHistory.fund_id)
+        )
+    }
+    history_counts = {
+        (u, f): count
+        for u, f, count in (
+            session.query(Investment.user_id, Investment.fund_id, func.count(Investment.id))
+                   .filter(Investment.user_id.in_(user_ids),
+                           Investment.fund_id.in_(fund_ids),
+                           func.lower(Investment.transaction_type).in_(('buy', 'sell')))
+                   .group_by(Investment.user_id, Investment.fund_id)
+        )
+    }
+
+    months = long_term_months_by_fund(session, fund_ids)
+    to_rebuild = []
+    for pair, new_rows in new_by_pair.items():
+        new_txns = sorted(to_fixed_point_txns(new_rows), key=lambda t: t.date)
+        ledger_count, last_date = ledger_state.get(pair, (0, None))
+        new_count = sum(1 for t in new_txns if t.transaction_type in ('buy', 'sell'))
+
+        in_step = ledger_count + new_count == history_counts.get(pair, 0)
+        if not in_step or (last_date is not None and new_txns[0].date < last_date):
+            to_rebuild.append(pair)
+            continue
+
+        open_lots = [
+            {"id": lot_id, "tx_date": tx_date, "_units": to_micro_units(units),
+             "_cost": to_paise(total_cost), "_remaining": to_micro_units(remaining)}
+            for lot_id, tx_date, units, total_cost, remaining in (
+                session.query(InvestmentHistory.id, InvestmentHistory.tx_date,
+                              InvestmentHistory.units, InvestmentHistory.total_cost,
+                              InvestmentHistory.units_remaining)
+                       .filter(InvestmentHistory.user_id == pair[0],
+                               InvestmentHistory.fund_id == pair[1],
+                               InvestmentHistory.tx_type == 'BUY',
+                               InvestmentHistory.units_remaining > 0)
+                       .order_by(InvestmentHistory.tx_date.asc(), InvestmentHistory.id.asc())
+            )
+        ]
+
+        inserts, updates, gains = _replay(new_txns, open_lots, long_term_months=months[pair[1]])
+        if inserts:
+            session.bulk_insert_mappings(InvestmentHistory, _strip(inserts, _INSERT_KEYS))
+        if updates:
+            session.bulk_update_mappings(InvestmentHistory, _strip(updates, ("id", "units_remaining")))
+        if gains:
+            session.bulk_insert_mappings(RealizedGain, gains)
+
+    if to_rebuild:
+        rebuild_ledgers(session, to_rebuild)
+
+
+def rebuild_user_ledger(session: Session, user_id: int):
+    """Rebuild every fund's ledger for one user and drop rows without a fund (backfill / repair)."""
+    fund_ids = [
+        fund_id for (fund_id,) in
+        session.query(Investment.fund_id)
+               .filter(Investment.user_id == user_id, Investment.fund_id.isnot(None))
+               .distinct()
+    ]
+    stale = [
+        fund_id for (fund_id,) in
+        session.query(InvestmentHistory.fund_id)
+               .filter(InvestmentHistory.user_id == user_id)
+               .distinct()
+    ]
+    rebuild_ledgers(session, {(user_id, f) for f in set(fund_ids) | set(stale)})
+
+
+# ---------------------------------------------------------
+# Ledger reads (dashboards)
+# ---------------------------------------------------------
+def ensure_ledgers(session: Session, user_ids):
+    """
+    Rebuild any (user, fund) ledger whose row count no longer matches the
+    buy/sell history (e.g. data loaded before the ledger was maintained).
+    Two aggregate queries when everything is in step. Does not commit;
+    returns the pairs that were rebuilt.
+    """
+    ledger_counts = dict(
+        ((u, f), count) for u, f, count in
+        session.query(InvestmentHistory.user_id, InvestmentHistory.fund_id,
+                      func.count(InvestmentHistory.id))
+               .filter(InvestmentHistory.user_id.in_(user_ids))
+               .group_by(InvestmentHistory.user_id, InvestmentHistory.fund_id)
+    )
+    history_counts = dict(
+        ((u, f), count) for u, f, count in
+        session.query(Investment.user_id, Investment.fund_id, func.count(Investment.id))
+               .filter(Investment.user_id.in_(user_ids),
+                       Investment.fund_id.isnot(None),
+                       func.lower(Investment.transaction_type).in_(('buy', 'sell')))
+               .group_by(Investment.user_id, Investment.fund_id)
+    )
+
+    stale = [
+        pair for pair in set(ledger_counts) | set(history_counts)
+        if ledger_counts.get(pair, 0) != history_counts.get(pair, 0)
+    ]
+    if stale:
+        rebuild_ledgers(session, stale)
+        session.flush()
+    return stale
+
+
+def load_open_lots(session: Session, user_ids):
+    """
+    {fund_id: [(tx_date, remaining_micro_units, remaining_cost_paise), ...]}
+    from the open BUY lots of all given users, in one query. Lots of several
+    users in the same fund are merged (each user's FIFO is already applied).
+    """
+    rows = (
+        session.query(InvestmentHistory.fund_id, InvestmentHistory.tx_date,
+                      InvestmentHistory.units, InvestmentHistory.total_cost,
+                      InvestmentHistory.units_remaining)
+               .filter(InvestmentHistory.user_id.in_(user_ids),
+                       InvestmentHistory.tx_type == 'BUY',
+                       InvestmentHistory.units_remaining > 0)
+               .order_by(InvestmentHistory.tx_date.asc(), InvestmentHistory.id.asc())
+               .all()
+    )
+
+    lots_by_fund = {}
+    for fund_id, tx_date, units, total_cost, remaining in rows:
+        units = to_micro_units(units)
+        remaining = to_micro_units(remaining)
+        cost = to_paise(total_cost)
+        if remaining != units:
+            cost = round_div(cost * remaining, units)
+        lots_by_fund.setdefault(fund_id, []).append((tx_date, remaining, cost))
+    return lots_by_fund
+
+
+def with_terminal_value(cash_flows, current_value, today):
+    """cash_flows ending in the holding's current value as an inflow, if it has any."""
+    cash_flows = CashFlowSeries.coerce(cash_flows)
+    if cash_flows and current_value > 0:
+        cash_flows = cash_flows.with_flow(today, current_value)
+    return cash_flows
+
+
+def value_open_lots(lots, latest_nav, today=None, cash_flows=None):
+    """
+    Same keys as calculate_fifo_returns(with_xirr=False), from open lots
+    instead of a replay. cash_flows (from load_cash_flows) is only needed
+    when XIRR is wanted; the terminal value is added to a copy.
+    """
+    if today is None:
+        today = datetime.date.today()
+
+    remaining_units = sum(units for _, units, _ in lots)
+    remaining_cost = sum(cost for _, _, cost in lots)
+    positive = [(d, cost) for d, _, cost in lots if cost > 0]
+    held_cost = sum(cost for _, cost in positive)
+    weighted_days = sum((today - d).days * cost for d, cost in positive)
+
+    current_value_paise = value_in_paise(remaining_units, to_nav_scale(latest_nav or 0))
+    current_value = paise_to_rupees(current_value_paise)
+
+    cash_flows = with_terminal_value(cash_flows, current_value, today)
+
+    return {
+        "remaining_units": micro_units_to_units(remaining_units),
+        "cost_value": paise_to_rupees(remaining_cost),
+        "current_value": current_value,
+        "absolute_return": current_value - paise_to_rupees(remaining_cost),
+        "xirr": None,
+        "cash_flows": cash_flows,
+        "remaining_lots": [
+            {"date": d, "units": micro_units_to_units(units), "cost": paise_to_rupees(cost)}
+            for d, units, cost in lots
+        ],
+        "holding_period": (weighted_days / held_cost / 365.0) if held_cost > 0 else 0.0,
+        "cost_value_paise": remaining_cost,
+        "current_value_paise": current_value_paise,
+    }
+
+
+def load_fund_activity(session: Session, user_ids):
+    """
+    Per-fund transaction summary in one aggregate query, in order of each
+    fund's first transaction:
+    {fund_id: {"first_buy", "last_sell", "buy_amount", "sell_amount",
+               "net_units", "plan_type"}}
+    """
+    kind = func.lower(Investment.transaction_type)
+    rows = (
+        session.query(
+            Investment.fund_id,
+            func.min(case((kind == 'buy', Investment.date))),
+            func.max(case((kind == 'sell', Investment.date))),
+            func.sum(case((kind == 'buy', Investment.amount), else_=0)),
+            func.sum(case((kind == 'sell', Investment.amount), else_=0)),
+            func.sum(Investment.units),
+            func.max(Investment.plan_type),
+        )
+        .filter(Investment.user_id.in_(user_ids))
+        .group_by(Investment.fund_id)
+        .order_by(func.min(Investment.date), Investment.fund_id)
+        .all()
+    )
+    return {
+        fund_id: {
+            "first_buy": first_buy,
+            "last_sell": last_sell,
+            "buy_amount": buy_amount or 0,
+            "sell_amount": sell_amount or 0,
+            "net_units": net_units or 0,
+            "plan_type": plan_type,
+        }
+        for fund_id, first_buy, last_sell, buy_amount, sell_amount, net_units, plan_type in rows
+    }
+
+
+def load_cash_flows(session: Session, user_ids, fund_ids=None):
+    """
+    {fund_id: CashFlowSeries} investor cash flows (buys negative, sells
+    positive), read as plain columns. Pass fund_ids to fetch only the funds
+    whose XIRR is actually shown.
+    """
+    query = (
+        session.query(Investment.fund_id, Investment.date,
+                      Investment.transaction_type, Investment.amount)
+               .filter(Investment.user_id.in_(user_ids))
+    )
+    if fund_ids is not None:
+        query = query.filter(Investment.fund_id.in_(list(fund_ids)))
+
+    columns = {}
+    for fund_id, txn_date, txn_type, amount in query.order_by(Investment.date, Investment.id):
+        kind = (txn_type or '').lower()
+        if kind == 'buy':
+            value = -paise_to_rupees(to_paise(amount))
+        elif kind == 'sell':
+            value = abs(paise_to_rupees(to_paise(amount)))
+        else:
+            continue
+        days, amounts = columns.setdefault(fund_id, ([], []))
+        days.append(txn_date.toordinal())
+        amounts.append(value)
+
+    return {
+        fund_id: CashFlowSeries(days, amounts, presorted=True)
+        for fund_id, (days, amounts) in columns.items()
+    }
+
+
+def load_daily_cash_flows(session: Session, user_ids, fund_ids=None):
+    """
+    {sub_category_id: CashFlowSeries} of the users' net investor flow per
+    day, summed in the database and grouped by the fund's subcategory (None
+    for funds without one and transactions without a fund row). Enough for
+    portfolio- and bucket-level XIRR, which do not need per-fund series.
+    """
+    kind = func.lower(Investment.transaction_type)
+    flow = case((kind == 'buy', -Investment.amount), else_=func.abs(Investment.amount))
+    query = (
+        session.query(Fund.sub_category_id, Investment.date, func.sum(flow))
+               .outerjoin(Fund, Fund.id == Investment.fund_id)
+               .filter(Investment.user_id.in_(user_ids), kind.in_(('buy', 'sell')))
+    )
+    if fund_ids is not None:
+        query = query.filter(Investment.fund_id.in_(list(fund_ids)))
+
+    columns = {}
+    for sub_category_id, txn_date, total in query.group_by(
+        Fund.sub_category_id, Investment.date
+    ).order_by(Investment.date):
+        if total is None:
+            continue
+        days, amounts = columns.setdefault(sub_category_id, ([], []))
+        days.append(txn_date.toordinal())
+        amounts.append(paise_to_rupees(to_paise(total)))
+
+    return {
+        sub_category_id: CashFlowSeries(days, amounts, presorted=True)
+        for sub_category_id, (days, amounts) in columns.items()
+    }
@@ -0,0 +1,169 @@
+import threading
+import time
+from sqlalchemy import func, and_
+from sqlalchemy.orm import Session
+from models import Fund, FundNAVHistory
+
+
+# ---------------------------------------------------------
+# Writes (every NAV write path calls note_nav)
+# ---------------------------------------------------------
+def note_nav(fund, nav_date, nav_value):
+    """
+    Advance fund.latest_nav/latest_nav_date to a NAV just written to
+    FundNAVHistory, if it is at least as recent as the stored one (same
+    date = revision). Returns True when the fund row changed.
+    """
+    if nav_date is None or nav_value is None:
+        return False
+    if fund.latest_nav_date is not None and nav_date < fund.latest_nav_date:
+        return False
+    if fund.latest_nav_date == nav_date and fund.latest_nav == nav_value:
+        return False
+    fund.latest_nav = nav_value
+    fund.latest_nav_date = nav_date
+    return True
+
+
+def refresh_latest_navs(session: Session, fund_ids=None):
+    """
+    Recompute latest_nav/latest_nav_date from FundNAVHistory in one query
+    (backfill, or after deleting NAV rows). Funds with no NAV history keep
+    their columns. The caller commits. Returns the number of funds changed.
+    """
+    latest = session.query(
+        FundNAVHistory.fund_id, func.max(FundNAVHistory.nav_date).label("nav_date")
+    )
+    if fund_ids is not None:
+        latest = latest.filter(FundNAVHistory.fund_id.in_(list(fund_ids)))
+    latest = latest.group_by(FundNAVHistory.fund_id).subquery()
+
+    rows = (
+        session.query(Fund, FundNAVHistory.nav_date, func.max(FundNAVHistory.nav_value))
+               .join(latest, latest.c.fund_id == Fund.id)
+               .join(FundNAVHistory, and_(FundNAVHistory.fund_id == latest.c.fund_id,
+                                          FundNAVHistory.nav_date == latest.c.nav_date))
+               .group_by(Fund.id, FundNAVHistory.nav_date)
+               .all()
+    )
+
+    changed = 0
+    for fund, nav_date, nav_value in rows:
+        if fund.latest_nav_date != nav_date or fund.latest_nav != nav_value:
+            fund.latest_nav = nav_value
+            fund.latest_nav_date = nav_date
+            changed += 1
+    return changed
+
+
+# ---------------------------------------------------------
+# Reads
+# ---------------------------------------------------------
+def latest_navs_by_fund(session: Session, fund_ids):
+    """
+    {fund_id: (nav as float, nav_date)} from one IN (...) fetch of fund rows.
+    Funds never written since the column was added (latest_nav_date NULL)
+    are filled from FundNAVHistory in one grouped query.
+    """
+    fund_ids = [fid for fid in set(fund_ids) if fid is not None]
+    if not fund_ids:
+        return {}
+
+    navs = {}
+    missing = []
+    for fund_id, nav, nav_date in (
+        session.query(Fund.id, Fund.latest_nav, Fund.latest_nav_date).filter(Fund.id.in_(fund_ids))
+    ):
+        if nav_date is None or nav is None:
+            missing.append(fund_id)
+        else:
+            navs[fund_id] = (float(nav), nav_date)
+
+    if missing:
+        latest = (
+            session.query(FundNAVHistory.fund_id, func.max(FundNAVHistory.nav_date).label("nav_date"))
+                   .filter(FundNAVHistory.fund_id.in_(missing))
+                   .group_by(FundNAVHistory.fund_id)
+                   .subquery()
+        )
+        for fund_id, nav_date, nav in (
+            session.query(FundNAVHistory.fund_id, FundNAVHistory.nav_date, func.max(FundNAVHistory.nav_value))
+                   .join(latest, and_(FundNAVHistory.fund_id == latest.c.fund_id,
+                                      FundNAVHistory.nav_date == latest.c.nav_date))
+                   .group_by(FundNAVHistory.fund_id, FundNAVHistory.nav_date)
+        ):
+            navs[fund_id] = (float(nav), nav_date)
+
+    return navs
+
+
+# ---------------------------------------------------------
+# Process-wide cache (shared by all request threads)
+# ---------------------------------------------------------
+class LatestNavCache:
+    """
+    fund_id → (nav, nav_date), filled lazily from latest_navs_by_fund.
+
+    Every NAV write path calls invalidate() after committing, which bumps a
+    version counter and drops the entries. A fetch that started under an
+    older version is not stored, so a reader racing a write can never put
+    pre-write NAVs back. Entries also expire after max_age seconds, which
+    picks up NAVs written by other processes (the standalone scheduler).
+    """
+
+    def __init__(self, max_age=600):
+        self.max_age = max_age
+        self._navs = {}
+        self._version = 0
+        self._loaded_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        """Current version; reading it applies the max_age expiry like get() does."""
+        with self._lock:
+            self._expire()
+            return self._version
+
+    def _expire(self):
+        # Caller holds the lock
+        if time.monotonic() - self._loaded_at > self.max_age:
+            self._version += 1
+            self._navs = {}
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._navs = {}
+            self._loaded_at = time.monotonic()
+
+    def get(self, session: Session, fund_ids):
+        """Same result as latest_navs_by_fund; only uncached funds hit the database."""
+        fund_ids = {fid for fid in fund_ids if fid is not None}
+        if not fund_ids:
+            return {}
+
+        with self._lock:
+            self._expire()
+            version = self._version
+            result = {fid: self._navs[fid] for fid in fund_ids if fid in self._navs}
+            missing = [fid for fid in fund_ids if fid not in result]
+            self.hits += len(result)
+            self.misses += len(missing)
+
+        if missing:
+            fetched = latest_navs_by_fund(session, missing)
+            # None marks funds without any NAV so they aren't fetched again
+            fresh = {fid: fetched.get(fid) for fid in missing}
+            with self._lock:
+                if self._version == version:
+                    self._navs.update(fresh)
+            result.update(fresh)
+
+        return {fid: nav for fid, nav in result.items() if nav is not None}
+
+
+latest_nav_cache = LatestNavCache()
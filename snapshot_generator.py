@@ -3,8 +3,10 @@
 import datetime
 import calendar
 from db_config import db
-from models import Investment, Fund, FundNAVHistory, PortfolioSnapshot, User
-from utils import calculate_fifo_returns
+from models import Investment, Fund, PortfolioSnapshot, User
+from utils import calculate_rolling_xirr
+from cashflows import CashFlowSeries
+from valuation_engine import value_portfolio_at_cutoffs, NavResolver
 
 
 # ---------------------------------------------------------
@@ -36,32 +38,36 @@ def generate_cutoff_dates(years_back=10):
 # ---------------------------------------------------------
 def get_nav_for_cutoff(fund_id, cutoff):
     """Get NAV on or before cutoff; fallback to next 15 days."""
-    nav_record = (
-        FundNAVHistory.query
-        .filter(
-            FundNAVHistory.fund_id == fund_id,
-            FundNAVHistory.nav_date <= cutoff
-        )
-        .order_by(FundNAVHistory.nav_date.desc())
-        .first()
-    )
+    return NavResolver([fund_id], [cutoff]).nav(fund_id, cutoff)
 
-    if nav_record:
-        return float(nav_record.nav_value)
 
-    # Fallback: next 15 days
-    nav_record = (
-        FundNAVHistory.query
-        .filter(
-            FundNAVHistory.fund_id == fund_id,
-            FundNAVHistory.nav_date > cutoff,
-            FundNAVHistory.nav_date <= cutoff + datetime.timedelta(days=15)
-        )
-        .order_by(FundNAVHistory.nav_date.asc())
-        .first()
+# ---------------------------------------------------------
+# Investor cash flows (same sign convention as the FIFO engine)
+# ---------------------------------------------------------
+def get_external_cash_flows(user_ids):
+    """
+    Buys as outflows, sells as inflows, for all given users in one query,
+    as a date-ordered CashFlowSeries.
+    """
+    rows = (
+        db.session.query(Investment.date, Investment.transaction_type, Investment.amount)
+        .filter(Investment.user_id.in_(user_ids))
+        .order_by(Investment.date, Investment.id)
+        .all()
     )
 
-    return float(nav_record.nav_value) if nav_record else None
+    days = []
+    amounts = []
+    for txn_date, txn_type, amount in rows:
+        kind = (txn_type or "").lower()
+        if kind == "buy":
+            amounts.append(-float(amount or 0))
+        elif kind == "sell":
+            amounts.append(abs(float(amount or 0)))
+        else:
+            continue
+        days.append(txn_date.toordinal())
+    return CashFlowSeries(days, amounts, presorted=True)
 
 
 # ---------------------------------------------------------
@@ -79,51 +85,27 @@ def generate_personal_snapshots(user_id, years_back=10):
 
     cutoffs = generate_cutoff_dates(years_back)
 
-    # All funds the user has ever invested in
-    funds = (
-        Fund.query.join(Investment)
-        .filter(Investment.user_id == user_id)
-        .distinct()
-        .all()
-    )
-
-    if not funds:
+    # One load of transactions + NAVs, one forward pass over the cutoffs
+    cutoff_values = [
+        (point["date"], point["value"])
+        for point in value_portfolio_at_cutoffs([user_id], cutoffs)
+        if point["value_paise"] > 0
+    ]
+    if not cutoff_values:
         return
 
-    for cutoff in cutoffs:
-        total_value = 0.0
-
-        for fund in funds:
-            # All transactions up to cutoff
-            txns = (
-                Investment.query
-                .filter(
-                    Investment.user_id == user_id,
-                    Investment.fund_id == fund.id,
-                    Investment.date <= cutoff
-                )
-                .order_by(Investment.date)
-                .all()
-            )
-
-            if not txns:
-                continue
-
-            nav_value = get_nav_for_cutoff(fund.id, cutoff)
-            if nav_value is None:
-                continue
-
-            result = calculate_fifo_returns(txns, nav_value, today=cutoff)
-            total_value += result["current_value"]
-
-        if total_value > 0:
-            snap = PortfolioSnapshot(
-                user_id=user_id,
-                snapshot_date=cutoff,
-                portfolio_value=round(total_value, 2),
-                dashboard_type="personal"
-            )
-            db.session.add(snap)
+    # XIRR over time: one forward walk over the cutoffs, warm-started
+    xirr_by_cutoff = calculate_rolling_xirr(get_external_cash_flows([user_id]), cutoff_values)
+
+    for cutoff, total_value in cutoff_values:
+        snap = PortfolioSnapshot(
+            user_id=user_id,
+            snapshot_date=cutoff,
+            portfolio_value=round(total_value, 2),
+            xirr=xirr_by_cutoff.get(cutoff),
+            dashboard_type="personal"
+        )
+        db.session.add(snap)
 
     db.session.commit()
 
@@ -155,51 +137,26 @@ def generate_family_snapshots(family_id, years_back=10):
 
     cutoffs = generate_cutoff_dates(years_back)
 
-    # All funds touched by any family member
-    funds = (
-        Fund.query.join(Investment)
-        .filter(Investment.user_id.in_(member_ids))
-        .distinct()
-        .all()
-    )
-
-    if not funds:
-        print(f"[SNAPSHOT] No funds found for family_id {family_id}, skipping.")
+    cutoff_values = [
+        (point["date"], point["value"])
+        for point in value_portfolio_at_cutoffs(member_ids, cutoffs)
+        if point["value_paise"] > 0
+    ]
+    if not cutoff_values:
+        print(f"[SNAPSHOT] No holdings found for family_id {family_id}, skipping.")
         return
 
-    for cutoff in cutoffs:
-        total_value = 0.0
-
-        for fund in funds:
-            txns = (
-                Investment.query
-                .filter(
-                    Investment.user_id.in_(member_ids),
-                    Investment.fund_id == fund.id,
-                    Investment.date <= cutoff
-                )
-                .order_by(Investment.date)
-                .all()
-            )
-
-            if not txns:
-                continue
-
-            nav_value = get_nav_for_cutoff(fund.id, cutoff)
-            if nav_value is None:
-                continue
-
-            result = calculate_fifo_returns(txns, nav_value, today=cutoff)
-            total_value += result["current_value"]
-
-        if total_value > 0:
-            snap = PortfolioSnapshot(
-                family_id=family_id,
-                snapshot_date=cutoff,
-                portfolio_value=round(total_value, 2),
-                dashboard_type="family"
-            )
-            db.session.add(snap)
+    xirr_by_cutoff = calculate_rolling_xirr(get_external_cash_flows(member_ids), cutoff_values)
+
+    for cutoff, total_value in cutoff_values:
+        snap = PortfolioSnapshot(
+            family_id=family_id,
+            snapshot_date=cutoff,
+            portfolio_value=round(total_value, 2),
+            xirr=xirr_by_cutoff.get(cutoff),
+            dashboard_type="family"
+        )
+        db.session.add(snap)
 
     db.session.commit()
     print(f"[SNAPSHOT] ✅ Family snapshots generated for family_id {family_id}")
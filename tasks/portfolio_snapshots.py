@@ -1,11 +1,13 @@
-from datetime import date, timedelta
+from datetime import date
 from calendar import monthrange
 
 from sqlalchemy import func
 
 from db_config import db
-from models import User, Fund, Investment, FundNAVHistory, PortfolioSnapshot
-from utils import calculate_fifo_returns
+from models import User, Investment, PortfolioSnapshot
+from utils import calculate_rolling_xirr
+from snapshot_generator import get_external_cash_flows
+from valuation_engine import value_portfolio_at_cutoffs
 
 
 def generate_snapshot_dates(start_year=None):
@@ -42,75 +44,6 @@ def generate_snapshot_dates(start_year=None):
     return sorted(set(dates))
 
 
-def calculate_portfolio_value_at_date(user_id, cutoff_date):
-    """
-    Calculate total portfolio value at a specific date for a user,
-    using your existing FIFO engine.
-    """
-    funds = (
-        Fund.query
-        .join(Investment, Investment.fund_id == Fund.id)
-        .filter(
-            Investment.user_id == user_id,
-            Investment.date <= cutoff_date
-        )
-        .distinct()
-        .all()
-    )
-
-    total_value = 0.0
-
-    for fund in funds:
-        nav_record = (
-            FundNAVHistory.query
-            .filter(
-                FundNAVHistory.fund_id == fund.id,
-                FundNAVHistory.nav_date <= cutoff_date
-            )
-            .order_by(FundNAVHistory.nav_date.desc())
-            .first()
-        )
-
-        if nav_record is None:
-            nav_record = (
-                FundNAVHistory.query
-                .filter(
-                    FundNAVHistory.fund_id == fund.id,
-                    FundNAVHistory.nav_date > cutoff_date,
-                    FundNAVHistory.nav_date <= cutoff_date + timedelta(days=15)
-                )
-                .order_by(FundNAVHistory.nav_date.asc())
-                .first()
-            )
-
-        if nav_record is None:
-            continue
-
-        txns = (
-            Investment.query
-            .filter(
-                Investment.user_id == user_id,
-                Investment.fund_id == fund.id,
-                Investment.date <= cutoff_date
-            )
-            .order_by(Investment.date)
-            .all()
-        )
-
-        if not txns:
-            continue
-
-        result = calculate_fifo_returns(
-            txns,
-            float(nav_record.nav_value),
-            today=cutoff_date
-        )
-
-        total_value += float(result["current_value"])
-
-    return round(total_value, 2)
-
-
 def rebuild_user_snapshots(user_id, start_year=None):
     """
     Rebuild all snapshots for a user.
@@ -121,17 +54,26 @@ def rebuild_user_snapshots(user_id, start_year=None):
 
     PortfolioSnapshot.query.filter_by(user_id=user_id).delete()
 
-    snapshots = []
-    for cutoff_date in dates:
-        value = calculate_portfolio_value_at_date(user_id, cutoff_date)
-        if value > 0:
-            snapshots.append(
-                PortfolioSnapshot(
-                    user_id=user_id,
-                    snapshot_date=cutoff_date,
-                    portfolio_value=value,
-                )
-            )
+    # Single sweep over all dates instead of a FIFO replay per date
+    date_values = [
+        (point["date"], point["value"])
+        for point in value_portfolio_at_cutoffs([user_id], dates)
+        if point["value_paise"] > 0
+    ]
+
+    # XIRR over time, as generate_personal_snapshots stores it
+    xirr_by_date = calculate_rolling_xirr(get_external_cash_flows([user_id]), date_values)
+
+    snapshots = [
+        PortfolioSnapshot(
+            user_id=user_id,
+            snapshot_date=snapshot_date,
+            portfolio_value=round(value, 2),
+            xirr=xirr_by_date.get(snapshot_date),
+            dashboard_type="personal",
+        )
+        for snapshot_date, value in date_values
+    ]
 
     if snapshots:
         db.session.bulk_save_objects(snapshots)
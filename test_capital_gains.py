@@ -0,0 +1,40 @@
+from services.capital_gains import (
+    financial_year, long_term_date, holding_term, gain_row, LONG_TERM_MONTHS, DEFAULT_LONG_TERM_MONTHS,
+)
+import datetime
+
+d = datetime.date
+equity = LONG_TERM_MONTHS["Equity"]
+
+# Long-term starts the day after the holding period ends
+assert long_term_date(d(2023, 3, 15), equity) == d(2024, 3, 16)
+assert long_term_date(d(2023, 3, 15), DEFAULT_LONG_TERM_MONTHS) == d(2025, 3, 16)
+assert holding_term(d(2023, 3, 15), d(2024, 3, 15), equity) == 'STCG'
+assert holding_term(d(2023, 3, 15), d(2024, 3, 16), equity) == 'LTCG'
+assert holding_term(d(2023, 3, 15), d(2025, 3, 15), DEFAULT_LONG_TERM_MONTHS) == 'STCG'
+assert holding_term(d(2023, 3, 15), d(2025, 3, 16), DEFAULT_LONG_TERM_MONTHS) == 'LTCG'
+
+# Month-end buys clamp to the last day of the target month
+assert long_term_date(d(2022, 8, 31), 6) == d(2023, 3, 1)
+assert long_term_date(d(2023, 8, 31), 6) == d(2024, 3, 1)
+assert long_term_date(d(2024, 2, 29), equity) == d(2025, 3, 1)
+assert long_term_date(d(2023, 12, 31), 2) == d(2024, 3, 1)
+assert holding_term(d(2024, 2, 29), d(2025, 2, 28), equity) == 'STCG'
+assert holding_term(d(2024, 2, 29), d(2025, 3, 1), equity) == 'LTCG'
+
+# Financial years run April to March
+assert financial_year(d(2024, 3, 31)) == '2023-24'
+assert financial_year(d(2024, 4, 1)) == '2024-25'
+assert financial_year(d(2000, 1, 1)) == '1999-00'
+assert financial_year(d(2099, 12, 31)) == '2099-00'
+
+# A gain row on either side of the boundary, in fixed point (micro-units, paise)
+before = gain_row(1, 2, d(2023, 3, 15), d(2024, 3, 15), 12_500_000, 100_000, 125_050, equity)
+after = gain_row(1, 2, d(2023, 3, 15), d(2024, 3, 16), 12_500_000, 100_000, 99_000, equity)
+print("Gain rows:", before, after, sep="\n")
+assert (before["term"], before["financial_year"], before["holding_days"]) == ('STCG', '2023-24', 366)
+assert (after["term"], after["financial_year"], after["holding_days"]) == ('LTCG', '2023-24', 367)
+assert (float(before["units"]), float(before["cost"]), float(before["gain"])) == (12.5, 1000.0, 250.5)
+assert float(after["gain"]) == -10.0
+
+print("Capital gains term and financial year rules hold at their boundaries")
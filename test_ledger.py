@@ -0,0 +1,91 @@
+from flask import Flask
+from db_config import db
+from models import User, Fund, Investment, InvestmentHistory, RealizedGain
+from services.investments import record_investments, rebuild_ledgers
+import datetime
+import random
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+
+def ledger_state(user_id):
+    """Lot ledger and realized gains as comparable rows (ids left out)."""
+    lots = sorted(
+        (h.fund_id, h.tx_date, h.tx_type, h.units, h.total_cost, h.units_remaining)
+        for h in InvestmentHistory.query.filter_by(user_id=user_id)
+    )
+    gains = sorted(
+        (g.fund_id, g.buy_date, g.sell_date, g.units, g.cost, g.proceeds, g.term)
+        for g in RealizedGain.query.filter_by(user_id=user_id)
+    )
+    return lots, gains
+
+
+def rebuilt_state(user_id, fund_ids):
+    rebuild_ledgers(db.session, [(user_id, fund_id) for fund_id in fund_ids])
+    db.session.flush()
+    return ledger_state(user_id)
+
+
+with app.app_context():
+    db.create_all()
+
+    user = User(name="ledger", email="ledger@example.com")
+    user.set_password("x")
+    funds = [Fund(name=f"Fund {i} Direct Growth", isin=f"INF{i:09d}") for i in range(3)]
+    db.session.add_all([user] + funds)
+    db.session.flush()
+
+    # Buys and partial sells, in date order
+    random.seed(5)
+    rows = []
+    held = {f.id: 0.0 for f in funds}
+    for k in range(120):
+        fund = funds[k % 3]
+        day = datetime.date(2021, 1, 4) + datetime.timedelta(days=9 * k)
+        if held[fund.id] > 0 and random.random() < 0.3:
+            units = round(held[fund.id] * random.uniform(0.2, 0.8), 6)
+            held[fund.id] -= units
+            rows.append(dict(fund_id=fund.id, transaction_type="sell", units=units, amount=round(units * 12, 2), date=day))
+        else:
+            units = round(random.uniform(10, 300), 6)
+            held[fund.id] += units
+            rows.append(dict(fund_id=fund.id, transaction_type="buy", units=units, amount=round(units * 10, 2), date=day))
+
+    def insert(batch):
+        new = [
+            Investment(user_id=user.id, isin=funds[0].isin, nav=10, **row)
+            for row in batch
+        ]
+        db.session.add_all(new)
+        db.session.flush()
+        record_investments(db.session, new)
+        db.session.commit()
+
+    # Tail appends in uneven batches
+    pos = 0
+    while pos < len(rows):
+        size = random.randint(1, 15)
+        insert(rows[pos:pos + size])
+        pos += size
+
+    appended = ledger_state(user.id)
+    assert appended[0] and appended[1]
+    assert appended == rebuilt_state(user.id, [f.id for f in funds])
+    db.session.rollback()
+    print("Tail-appended ledger matches a rebuild:", len(appended[0]), "lots,", len(appended[1]), "gains")
+
+    # A backdated buy and sell land in the middle of two funds' histories
+    insert([
+        dict(fund_id=funds[0].id, transaction_type="buy", units=55.5, amount=600.00, date=datetime.date(2021, 6, 1)),
+        dict(fund_id=funds[1].id, transaction_type="sell", units=5.0, amount=70.00, date=datetime.date(2022, 2, 1)),
+        dict(fund_id=funds[2].id, transaction_type="buy", units=8.0, amount=95.00, date=rows[-1]["date"]),
+    ])
+    backdated = ledger_state(user.id)
+    assert backdated != appended
+    assert backdated == rebuilt_state(user.id, [f.id for f in funds])
+    db.session.rollback()
+    print("Ledger after a backdated insert matches a rebuild")
@@ -0,0 +1,69 @@
+from flask import Flask
+from db_config import db
+from models import Fund, FundNAVHistory
+from valuation_engine import NavResolver, nav_point_on_or_before, NAV_FALLBACK_DAYS
+from money import to_nav_scale
+import datetime
+import nav_store
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+# Resolve from the database only
+nav_store.NAV_STORE_DIR = None
+
+d = datetime.date
+navs = {
+    # Gaps between NAVs: dates in between take the last one before
+    "INF000000001": [(d(2024, 1, 1), "10.5"), (d(2024, 1, 10), "11.25"), (d(2024, 3, 1), "12.00000001")],
+    # First NAV comes after the earliest dates asked for
+    "INF000000002": [(d(2024, 2, 16), "20"), (d(2024, 2, 19), "21")],
+    # No NAVs at all
+    "INF000000003": [],
+}
+
+with app.app_context():
+    db.create_all()
+    funds = {isin: Fund(name=f"Fund {isin}", isin=isin) for isin in navs}
+    db.session.add_all(funds.values())
+    db.session.flush()
+    for isin, rows in navs.items():
+        db.session.add_all(
+            FundNAVHistory(fund_id=funds[isin].id, nav_date=nav_date, nav_value=value, isin=isin, nav_type="growth")
+            for nav_date, value in rows
+        )
+    db.session.commit()
+
+    one, two, three = (funds[isin].id for isin in navs)
+    assert NAV_FALLBACK_DAYS == 15
+    dates = [d(2023, 12, 1), d(2023, 12, 20), d(2024, 1, 1), d(2024, 1, 5), d(2024, 1, 31),
+             d(2024, 2, 1), d(2024, 2, 17), d(2024, 2, 29), d(2024, 6, 30)]
+    resolver = NavResolver([one, two, three, None], dates)
+
+    # Last NAV on or before the date
+    assert resolver.point(one, d(2024, 1, 1)) == (d(2024, 1, 1), to_nav_scale("10.5"))
+    assert resolver.point(one, d(2024, 1, 5)) == (d(2024, 1, 1), to_nav_scale("10.5"))
+    assert resolver.point(one, d(2024, 2, 29)) == (d(2024, 1, 10), to_nav_scale("11.25"))
+    assert resolver.nav(one, d(2024, 6, 30)) == 12.00000001
+    assert resolver.point(two, d(2024, 2, 17)) == (d(2024, 2, 16), to_nav_scale("20"))
+
+    # Else the first NAV within 15 days after; 16 days out is no NAV
+    assert resolver.point(one, d(2023, 12, 20)) == (d(2024, 1, 1), to_nav_scale("10.5"))
+    assert resolver.point(one, d(2023, 12, 1)) is None
+    assert resolver.point(two, d(2024, 2, 1)) == (d(2024, 2, 16), to_nav_scale("20"))
+    assert resolver.point(two, d(2024, 1, 31)) is None
+    assert resolver.scaled_nav(two, d(2024, 1, 31)) is None
+
+    # Funds without NAVs and dates that were not asked for
+    assert all(resolver.point(three, day) is None for day in dates)
+    assert resolver.nav(one, d(2024, 1, 6)) is None
+
+    # Same answers as the single-series rule
+    for isin, rows in navs.items():
+        series = ([nav_date for nav_date, _ in rows], [to_nav_scale(value) for _, value in rows]) if rows else None
+        for day in dates:
+            assert resolver.point(funds[isin].id, day) == nav_point_on_or_before(series, day), (isin, day)
+
+    print("NavResolver:", int(resolver.found.sum()), "of", resolver.found.size, "fund-dates resolved")
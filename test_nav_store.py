@@ -0,0 +1,97 @@
+from flask import Flask
+from db_config import db
+from models import Fund, FundNAVHistory
+from money import to_nav_scale
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import nav_store
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db.init_app(app)
+
+nav_store.NAV_STORE_DIR = tempfile.mkdtemp(prefix="nav_store_test_")
+
+random.seed(3)
+start = datetime.date(2023, 1, 2)
+
+
+def add_navs(fund, days):
+    for k in days:
+        db.session.add(FundNAVHistory(
+            fund_id=fund.id, nav_date=start + datetime.timedelta(days=k),
+            nav_value=f"{random.uniform(10, 90):.8f}", isin=fund.isin, nav_type="growth",
+        ))
+
+
+def expected_series(fund_id):
+    rows = (FundNAVHistory.query.filter_by(fund_id=fund_id)
+            .order_by(FundNAVHistory.nav_date).all())
+    return [r.nav_date.toordinal() for r in rows], [to_nav_scale(r.nav_value) for r in rows]
+
+
+def check_store(fund_ids):
+    """The live store holds exactly FundNAVHistory and nothing is stale."""
+    store = nav_store.open_store()
+    for fund_id in fund_ids:
+        ordinals, navs = store.series(fund_id)
+        assert (list(ordinals), list(navs)) == expected_series(fund_id), fund_id
+    assert nav_store.stale_store_fund_ids(db.session, store) == []
+    return store
+
+
+with app.app_context():
+    db.create_all()
+    funds = [Fund(name=f"Fund {i}", isin=f"INF{i:09d}") for i in range(5)]
+    db.session.add_all(funds)
+    db.session.flush()
+    for k, fund in enumerate(funds[:4]):
+        add_navs(fund, range(k, 400, 1 + k))
+    db.session.commit()
+    ids = [f.id for f in funds]
+
+    # Write, publish and read back
+    assert nav_store.open_store() is None
+    assert nav_store.rebuild_nav_store(db.session) == 4
+    store = check_store(ids[:4])
+    assert store.delta is None and list(store.fund_ids) == ids[:4]
+    assert ids[4] not in store and None not in store
+    until = start + datetime.timedelta(days=100)
+    ordinals, _ = store.series(ids[1], until=until)
+    assert list(ordinals) == expected_series(ids[1])[0][:len(ordinals)] and ordinals[-1] <= until.toordinal()
+    print("Store round trip:", store.generation, store.base.rows, "NAVs")
+
+    # A new NAV, a same-date revision and a fund new to the store are all stale
+    add_navs(funds[0], [400])
+    revised = FundNAVHistory.query.filter_by(fund_id=ids[2]).order_by(FundNAVHistory.nav_date).first()
+    revised.nav_value = revised.nav_value + 1
+    add_navs(funds[4], range(0, 30))
+    db.session.commit()
+    stale = nav_store.stale_store_fund_ids(db.session, store)
+    assert sorted(stale) == [ids[0], ids[2], ids[4]], stale
+    assert nav_store.stale_store_fund_ids(db.session, store, [ids[1], ids[2]]) == [ids[2]]
+
+    # Synced as a delta over the unchanged base
+    nav_store.DELTA_COMPACT_RATIO = 10
+    assert nav_store.sync_nav_store(db.session) == 3
+    store = check_store(ids)
+    assert store.delta is not None and store.base.name == store.generation.split("+")[0]
+    assert nav_store.sync_nav_store(db.session) == 0
+    print("Store after a delta sync:", store.generation)
+
+    # A further change past the ratio folds everything into a new base
+    nav_store.DELTA_COMPACT_RATIO = 0
+    add_navs(funds[3], [401])
+    db.session.commit()
+    assert nav_store.sync_nav_store(db.session) == 1
+    store = check_store(ids)
+    assert store.delta is None
+    files = [f for f in os.listdir(nav_store.NAV_STORE_DIR) if f.endswith(".npy")]
+    assert len(files) == len(nav_store._ARRAYS) and all(store.generation in f for f in files), files
+    print("Store after compaction:", store.generation, store.base.rows, "NAVs")
+
+shutil.rmtree(nav_store.NAV_STORE_DIR)
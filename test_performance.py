@@ -0,0 +1,34 @@
+from performance import calculate_twr_series, trailing_twr
+import datetime
+
+# Modified Dietz on a hand-worked series (investor flows: buys negative)
+snapshots = [
+    (datetime.date(2024, 1, 1), 1000.0),
+    (datetime.date(2024, 1, 31), 1150.0),
+    (datetime.date(2024, 3, 1), 1100.0),
+]
+flows = [
+    (datetime.date(2024, 1, 1), -1000.0),   # already in the first snapshot
+    (datetime.date(2024, 1, 16), -100.0),   # 100 in, half of a 30-day period
+    (datetime.date(2024, 2, 10), 200.0),    # 200 out, 20 of 30 days left
+]
+
+series = calculate_twr_series(snapshots, flows)
+print("TWR series:", series)
+
+r1 = (1150 - 1000 - 100) / (1000 + 100 * 15 / 30)
+r2 = (1100 - 1150 + 200) / (1150 - 200 * 20 / 30)
+assert [p["date"] for p in series] == [d for d, _ in snapshots]
+assert series[0]["index"] == 1.0 and series[0]["period_return"] == 0.0
+assert abs(series[1]["period_return"] - r1) < 1e-12
+assert abs(series[2]["period_return"] - r2) < 1e-12
+assert abs(series[2]["index"] - (1 + r1) * (1 + r2)) < 1e-12
+
+# Snapshot order and the pair form of the flows do not matter
+assert calculate_twr_series(list(reversed(snapshots)), flows) == series
+
+# Trailing windows longer than the history have no value
+trailing = trailing_twr(series)
+print("Trailing TWR:", trailing)
+assert trailing == {"1Y": None, "3Y": None, "5Y": None}
+assert abs(trailing_twr(series, periods=(1,), as_of=datetime.date(2025, 1, 1))["1Y"] - (series[-1]["index"] - 1)) < 1e-12
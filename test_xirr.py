@@ -11,3 +11,38 @@ flows = [
 
 xirr_result = calculate_xirr(flows)
 print("XIRR result:", xirr_result, "%")
+
+# Batch solver must agree with the scalar one
+from utils import calculate_xirr_batch
+
+batch_result = calculate_xirr_batch([flows, flows[:2], []])
+print("Batch XIRR result:", batch_result)
+assert abs(batch_result[0]["xirr"] - xirr_result) < 1e-6
+assert batch_result[0]["converged"]
+assert batch_result[1]["status"] == "no_sign_change"
+
+# Cached solver: hits, warm starts from the previous root, LRU eviction
+from utils import XirrCache
+
+cache = XirrCache(maxsize=2)
+first = cache.solve(flows)
+assert abs(first - xirr_result) < 1e-6
+assert cache.solve(flows) == first
+assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+# A NAV load only moves the terminal inflow: warm-started from the last root
+revalued = flows[:-1] + [(flows[-1][0], 795000.00)]
+warm = cache.solve(revalued)
+assert cache.stats()["warm_starts"] == 1
+assert abs(warm - calculate_xirr(revalued)) < 1e-6, (warm, calculate_xirr(revalued))
+
+# Third distinct series pushes the least recently used one out
+other = [(datetime.date(2023, 1, 2), -1000.00), (datetime.date(2024, 1, 2), 1100.00)]
+cache.solve(other)
+stats = cache.stats()
+print("XIRR cache stats:", stats)
+assert stats["size"] == 2 and stats["evictions"] == 1
+cache.solve(revalued)
+assert cache.stats()["hits"] == 2
+cache.solve(flows)
+assert cache.stats()["misses"] == 4 and cache.stats()["evictions"] == 2
@@ -2,7 +2,11 @@ import datetime
 import requests
 from bs4 import BeautifulSoup
 import re
+import threading
+from collections import OrderedDict, deque
+import numpy as np
 from sqlalchemy import case
+from cashflows import CashFlowSeries
 
 # ===========================
 # Date Normalization
@@ -43,62 +47,52 @@ def format_fund_name(name):
 # XIRR Calculation
 # ===========================
 
-def calculate_xirr(cash_flows, tol=1e-7, max_iter=100):
+def _normalize_cash_flows(cash_flows):
+    """
+    Cash flows as a date-ordered CashFlowSeries. A series is used as is;
+    anything else goes through CashFlowSeries.from_pairs, which skips rows
+    with an unparseable date or amount.
+    """
+    return CashFlowSeries.coerce(cash_flows)
+
+
+def calculate_xirr(cash_flows, tol=1e-7, max_iter=100, guess=None):
     """
     Deterministic XIRR using Newton–Raphson with economic guardrails.
     Returns decimal (e.g. 0.234 for 23.4%).
+    `guess` overrides the CAGR starting point (warm start from a known root).
     """
 
-    import datetime
-
-    # Normalize flows
-    flows = []
-    for dt, amt in cash_flows:
-        if isinstance(dt, datetime.datetime):
-            dt = dt.date()
-        elif isinstance(dt, str):
-            try:
-                dt = datetime.datetime.strptime(dt, "%Y-%m-%d").date()
-            except ValueError:
-                continue
-        if not isinstance(dt, datetime.date):
-            continue
-        try:
-            amt = float(amt)
-        except (TypeError, ValueError):
-            continue
-        flows.append((dt, amt))
+    series = _normalize_cash_flows(cash_flows)
 
-    if not flows or not any(a < 0 for _, a in flows) or not any(a > 0 for _, a in flows):
+    if not series or not series.has_sign_change():
         return 0.0
 
-    flows.sort(key=lambda x: x[0])
-    d0 = flows[0][0]
+    flows = list(zip(series.year_fractions().tolist(), series.amounts.tolist()))
 
     def npv(rate):
         total = 0.0
-        for dt, amt in flows:
-            days = (dt - d0).days
+        for years, amt in flows:
             # guard against invalid base
             if rate <= -0.999999:
                 return float("inf")
-            total += amt / ((1.0 + rate) ** (days / 365.0))
+            total += amt / ((1.0 + rate) ** years)
         return total
 
     def d_npv(rate):
         total = 0.0
-        for dt, amt in flows:
-            days = (dt - d0).days
+        for years, amt in flows:
             if rate <= -0.999999:
                 return 0.0
-            total += -(days/365.0) * amt / ((1.0 + rate) ** ((days/365.0) + 1))
+            total += -years * amt / ((1.0 + rate) ** (years + 1))
         return total
 
     # Initial guess: CAGR of inflows vs outflows
     total_out = sum(-amt for _, amt in flows if amt < 0)
     total_in  = sum(amt for _, amt in flows if amt > 0)
-    years = max((flows[-1][0] - d0).days / 365.0, 1e-6)
-    guess = (total_in / total_out) ** (1.0 / years) - 1.0 if total_out > 0 else 0.1
+    years = max(flows[-1][0], 1e-6)
+    if guess is None:
+        guess = (total_in / total_out) ** (1.0 / years) - 1.0 if total_out > 0 else 0.1
 
     # clamp guess into safe domain
     rate = max(min(guess, 5.0), -0.9)
@@ -132,6 +126,284 @@ def calculate_xirr(cash_flows, tol=1e-7, max_iter=100):
     return float(rate) if not isinstance(rate, complex) else 0.0
 
 
+def _solve_packed_xirr(years, amounts, guesses=None, tol=1e-7, max_iter=100):
+    """
+    Newton–Raphson core shared by the batch and rolling solvers.
+
+    `years` and `amounts` are (series × flows) arrays; every row must contain
+    at least one outflow and one inflow. `guesses` is an optional per-row
+    starting rate where NaN means "use the CAGR guess".
+    Returns (rates, statuses, iterations) arrays.
+    """
+    total_out = -np.where(amounts < 0, amounts, 0.0).sum(axis=1)
+    total_in = np.where(amounts > 0, amounts, 0.0).sum(axis=1)
+    span = np.maximum(years.max(axis=1), 1e-6)
+
+    with np.errstate(all="ignore"):
+        # Initial guess: CAGR of inflows vs outflows, clamped into safe domain
+        guess = (total_in / total_out) ** (1.0 / span) - 1.0
+        if guesses is not None:
+            guess = np.where(np.isnan(guesses), guess, guesses)
+        rate = np.clip(np.nan_to_num(guess, nan=0.1, posinf=5.0, neginf=-0.9), -0.9, 5.0)
+
+        status = np.full(len(amounts), "max_iter", dtype=object)
+        iterations = np.zeros(len(amounts), dtype=int)
+        active = np.ones(len(amounts), dtype=bool)
+
+        for _ in range(max_iter):
+            idx = np.nonzero(active)[0]
+            if idx.size == 0:
+                break
+
+            r = rate[idx]
+            t = years[idx]
+            a = amounts[idx]
+            disc = (1.0 + r[:, None]) ** t
+            f = (a / disc).sum(axis=1)
+            df = (-t * a / (disc * (1.0 + r[:, None]))).sum(axis=1)
+            iterations[idx] += 1
+
+            flat = np.abs(df) < 1e-12
+            new_rate = r - f / df
+            step = new_rate - r
+
+            invalid = ~flat & (~np.isfinite(new_rate) | (new_rate <= -0.999999))
+            done = ~flat & ~invalid & (np.abs(step) < tol)
+            moving = ~flat & ~invalid & ~done
+
+            # cap extreme jumps
+            capped = np.where(np.abs(step) > 1.0, r + np.sign(step), new_rate)
+
+            rate[idx[invalid]] = 0.0
+            rate[idx[done]] = new_rate[done]
+            rate[idx[moving]] = capped[moving]
+
+            status[idx[flat]] = "flat_derivative"
+            status[idx[invalid]] = "diverged"
+            status[idx[done]] = "converged"
+            active[idx[~moving]] = False
+
+    # Economic guardrail: enforce sign consistency
+    net_gain = total_in - total_out
+    rate[(net_gain > 0) & (rate < 0)] = 0.0
+    rate[(net_gain < 0) & (rate > 0)] = 0.0
+
+    return rate, status, iterations
+
+
+def calculate_xirr_batch(cash_flow_series, tol=1e-7, max_iter=100, guesses=None):
+    """
+    Solve XIRR for many cash-flow series in one vectorized Newton–Raphson pass.
+
+    Each series is taken as a CashFlowSeries (see calculate_xirr), then all
+    series are packed into padded (series × flows) NumPy arrays of year fractions and
+    amounts. Every iteration evaluates NPV and its derivative for all
+    still-active series at once; a series drops out as soon as it converges
+    or hits a guardrail. Same initial guess, step cap and sign guardrail as
+    the scalar solver, so results agree within `tol`. `guesses` optionally
+    gives a per-series starting rate (None keeps the CAGR guess).
+
+    Returns one dict per input series, in order:
+        {"xirr": float, "converged": bool, "status": str, "iterations": int}
+    status is one of: converged, max_iter, flat_derivative, diverged,
+    no_sign_change.
+    """
+    normalized = [_normalize_cash_flows(cf) for cf in cash_flow_series]
+
+    results = [
+        {"xirr": 0.0, "converged": False, "status": "no_sign_change", "iterations": 0}
+        for _ in normalized
+    ]
+
+    solvable = [i for i, flows in enumerate(normalized) if flows.has_sign_change()]
+    if not solvable:
+        return results
+
+    # ===== Pack into padded arrays (padding has amount 0 → contributes nothing) =====
+    width = max(len(normalized[i]) for i in solvable)
+    years = np.zeros((len(solvable), width))
+    amounts = np.zeros((len(solvable), width))
+
+    for row, i in enumerate(solvable):
+        flows = normalized[i]
+        years[row, :len(flows)] = flows.year_fractions()
+        amounts[row, :len(flows)] = flows.amounts
+
+    start_guesses = None
+    if guesses is not None:
+        start_guesses = np.array(
+            [np.nan if guesses[i] is None else guesses[i] for i in solvable],
+            dtype=float,
+        )
+
+    rate, status, iterations = _solve_packed_xirr(years, amounts, start_guesses, tol, max_iter)
+
+    for row, i in enumerate(solvable):
+        results[i] = {
+            "xirr": float(rate[row]),
+            "converged": status[row] == "converged",
+            "status": status[row],
+            "iterations": int(iterations[row]),
+        }
+
+    return results
+
+
+def calculate_rolling_xirr(cash_flows, cutoff_values, tol=1e-7, max_iter=100):
+    """
+    XIRR as of every cutoff in one forward walk.
+
+    cash_flows    : investor-side flows (buys negative, sells positive)
+    cutoff_values : (cutoff_date, portfolio_value) pairs; the value is the
+                    terminal inflow at that cutoff
+
+    The CashFlowSeries arrays are used directly. Each cutoff only
+    advances a pointer over the flows dated on or before it and solves on
+    that prefix, warm-started from the previous cutoff's rate.
+    Returns {cutoff_date: xirr}; cutoffs with no outflow yet or no value
+    are omitted.
+    """
+    flows = _normalize_cash_flows(cash_flows)
+    if not flows:
+        return {}
+
+    ordinals = flows.ordinals.astype(float)
+    amounts = flows.amounts
+    outflows_seen = np.cumsum(amounts < 0)
+
+    results = {}
+    pos = 0
+    prev_rate = np.nan
+
+    for cutoff, value in sorted(cutoff_values, key=lambda x: x[0]):
+        cutoff_ord = cutoff.toordinal()
+        while pos < len(flows) and ordinals[pos] <= cutoff_ord:
+            pos += 1
+
+        if pos == 0 or not value or value <= 0 or outflows_seen[pos - 1] == 0:
+            continue
+
+        years = (np.append(ordinals[:pos], cutoff_ord) - ordinals[0]) / 365.0
+        window = np.append(amounts[:pos], float(value))
+
+        rate, status, _ = _solve_packed_xirr(
+            years[None, :], window[None, :], np.array([prev_rate]), tol, max_iter
+        )
+        if status[0] != "converged" and not np.isnan(prev_rate):
+            # warm start led astray → fall back to the cold CAGR guess
+            rate, status, _ = _solve_packed_xirr(
+                years[None, :], window[None, :], None, tol, max_iter
+            )
+        results[cutoff] = float(rate[0])
+        if status[0] == "converged":
+            prev_rate = rate[0]
+
+    return results
+
+
+
+# ===========================
+# XIRR Cache
+# ===========================
+
+class XirrCache:
+    """
+    Thread-safe LRU memo of XIRR results keyed by
+    CashFlowSeries.fingerprint().
+
+    A fund's flows only change on upload or NAV load, and a NAV load only
+    moves the terminal "current value" inflow. So besides the exact key we
+    remember the last root per series-without-its-terminal-flow; a miss on
+    that prefix warm-starts Newton from the previous root.
+    """
+
+    def __init__(self, maxsize=4096, tol=1e-7, max_iter=100):
+        self.maxsize = maxsize
+        self.tol = tol
+        self.max_iter = max_iter
+        self._results = OrderedDict()
+        self._roots_by_prefix = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.warm_starts = 0
+        self.evictions = 0
+
+    def _remember(self, store, key, value):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.maxsize:
+            store.popitem(last=False)
+            if store is self._results:
+                self.evictions += 1
+
+    def solve_batch(self, cash_flow_series):
+        """Cached calculate_xirr_batch: only misses are sent to the solver."""
+        normalized = [_normalize_cash_flows(cf) for cf in cash_flow_series]
+        keys = [flows.fingerprint() for flows in normalized]
+        prefixes = [flows[:-1].fingerprint() if flows else None for flows in normalized]
+
+        results = [None] * len(normalized)
+        pending = []
+        guesses = []
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                cached = self._results.get(key)
+                if cached is not None:
+                    self._results.move_to_end(key)
+                    self.hits += 1
+                    results[i] = dict(cached)
+                    continue
+                self.misses += 1
+                guess = self._roots_by_prefix.get(prefixes[i])
+                if guess is not None:
+                    self.warm_starts += 1
+                pending.append(i)
+                guesses.append(guess)
+
+        if pending:
+            solved = calculate_xirr_batch(
+                [normalized[i] for i in pending],
+                tol=self.tol,
+                max_iter=self.max_iter,
+                guesses=guesses,
+            )
+            with self._lock:
+                for i, res in zip(pending, solved):
+                    self._remember(self._results, keys[i], res)
+                    if res["converged"]:
+                        self._remember(self._roots_by_prefix, prefixes[i], res["xirr"])
+                    results[i] = dict(res)
+
+        return results
+
+    def solve(self, cash_flows):
+        """Cached drop-in for calculate_xirr()."""
+        return self.solve_batch([cash_flows])[0]["xirr"]
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._roots_by_prefix.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._results),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "warm_starts": self.warm_starts,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Process-wide cache shared by all request threads
+xirr_cache = XirrCache()
+
 
 # ===========================
 # Portfolio Holdings Calculator
@@ -139,6 +411,10 @@ def calculate_xirr(cash_flows, tol=1e-7, max_iter=100):
 
 from models import Investment, Fund, FundNAVHistory
 from sqlalchemy import func
+from money import (
+    PAISE, round_div, to_nav_scale, value_in_paise, paise_to_rupees,
+    micro_units_to_units, to_fixed_point_txns,
+)
 
 def get_portfolio_holdings(db, user_id):
     """
@@ -148,12 +424,16 @@ def get_portfolio_holdings(db, user_id):
     - market_value
     - percentage of portfolio
     Returns a list of dicts.
+
+    One statement: the net-units aggregate joined to the latest NAV date per
+    ISIN (max-date join, so it runs on SQLite and on MySQL without window
+    functions) and to Fund for the name.
     """
 
-    # Step 1: aggregate net units per ISIN
-    holdings = (
+    # Net units per ISIN
+    net = (
         db.session.query(
-            Investment.isin,
+            Investment.isin.label('isin'),
             func.sum(
                 case(
                     (Investment.transaction_type.ilike('buy'), Investment.units),
@@ -161,39 +441,50 @@ def get_portfolio_holdings(db, user_id):
                 )
             ).label('net_units')
         )
-        .filter(Investment.user_id == user_id)
+        .filter(Investment.user_id == user_id, Investment.isin.isnot(None), Investment.isin != '')
         .group_by(Investment.isin)
-        .all()
+        .subquery()
     )
 
-    results = []
-    portfolio_total = 0
-
-    # Step 2: fetch latest NAV for each ISIN
-    for isin, net_units in holdings:
-        if not isin or not net_units or net_units <= 0:
-            continue
+    # Latest NAV date per held ISIN
+    latest = (
+        db.session.query(
+            FundNAVHistory.isin.label('isin'),
+            func.max(FundNAVHistory.nav_date).label('nav_date')
+        )
+        .filter(FundNAVHistory.isin.in_(db.session.query(net.c.isin)))
+        .group_by(FundNAVHistory.isin)
+        .subquery()
+    )
 
-        latest_nav_lookup = (
-            db.session.query(FundNAVHistory.nav_value, FundNAVHistory.nav_date)
-            .filter(FundNAVHistory.isin == isin)
-            .order_by(FundNAVHistory.nav_date.desc())
-            .first()
+    rows = (
+        db.session.query(
+            net.c.isin,
+            net.c.net_units,
+            func.max(FundNAVHistory.nav_value),
+            latest.c.nav_date,
+            func.max(Fund.name),
         )
+        .join(latest, latest.c.isin == net.c.isin)
+        .join(FundNAVHistory, (FundNAVHistory.isin == latest.c.isin)
+                              & (FundNAVHistory.nav_date == latest.c.nav_date))
+        .outerjoin(Fund, Fund.isin == net.c.isin)
+        .filter(net.c.net_units > 0)
+        .group_by(net.c.isin, net.c.net_units, latest.c.nav_date)
+        .order_by(net.c.isin)
+        .all()
+    )
 
-        if not latest_nav_lookup:
-            continue
+    results = []
+    portfolio_total = 0
 
-        latest_nav, nav_date = latest_nav_lookup
+    for isin, net_units, latest_nav, nav_date, fund_name in rows:
         market_value = float(net_units) * float(latest_nav)
         portfolio_total += market_value
 
-        fund = Fund.query.filter_by(isin=isin).first()
-        fund_name = fund.name if fund else isin
-
         results.append({
             "isin": isin,
-            "fund_name": fund_name,
+            "fund_name": fund_name or isin,
             "net_units": float(net_units),
             "latest_nav": float(latest_nav),
             "nav_date": nav_date,
@@ -201,7 +492,7 @@ def get_portfolio_holdings(db, user_id):
             "pct_of_portfolio": 0.0  # placeholder, fill after total known
         })
 
-    # Step 3: compute percentages
+    # Compute percentages
     if portfolio_total > 0:
         for r in results:
             r["pct_of_portfolio"] = round((r["market_value"] / portfolio_total) * 100, 2)
@@ -210,79 +501,133 @@ def get_portfolio_holdings(db, user_id):
 
 # ======== FIFO returns plus XIRR=============
 
-def calculate_fifo_returns(transactions, latest_nav, today=None):
-    import datetime
+class FifoLot:
+    """
+    One open buy lot in fixed point (micro-units, paise). Remaining cost is
+    derived from the original cost pro rata, so a partial sell only
+    decrements units and never rescales cost.
+    """
+    __slots__ = ("date", "units", "orig_units", "orig_cost")
+
+    def __init__(self, date, units, cost):
+        self.date = date
+        self.units = units
+        self.orig_units = units
+        self.orig_cost = cost
+
+    @property
+    def cost(self):
+        # Lots without positive units are never matched; keep their cost as-is
+        if self.orig_units <= 0 or self.units == self.orig_units:
+            return self.orig_cost
+        return round_div(self.orig_cost * self.units, self.orig_units)
+
+    def as_dict(self):
+        return {
+            "date": self.date,
+            "units": micro_units_to_units(self.units),
+            "cost": paise_to_rupees(self.cost),
+        }
+
+
+def calculate_fifo_returns(transactions, latest_nav, today=None, with_xirr=True):
+    """
+    FIFO-match sells against buys and value what is left at latest_nav.
+
+    Matching and valuation run on exact integers (see money.py): rows are
+    converted to FixedPointTxn once, or passed in pre-converted by callers
+    that replay the same history repeatedly. Open lots live in a deque of
+    FifoLot records, so consuming the oldest lot is O(1). Rupee/unit floats
+    are only produced for the result dict; the *_paise keys carry the exact
+    totals for callers that aggregate across funds. "cash_flows" is a
+    CashFlowSeries built straight from the fixed-point rows.
+
+    Pass with_xirr=False when the caller solves XIRR itself (e.g. in one
+    calculate_xirr_batch call across funds); "xirr" is then None.
+    """
     if today is None:
         today = datetime.date.today()
 
-    txns = sorted(transactions, key=lambda t: t.date)
+    txns = sorted(to_fixed_point_txns(transactions), key=lambda t: t.date)
 
-    buy_lots = []
-    cash_flows = []
+    buy_lots = deque()
+    flow_days = []
+    flow_amounts = []
+    add_lot = buy_lots.append
+    consume_lot = buy_lots.popleft
+    add_day = flow_days.append
+    add_amount = flow_amounts.append
 
     for t in txns:
-        if t.transaction_type.lower() == 'buy':
-            buy_lots.append({
-                'date': t.date.date() if isinstance(t.date, datetime.datetime) else t.date,
-                'units': float(t.units or 0),
-                'cost': float(t.amount or 0)
-            })
-            cash_flows.append((t.date, -float(t.amount or 0)))
-
-        elif t.transaction_type.lower() == 'sell':
-            units_to_sell = abs(float(t.units or 0))  # ✅ normalize units
-            cash_flows.append((t.date, abs(float(t.amount or 0))))  # ✅ treat amount as inflow
+        if t.transaction_type == 'buy':
+            txn_date = t.date
+            add_lot(FifoLot(
+                txn_date.date() if isinstance(txn_date, datetime.datetime) else txn_date,
+                t.units,
+                t.amount,
+            ))
+            add_day(txn_date.toordinal())
+            add_amount(-t.amount / PAISE)
+
+        elif t.transaction_type == 'sell':
+            units_to_sell = abs(t.units)  # ✅ normalize units
+            add_day(t.date.toordinal())
+            add_amount(abs(t.amount) / PAISE)  # ✅ treat amount as inflow
 
             while units_to_sell > 0 and buy_lots:
                 lot = buy_lots[0]
-                if lot['units'] <= 0:
-                    buy_lots.pop(0)
+                lot_units = lot.units
+                if lot_units <= 0:
+                    consume_lot()
                     continue
 
-                matched_units = min(lot['units'], units_to_sell)
-                proportion = matched_units / lot['units']
-                lot['cost'] -= lot['cost'] * proportion
-                lot['units'] -= matched_units
-                units_to_sell -= matched_units
+                if lot_units <= units_to_sell:
+                    units_to_sell -= lot_units
+                    consume_lot()
+                    continue
 
-                if lot['units'] <= 1e-9:
-                    buy_lots.pop(0)
+                lot.units = lot_units - units_to_sell
+                units_to_sell = 0
 
-    remaining_units = sum(lot['units'] for lot in buy_lots)
-    remaining_cost = sum(lot['cost'] for lot in buy_lots)
+    remaining_units = 0
+    remaining_cost = 0
 
     # ===== Cost‑Weighted Holding Period (years) =====
-    weighted_days_sum = 0.0
-    total_cost = 0.0
+    weighted_days_sum = 0
+    total_cost = 0
 
     for lot in buy_lots:
-        if lot["cost"] > 0:
-            days_held = (today - lot["date"]).days
-            weighted_days_sum += days_held * float(lot["cost"])
-            total_cost += float(lot["cost"])
+        lot_cost = lot.cost
+        remaining_units += lot.units
+        remaining_cost += lot_cost
+        if lot_cost > 0:
+            weighted_days_sum += (today - lot.date).days * lot_cost
+            total_cost += lot_cost
 
     holding_period_years = (weighted_days_sum / total_cost / 365.0) if total_cost > 0 else 0.0
 
-    current_value = float(remaining_units) * float(latest_nav or 0)
+    current_value_paise = value_in_paise(remaining_units, to_nav_scale(latest_nav or 0))
+    current_value = paise_to_rupees(current_value_paise)
     if current_value > 0:
-        cash_flows.append((today, current_value))
-
-    # Debug print
-    #print(">>> DEBUG CASH FLOWS FEED to XIRR")
-    #for dt, amt in sorted(cash_flows, key=lambda x: x[0]):
-    #    print(f"   {dt}  {amt:+,.2f}")
+        add_day(today.toordinal())
+        add_amount(current_value)
+    cash_flows = CashFlowSeries(flow_days, flow_amounts)
 
-    absolute_return = current_value - remaining_cost
-    xirr_val = calculate_xirr(cash_flows) if cash_flows else 0.0
+    absolute_return = current_value - paise_to_rupees(remaining_cost)
+    if not with_xirr:
+        xirr_val = None
+    else:
+        xirr_val = calculate_xirr(cash_flows) if cash_flows else 0.0
 
     return {
-        "remaining_units": remaining_units,
-        "cost_value": remaining_cost,
+        "remaining_units": micro_units_to_units(remaining_units),
+        "cost_value": paise_to_rupees(remaining_cost),
         "current_value": current_value,
         "absolute_return": absolute_return,
         "xirr": xirr_val,
-        "cash_flows": cash_flows,     
-        "remaining_lots": buy_lots,
-        "holding_period": holding_period_years    
+        "cash_flows": cash_flows,
+        "remaining_lots": [lot.as_dict() for lot in buy_lots],
+        "holding_period": holding_period_years,
+        "cost_value_paise": remaining_cost,
+        "current_value_paise": current_value_paise,
     }
-
@@ -0,0 +1,489 @@
+# valuation_engine.py
+#
+# Sweep-line portfolio valuation: load a set of users' transactions and the
+# NAV series of the funds they hold once, then walk the cutoff dates in order
+# while carrying FIFO state forward, instead of replaying every fund from
+# scratch at every cutoff.
+
+import datetime
+import threading
+from bisect import bisect_right
+from collections import deque, OrderedDict
+
+import numpy as np
+from sqlalchemy import func
+
+from db_config import db
+from models import Investment, Fund, FundNAVHistory
+from money import (
+    NAV_SCALE, to_fixed_point_txns, to_nav_scale, value_in_paise, paise_to_rupees, micro_units_to_units,
+)
+from utils import FifoLot, xirr_cache
+from cashflows import CashFlowSeries
+from nav_store import store_series
+from services.latest_navs import latest_nav_cache
+
+# A fund with no NAV on or before a cutoff may use the first NAV up to this
+# many days after it (the rule NavResolver applies everywhere).
+NAV_FALLBACK_DAYS = 15
+
+
+# ---------------------------------------------------------
+# Incremental FIFO state for one fund
+# ---------------------------------------------------------
+class FifoBook:
+    """
+    Open lots for one fund plus running unit/cost totals, so the holding can
+    be read after every applied transaction without re-summing the deque.
+    Matching is the same as utils.calculate_fifo_returns.
+    """
+    __slots__ = ("lots", "units", "cost")
+
+    def __init__(self):
+        self.lots = deque()
+        self.units = 0   # micro-units
+        self.cost = 0    # paise
+
+    def apply(self, txn):
+        if txn.transaction_type == "buy":
+            txn_date = txn.date
+            if isinstance(txn_date, datetime.datetime):
+                txn_date = txn_date.date()
+            self.lots.append(FifoLot(txn_date, txn.units, txn.amount))
+            self.units += txn.units
+            self.cost += txn.amount
+
+        elif txn.transaction_type == "sell":
+            units_to_sell = abs(txn.units)
+            lots = self.lots
+
+            while units_to_sell > 0 and lots:
+                lot = lots[0]
+                lot_units = lot.units
+                if lot_units <= 0:
+                    self.units -= lot_units
+                    self.cost -= lot.cost
+                    lots.popleft()
+                    continue
+
+                if lot_units <= units_to_sell:
+                    units_to_sell -= lot_units
+                    self.units -= lot_units
+                    self.cost -= lot.cost
+                    lots.popleft()
+                    continue
+
+                old_cost = lot.cost
+                lot.units = lot_units - units_to_sell
+                self.units -= units_to_sell
+                self.cost += lot.cost - old_cost
+                units_to_sell = 0
+
+
+# ---------------------------------------------------------
+# Loading (one query each for transactions and NAVs)
+# ---------------------------------------------------------
+def load_fund_transactions(user_ids):
+    """{fund_id: [FixedPointTxn, ...]} in date order for all given users."""
+    rows = (
+        Investment.query
+        .filter(Investment.user_id.in_(user_ids))
+        .order_by(Investment.date, Investment.id)
+        .all()
+    )
+
+    txns_by_fund = {}
+    for t in to_fixed_point_txns(rows):
+        txns_by_fund.setdefault(t.fund_id, []).append(t)
+    return txns_by_fund
+
+
+def load_nav_series(fund_ids, until=None):
+    """
+    {fund_id: ([nav_date, ...], [scaled_nav, ...])} sorted by date, from the
+    NAV store for the funds it holds and one query for the rest.
+    """
+    if not fund_ids:
+        return {}
+
+    stored, missing = store_series(fund_ids, until=until)
+    series = {
+        fund_id: ([datetime.date.fromordinal(o) for o in ordinals.tolist()], navs.tolist())
+        for fund_id, (ordinals, navs) in stored.items()
+    }
+    if not missing:
+        return series
+
+    query = (
+        db.session.query(FundNAVHistory.fund_id, FundNAVHistory.nav_date, FundNAVHistory.nav_value)
+        .filter(FundNAVHistory.fund_id.in_(missing))
+    )
+    if until is not None:
+        query = query.filter(FundNAVHistory.nav_date <= until)
+
+    for fund_id, nav_date, nav_value in query.order_by(FundNAVHistory.fund_id, FundNAVHistory.nav_date):
+        if nav_value is None:
+            continue
+        dates, navs = series.setdefault(fund_id, ([], []))
+        dates.append(nav_date)
+        navs.append(to_nav_scale(nav_value))
+    return series
+
+
+def nav_point_on_or_before(nav_series, cutoff, fallback_days=NAV_FALLBACK_DAYS):
+    """(nav_date, scaled_nav) for a cutoff from a loaded series, or None."""
+    if not nav_series:
+        return None
+    dates, navs = nav_series
+    pos = bisect_right(dates, cutoff)
+    if pos:
+        return dates[pos - 1], navs[pos - 1]
+    if dates[0] <= cutoff + datetime.timedelta(days=fallback_days):
+        return dates[0], navs[0]
+    return None
+
+
+def nav_on_or_before(nav_series, cutoff, fallback_days=NAV_FALLBACK_DAYS):
+    """Scaled NAV for a cutoff from a loaded series, or None."""
+    point = nav_point_on_or_before(nav_series, cutoff, fallback_days)
+    return point[1] if point else None
+
+
+class NavResolver:
+    """
+    As-of NAVs for a set of funds on a set of dates, from one query.
+
+    Funds in the NAV store are read from it; for the rest only the NAV rows
+    that can matter are loaded: per fund, from its last NAV on or before the
+    first date up to NAV_FALLBACK_DAYS after the last date. One searchsorted
+    per fund then resolves every date with the same rule as
+    nav_point_on_or_before (last NAV on or before the date, else the first
+    within the fallback window after it).
+
+    scaled[i, j]   : NAV × NAV_SCALE of fund_ids[i] on dates[j] (0 if none)
+    nav_dates[i, j]: ordinal of the NAV date used (0 if none)
+    found[i, j]    : whether a NAV was resolved
+    """
+
+    def __init__(self, fund_ids, dates, fallback_days=NAV_FALLBACK_DAYS):
+        self.fund_ids = sorted({f for f in fund_ids if f is not None})
+        self.dates = sorted(set(dates))
+        self.fallback_days = fallback_days
+        self._row = {fund_id: i for i, fund_id in enumerate(self.fund_ids)}
+        self._col = {d: j for j, d in enumerate(self.dates)}
+
+        shape = (len(self.fund_ids), len(self.dates))
+        self.scaled = np.zeros(shape, dtype=np.int64)
+        self.nav_dates = np.zeros(shape, dtype=np.int64)
+        self.found = np.zeros(shape, dtype=bool)
+        if self.fund_ids and self.dates:
+            self._resolve(self._load())
+
+    def _load(self):
+        """{fund_id: (ordinals, scaled_navs)} in date order: the NAV store, then one query."""
+        first, last = self.dates[0], self.dates[-1] + datetime.timedelta(days=self.fallback_days)
+        series, missing = store_series(self.fund_ids, until=last)
+        if not missing:
+            return series
+
+        start = (
+            db.session.query(FundNAVHistory.fund_id, func.max(FundNAVHistory.nav_date).label("nav_date"))
+            .filter(FundNAVHistory.fund_id.in_(missing), FundNAVHistory.nav_date <= first)
+            .group_by(FundNAVHistory.fund_id)
+            .subquery()
+        )
+        query = (
+            db.session.query(FundNAVHistory.fund_id, FundNAVHistory.nav_date, FundNAVHistory.nav_value)
+            .outerjoin(start, start.c.fund_id == FundNAVHistory.fund_id)
+            .filter(
+                FundNAVHistory.fund_id.in_(missing),
+                FundNAVHistory.nav_date <= last,
+                (start.c.nav_date.is_(None) & (FundNAVHistory.nav_date > first))
+                | (FundNAVHistory.nav_date >= start.c.nav_date),
+            )
+            .order_by(FundNAVHistory.fund_id, FundNAVHistory.nav_date)
+        )
+
+        for fund_id, nav_date, nav_value in query:
+            if nav_value is None:
+                continue
+            ordinals, navs = series.setdefault(fund_id, ([], []))
+            ordinals.append(nav_date.toordinal())
+            navs.append(to_nav_scale(nav_value))
+        return series
+
+    def _resolve(self, series):
+        targets = np.array([d.toordinal() for d in self.dates], dtype=np.int64)
+        for fund_id, (ordinals, navs) in series.items():
+            i = self._row[fund_id]
+            ordinals = np.asarray(ordinals, dtype=np.int64)
+            navs = np.asarray(navs, dtype=np.int64)
+
+            pos = np.searchsorted(ordinals, targets, side="right") - 1
+            before = pos >= 0
+            found = before | (ordinals[0] <= targets + self.fallback_days)
+            pos = np.where(before, pos, 0)
+
+            self.scaled[i] = np.where(found, navs[pos], 0)
+            self.nav_dates[i] = np.where(found, ordinals[pos], 0)
+            self.found[i] = found
+
+    def point(self, fund_id, d):
+        """(nav_date, scaled_nav) like nav_point_on_or_before, or None."""
+        i, j = self._row.get(fund_id), self._col.get(d)
+        if i is None or j is None or not self.found[i, j]:
+            return None
+        return datetime.date.fromordinal(int(self.nav_dates[i, j])), int(self.scaled[i, j])
+
+    def scaled_nav(self, fund_id, d):
+        """NAV × NAV_SCALE, or None."""
+        point = self.point(fund_id, d)
+        return point[1] if point else None
+
+    def nav(self, fund_id, d):
+        """NAV in rupees as a float, or None."""
+        scaled = self.scaled_nav(fund_id, d)
+        return scaled / NAV_SCALE if scaled is not None else None
+
+    def matrix(self, fund_ids=None, dates=None):
+        """(funds × dates) NAVs in rupees, 0.0 where none, in the given order."""
+        fund_ids = self.fund_ids if fund_ids is None else list(fund_ids)
+        dates = self.dates if dates is None else list(dates)
+        out = np.zeros((len(fund_ids), len(dates)))
+        rows = [(k, self._row[f]) for k, f in enumerate(fund_ids) if f in self._row]
+        cols = [(k, self._col[d]) for k, d in enumerate(dates) if d in self._col]
+        if rows and cols:
+            out_rows, in_rows = zip(*rows)
+            out_cols, in_cols = zip(*cols)
+            out[np.ix_(out_rows, out_cols)] = self.scaled[np.ix_(in_rows, in_cols)] / NAV_SCALE
+        return out
+
+
+# ---------------------------------------------------------
+# Sweep
+# ---------------------------------------------------------
+def value_at_cutoffs(txns_by_fund, navs, cutoffs):
+    """
+    Portfolio value and remaining cost at every cutoff in one forward pass.
+
+    Each fund keeps a transaction pointer and a FifoBook; advancing to the
+    next cutoff applies only the transactions dated in between. NAVs come
+    from a NavResolver over the cutoffs (last value on or before the cutoff,
+    else the first within NAV_FALLBACK_DAYS after it); funds with no NAV are
+    left out of that cutoff, like the per-cutoff generators did.
+
+    Returns a list of {"date", "value", "cost", "value_paise", "cost_paise"}
+    dicts in cutoff order.
+    """
+    cutoffs = sorted(cutoffs)
+    books = {fund_id: FifoBook() for fund_id in txns_by_fund}
+    positions = dict.fromkeys(txns_by_fund, 0)
+
+    results = []
+    for cutoff in cutoffs:
+        value_paise = 0
+        cost_paise = 0
+
+        for fund_id, txns in txns_by_fund.items():
+            pos = positions[fund_id]
+            book = books[fund_id]
+            while pos < len(txns) and txns[pos].date <= cutoff:
+                book.apply(txns[pos])
+                pos += 1
+            positions[fund_id] = pos
+
+            if pos == 0:
+                continue  # nothing invested yet
+
+            scaled_nav = navs.scaled_nav(fund_id, cutoff)
+            if scaled_nav is None:
+                continue
+
+            value_paise += value_in_paise(book.units, scaled_nav)
+            cost_paise += book.cost
+
+        results.append({
+            "date": cutoff,
+            "value": paise_to_rupees(value_paise),
+            "cost": paise_to_rupees(cost_paise),
+            "value_paise": value_paise,
+            "cost_paise": cost_paise,
+        })
+
+    return results
+
+
+def value_portfolio_at_cutoffs(user_ids, cutoffs):
+    """Load once and sweep: the entry point for the snapshot generators."""
+    if not user_ids or not cutoffs:
+        return []
+
+    txns_by_fund = load_fund_transactions(user_ids)
+    if not txns_by_fund:
+        return []
+
+    navs = NavResolver(txns_by_fund.keys(), cutoffs)
+    return value_at_cutoffs(txns_by_fund, navs, cutoffs)
+
+
+# ---------------------------------------------------------
+# Point-in-time holdings (any date, cached by data version)
+# ---------------------------------------------------------
+def holdings_as_of(txns_by_fund, navs, as_of):
+    """
+    FIFO holdings of every fund on `as_of` plus the cash flows behind them,
+    valued with a NavResolver that covers as_of.
+
+    Returns {fund_id: {"units", "cost_paise", "value_paise", "nav_date",
+    "scaled_nav", "cash_flows"}}; cash_flows ends with the holding's value
+    on as_of as a terminal inflow. Funds with no transactions by as_of are
+    left out; funds with no NAV are valued at 0 with nav_date None.
+    """
+    holdings = {}
+    for fund_id, txns in txns_by_fund.items():
+        book = FifoBook()
+        ordinals = []
+        amounts = []
+        for txn in txns:
+            if txn.date > as_of:
+                break
+            book.apply(txn)
+            txn_date = txn.date.date() if isinstance(txn.date, datetime.datetime) else txn.date
+            if txn.transaction_type == "buy":
+                ordinals.append(txn_date.toordinal())
+                amounts.append(-abs(paise_to_rupees(txn.amount)))
+            elif txn.transaction_type == "sell":
+                ordinals.append(txn_date.toordinal())
+                amounts.append(abs(paise_to_rupees(txn.amount)))
+        if not ordinals:
+            continue
+
+        point = navs.point(fund_id, as_of)
+        nav_date, scaled_nav = point if point else (None, 0)
+        value_paise = value_in_paise(book.units, scaled_nav) if book.units > 0 else 0
+
+        flows = CashFlowSeries(ordinals, amounts, presorted=True)
+        if value_paise:
+            flows = flows.with_flow(as_of, paise_to_rupees(value_paise))
+
+        holdings[fund_id] = {
+            "units": book.units,
+            "cost_paise": book.cost,
+            "value_paise": value_paise,
+            "nav_date": nav_date,
+            "scaled_nav": scaled_nav,
+            "cash_flows": flows,
+        }
+    return holdings
+
+
+def data_version(user_ids):
+    """
+    Cheap fingerprint of what a valuation reads, from values the write paths
+    already maintain: the users' transactions (count, last id, last update)
+    in one aggregate, the latest NAV date of their funds (Fund.latest_nav_date)
+    from the same query, and latest_nav_cache's version, which every NAV
+    write path in this process bumps (revisions included) and which moves
+    once max_age has passed, so NAVs revised by another process (the
+    scheduler, get_nav.py, bulk_nav_update.py) show within max_age.
+    """
+    txn_version = (
+        db.session.query(func.count(Investment.id), func.max(Investment.id),
+                         func.max(Investment.updated_at), func.max(Fund.latest_nav_date))
+        .outerjoin(Fund, Fund.id == Investment.fund_id)
+        .filter(Investment.user_id.in_(user_ids))
+        .one()
+    )
+    return (*(str(v) for v in txn_version), latest_nav_cache.version)
+
+
+class ValuationCache:
+    """Thread-safe LRU of point-in-time valuations keyed by (users, date, data version)."""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+# Process-wide cache shared by all request threads
+valuation_cache = ValuationCache()
+
+
+def value_portfolio_as_of(user_ids, as_of):
+    """
+    Holdings, units, cost, value and XIRR for the given users on any date,
+    from one transaction fetch, one NAV fetch and one batched XIRR solve.
+    Results are cached per (users, date, data version).
+
+    Returns {"date", "holdings": [...], "total": {...}} with rupee floats.
+    """
+    user_ids = sorted(set(user_ids))
+    key = (tuple(user_ids), as_of, data_version(user_ids))
+    cached = valuation_cache.get(key)
+    if cached is not None:
+        return cached
+
+    txns_by_fund = load_fund_transactions(user_ids)
+    navs = NavResolver(txns_by_fund.keys(), [as_of])
+    holdings = holdings_as_of(txns_by_fund, navs, as_of)
+
+    fund_ids = list(holdings)
+    total_flows = CashFlowSeries.concat([holdings[f]["cash_flows"] for f in fund_ids]).merge_by_date()
+    xirrs = xirr_cache.solve_batch([holdings[f]["cash_flows"] for f in fund_ids] + [total_flows])
+
+    funds = {f.id: f for f in Fund.query.filter(Fund.id.in_(fund_ids)).all()} if fund_ids else {}
+
+    rows = []
+    for fund_id, res in zip(fund_ids, xirrs):
+        h = holdings[fund_id]
+        if h["units"] <= 0:
+            continue
+        fund = funds.get(fund_id)
+        rows.append({
+            "fund_id": fund_id,
+            "fund_name": fund.name if fund else None,
+            "isin": fund.isin if fund else None,
+            "units": micro_units_to_units(h["units"]),
+            "nav": h["scaled_nav"] / NAV_SCALE if h["nav_date"] else None,
+            "nav_date": h["nav_date"].strftime("%Y-%m-%d") if h["nav_date"] else None,
+            "cost": paise_to_rupees(h["cost_paise"]),
+            "value": paise_to_rupees(h["value_paise"]),
+            "xirr": res["xirr"],
+        })
+    rows.sort(key=lambda r: r["value"], reverse=True)
+
+    result = {
+        "date": as_of.strftime("%Y-%m-%d"),
+        "holdings": rows,
+        "total": {
+            "cost": paise_to_rupees(sum(h["cost_paise"] for h in holdings.values() if h["units"] > 0)),
+            "value": paise_to_rupees(sum(h["value_paise"] for h in holdings.values())),
+            "xirr": xirrs[-1]["xirr"] if total_flows else None,
+        },
+    }
+    valuation_cache.put(key, result)
+    return result